@@ -8,6 +8,7 @@ Database Configuration
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
@@ -51,6 +52,27 @@ engine = create_engine(
 # Создание фабрики сессий
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронное подключение (asyncpg) для нагруженных маршрутов
+ASYNC_SQLALCHEMY_DATABASE_URL = (
+    f"postgresql+asyncpg://{user_enc}:{password_enc}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+)
+
+# asyncpg не понимает sslmode в URL — передаем режим через connect_args
+async_connect_args = {"ssl": POSTGRES_SSLMODE} if POSTGRES_SSLMODE else {}
+
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    pool_size=int(os.getenv("DB_ASYNC_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True,
+    echo=False,
+    connect_args=async_connect_args,
+)
+
+# Фабрика асинхронных сессий; объекты не истекают после commit,
+# чтобы их можно было сериализовать без дополнительных запросов
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # Базовый класс для SQLAlchemy моделей
 Base = declarative_base()
 
@@ -69,4 +91,15 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    """
+    Генератор асинхронной сессии базы данных для использования с FastAPI Depends().
+    
+    Yields:
+        AsyncSession: Асинхронная сессия базы данных SQLAlchemy.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Schema Upgrades
+---------------
+Идемпотентные DDL-изменения для уже существующих таблиц.
+
+Base.metadata.create_all создает только отсутствующие таблицы (вместе с их индексами),
+поэтому новые индексы и колонки для существующих таблиц добавляются здесь.
+Каждое выражение должно быть безопасно для повторного выполнения (IF [NOT] EXISTS).
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("schema_upgrades")
+
+UPGRADE_STATEMENTS = [
+    # Keyset-пагинация
+    "CREATE INDEX IF NOT EXISTS ix_user_actions_product_created_id ON user_actions (product_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_user_actions_user_created_id ON user_actions (user_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_active_created_id ON products (is_active, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_sensor_readings_device_created_id ON sensor_readings (device_id, created_at DESC, id DESC)",
+    "DROP INDEX IF EXISTS ix_sensor_readings_device_created",
+    # Медиафайлы во внешнем объектном хранилище
+    "ALTER TABLE product_media ADD COLUMN IF NOT EXISTS storage_backend VARCHAR(20) NOT NULL DEFAULT 'db'",
+    "ALTER TABLE product_media ALTER COLUMN content DROP NOT NULL",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS storage_backend VARCHAR(20) NOT NULL DEFAULT 'db'",
+    "ALTER TABLE staged_uploads ALTER COLUMN content DROP NOT NULL",
+    # ETag и размер содержимого медиа
+    "ALTER TABLE product_media ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64)",
+    "ALTER TABLE product_media ADD COLUMN IF NOT EXISTS content_size BIGINT",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64)",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS content_size BIGINT",
+    # Загрузка медиа частями
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS upload_state VARCHAR(20) NOT NULL DEFAULT 'complete'",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS received_bytes BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS total_size BIGINT",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS upload_id VARCHAR(1024)",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS upload_parts JSONB NOT NULL DEFAULT '[]'",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE",
+    # Очистка staged_uploads и поиск потерянных объектов хранилища
+    "CREATE INDEX IF NOT EXISTS ix_staged_uploads_updated_at ON staged_uploads (updated_at)",
+    "UPDATE staged_uploads SET updated_at = created_at WHERE updated_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_product_media_object_key ON product_media (object_key)",
+    "CREATE INDEX IF NOT EXISTS ix_product_media_variants_object_key ON product_media_variants (object_key)",
+    # Дедупликация содержимого медиа
+    "ALTER TABLE product_media ADD COLUMN IF NOT EXISTS blob_id INTEGER REFERENCES media_blobs (id)",
+    "CREATE INDEX IF NOT EXISTS ix_product_media_blob_id ON product_media (blob_id)",
+    "ALTER TABLE staged_uploads ADD COLUMN IF NOT EXISTS blob_id INTEGER",
+]
+
+
+def apply_schema_upgrades(engine: Engine) -> None:
+    """
+    Выполняет все выражения UPGRADE_STATEMENTS, каждое в отдельной транзакции.
+    
+    Args:
+        engine (Engine): SQLAlchemy engine.
+    """
+    for statement in UPGRADE_STATEMENTS:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+        except Exception as exc:
+            logger.exception("Schema upgrade failed: %s (%s)", statement, exc)
@@ -7,25 +7,33 @@ REST API для управления пользователями и ферма
 
 import os
 import logging
-from datetime import timedelta
 from typing import Optional, List
 
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form
+from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 
 from database.database import SessionLocal, engine, get_db, Base
+from database.schema_upgrades import apply_schema_upgrades
 from models import user as user_model, farm as farm_model
 from schemas import user as user_schema, farm as farm_schema
-from schemas.login import LoginRequest
-from utils.security import hash_password, verify_password
-from utils.auth import create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from utils.security import PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER, hash_password_pooled, shutdown_password_pool
+from utils.auth import get_current_user, get_current_principal, load_balance, Principal
 from routers import auth as auth_router
 from routers import products as products_router
 from routers import farms as farms_router  
 from routers import sensors as sensors_router
 from routers import gamification as gamification_router
+from utils.sensor_auth import start_last_seen_flusher, stop_last_seen_flusher
+from utils.sensor_partitions import ensure_partitions
+from utils.sensor_rollups import ensure_rollups
+from utils.ai_jobs import start_ai_job_worker, stop_ai_job_worker
+from utils.media_variants import start_media_variant_workers, stop_media_variant_workers
+from utils.media_gc import start_media_gc, stop_media_gc
+from utils.object_store import check_object_store
+from utils.ai_recommendation import close_neuroapi_clients
 from sqlalchemy.orm import relationship
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -48,6 +56,18 @@ app.include_router(gamification_router.router)
 if os.getenv("SKIP_CREATE_ALL", "false").lower() != "true":
     # Создание таблиц в базе данных для разработки
     Base.metadata.create_all(bind=engine)
+    # Новые индексы/колонки для уже существующих таблиц
+    apply_schema_upgrades(engine)
+    # Секции sensor_readings на текущий и ближайшие месяцы
+    try:
+        ensure_partitions(engine)
+    except Exception as exc:
+        logger.exception("Failed to ensure sensor_readings partitions: %s", exc)
+    # Агрегаты по истории, накопленной до их появления (однократно)
+    try:
+        ensure_rollups(engine)
+    except Exception as exc:
+        logger.exception("Failed to rebuild sensor rollups: %s", exc)
 
     
 origins = [
@@ -64,9 +84,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    """
+    Пул хеширования паролей перегружен — быстрый отказ вместо ожидания в очереди.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Authentication service is busy, retry later"},
+        headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+    )
+
+
+@app.on_event("startup")
+def on_startup():
+    """
+    Запуск фоновых задач приложения.
+    """
+    # Неверно настроенное хранилище медиа — ошибка запуска, а не потерянные загрузки
+    check_object_store()
+    start_last_seen_flusher()
+    start_ai_job_worker()
+    start_media_variant_workers()
+    start_media_gc()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    """
+    Остановка фоновых задач с сохранением накопленных данных.
+    """
+    stop_media_gc()
+    stop_media_variant_workers()
+    stop_ai_job_worker()
+    stop_last_seen_flusher()
+    shutdown_password_pool()
+
+
+@app.on_event("shutdown")
+def close_http_clients():
+    """
+    Закрытие пулов соединений HTTP-клиентов внешних API.
+    """
+    close_neuroapi_clients()
+
+
 @app.get("/")
 def root():
     """
@@ -114,7 +180,7 @@ def register(user_data: user_schema.UserCreate, db: Session = Depends(get_db)):
     if existing:
         raise HTTPException(status_code=409, detail="User with this email already exists")
 
-    hashed_pass = hash_password(user_data.password)
+    hashed_pass = hash_password_pooled(user_data.password)
     db_user = user_model.User(
         email=user_data.email,
         hashed_password=hashed_pass,
@@ -139,127 +205,6 @@ def register(user_data: user_schema.UserCreate, db: Session = Depends(get_db)):
 
 
 
-@app.post(
-    "/api/auth/login",
-    summary="Login (form / json / query)",
-    openapi_extra={
-        "requestBody": {
-            "required": True,
-            "content": {
-                "application/json": {
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "email": {"type": "string", "example": "test.exemple@mail.ru"},
-                            "password": {"type": "string", "example": "ABCabc.123321"},
-                        },
-                        "required": ["email", "password"],
-                    }
-                },
-                "application/x-www-form-urlencoded": {
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "email": {"type": "string", "example": "test.exemple@mail.ru"},
-                            "password": {"type": "string", "example": "ABCabc.123321"},
-                        },
-                        "required": ["email", "password"],
-                    }
-                },
-                "multipart/form-data": {
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "email": {"type": "string"},
-                            "password": {"type": "string"},
-                        },
-                        "required": ["email", "password"],
-                    }
-                },
-            },
-        }
-    },
-)
-async def login(
-    request: Request,
-    email: Optional[str] = Form(None),
-    password: Optional[str] = Form(None),
-    db: Session = Depends(get_db),
-):
-    """
-    Аутентификация пользователя.
-
-    Поддерживает:
-      - form-data / application/x-www-form-urlencoded (поля email, password) — видно в Swagger UI,
-      - application/json (тело: {"email": "...", "password": "..."}),
-      - multipart/form-data,
-      - query-параметры (?email=...&password=...).
-
-    Возвращает: {"access_token": "<jwt>", "token_type": "bearer"}.
-
-    Ошибки:
-      - 422 если отсутствуют email/password,
-      - 401 если неверные учетные данные,
-      - 403 если аккаунт отключен.
-    """
-    # 1) Если форма (Form) уже дала значения — используем их.
-    email_val = email
-    password_val = password
-
-    # Заголовок content-type (включая возможный ;charset=utf-8)
-    content_type = (request.headers.get("content-type") or "").lower()
-
-    # 2) Попробуем JSON, только если не хватает данных из формы
-    if (not email_val or not password_val) and content_type.startswith("application/json"):
-        try:
-            body = await request.json()
-            if isinstance(body, dict):
-                email_val = email_val or body.get("email")
-                password_val = password_val or body.get("password")
-        except Exception:
-            # если не удалось распарсить JSON — просто игнорируем и продолжим
-            pass
-
-    # 3) Если всё ещё не хватает — попробуем явно прочитать form (поддержка email_form и password_form)
-    if (not email_val or not password_val) and ("application/x-www-form-urlencoded" in content_type or "multipart/form-data" in content_type):
-        try:
-            form = await request.form()
-            # form может содержать другие имена (alias), поэтому проверим несколько вариантов
-            form_dict = dict(form)
-            email_val = email_val or form_dict.get("email") or form_dict.get("email_form")
-            password_val = password_val or form_dict.get("password") or form_dict.get("password_form")
-        except Exception:
-            pass
-
-    # 4) Последний шанс — query-параметры
-    if not email_val or not password_val:
-        q = request.query_params
-        email_val = email_val or q.get("email") or q.get("email_form")
-        password_val = password_val or q.get("password") or q.get("password_form")
-
-    # 5) Если всё ещё нет — ошибка 422
-    if not email_val or not password_val:
-        raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail="Missing email or password (send JSON body or form fields or query params)."
-        )
-
-    # 6) Аутентификация в БД
-    db_user = db.query(user_model.User).filter(user_model.User.email == email_val).first()
-    if not db_user or not verify_password(password_val, db_user.hashed_password):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password")
-
-    if not db_user.is_active:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User account is disabled")
-
-    # 7) Генерация токена
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": str(db_user.id), "role": db_user.role}, expires_delta=access_token_expires
-    )
-
-    return {"access_token": access_token, "token_type": "bearer"}
-
 @app.post("/api/users/", response_model=user_schema.User, status_code=201)
 def create_user(user_data: user_schema.UserCreate,
                 current_user: user_model.User = Depends(get_current_user),
@@ -287,7 +232,7 @@ def create_user(user_data: user_schema.UserCreate,
     if user_data.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot create admin users here")
 
-    hashed_pass = hash_password(user_data.password)
+    hashed_pass = hash_password_pooled(user_data.password)
     db_user = user_model.User(
         email=user_data.email,
         hashed_password=hashed_pass,
@@ -311,16 +256,18 @@ def create_user(user_data: user_schema.UserCreate,
 
 
 @app.get("/api/users/me", response_model=user_schema.User)
-def read_users_me(current_user: user_model.User = Depends(get_current_user)):
+def read_users_me(current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     Получение информации о текущем пользователе.
     
-    Возвращает профиль текущего аутентифицированного пользователя.
+    Возвращает профиль текущего аутентифицированного пользователя
+    из кеша пользователей; баланс читается из БД, так как кеш может отставать.
     
     Args:
-        current_user (user_model.User): Текущий аутентифицированный пользователь.
+        current_user (Principal): Текущий аутентифицированный пользователь.
+        db (Session): Сессия базы данных.
         
     Returns:
-        user_model.User: Информация о текущем пользователе.
+        dict: Информация о текущем пользователе.
     """
-    return current_user
\ No newline at end of file
+    return {**current_user._asdict(), "balance": load_balance(db, current_user.id)}
\ No newline at end of file
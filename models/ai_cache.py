@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+AI Recommendation Cache Model
+-----------------------------
+SQLAlchemy модель кеша ИИ рекомендаций, адресуемого по хешу контекста промпта.
+"""
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from database.database import Base
+
+
+class AiRecommendationCache(Base):
+    """
+    Сгенерированная рекомендация для нормализованного контекста товара.
+
+    Attributes:
+        cache_key (str): sha256 от версии промпта и нормализованного контекста (первичный ключ).
+        prompt_version (str): Версия шаблона промпта, с которым получена рекомендация.
+        recommendation (str): Текст рекомендации.
+        hits (int): Количество повторных использований.
+        created_at (datetime): Дата создания.
+        expires_at (datetime): Срок годности записи.
+    """
+    __tablename__ = "ai_recommendation_cache"
+
+    cache_key = Column(String(64), primary_key=True)
+    prompt_version = Column(String(16), nullable=False, index=True)
+    recommendation = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
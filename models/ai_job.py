@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+AI Recommendation Job Model
+---------------------------
+SQLAlchemy модель очереди фоновой генерации ИИ рекомендаций для продуктов.
+"""
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Index, text
+from database.database import Base
+
+
+class AiRecommendationJob(Base):
+    """
+    Задание на генерацию "Краткой рекомендации от ИИ" для паспорта продукта.
+
+    Attributes:
+        id (int): Уникальный идентификатор задания.
+        product_id (int): ID продукта.
+        status (str): pending | running | done | failed.
+        attempts (int): Количество выполненных попыток.
+        max_attempts (int): Максимальное количество попыток.
+        run_after (datetime): Не запускать раньше этого момента (backoff между попытками).
+        locked_at (datetime): Когда задание взято воркером (для возврата зависших заданий).
+        last_error (str): Текст последней ошибки.
+        created_at (datetime): Дата создания.
+        updated_at (datetime): Дата последнего изменения.
+    """
+    __tablename__ = "ai_recommendation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Не более одного незавершенного задания на продукт
+        Index(
+            "ux_ai_recommendation_jobs_active_product", "product_id", unique=True,
+            postgresql_where=text("status IN ('pending', 'running')"),
+        ),
+        Index("ix_ai_recommendation_jobs_status_run_after", "status", "run_after"),
+    )
@@ -4,7 +4,7 @@ Gamification Models
 -------------------
 SQLAlchemy модели для геймификации: усыновления, предметы магазина, действия.
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database.database import Base
@@ -70,6 +70,12 @@ class UserAction(Base):
     product = relationship("Product", backref="user_actions")
     item = relationship("GameItem")
 
+    # Индексы для keyset-пагинации историй действий
+    __table_args__ = (
+        Index("ix_user_actions_product_created_id", "product_id", "created_at", "id"),
+        Index("ix_user_actions_user_created_id", "user_id", "created_at", "id"),
+    )
+
 
 class GoalType(enum.Enum):
     boosts = "boosts"        # количество купленных бустов
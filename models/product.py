@@ -4,11 +4,14 @@
 -------------------------------------
 SQLAlchemy модели для Product, ProductPassport и ProductMedia.
 Все поля документированы и снабжены ограничениями (где это применимо).
+
+Колонки content с байтами файлов объявлены deferred: списки и метаданные медиа
+не читают их из Postgres, байты загружаются только при явном обращении к атрибуту.
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, Boolean, DateTime, UniqueConstraint, Index, Numeric
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Text, Boolean, DateTime, UniqueConstraint, Index, Numeric
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import relationship, foreign
+from sqlalchemy.orm import relationship, foreign, deferred
 from database.database import Base
 from sqlalchemy import LargeBinary
 from sqlalchemy.orm import relationship
@@ -40,6 +43,7 @@ class Product(Base):
     sensor_devices = relationship("SensorDevice", back_populates="product", cascade="all, delete-orphan")
     __table_args__ = (
         Index("ix_products_owner_active", "owner_id", "is_active"),
+        Index("ix_products_active_created_id", "is_active", "created_at", "id"),
     )
 
 
@@ -56,40 +60,123 @@ class ProductPassport(Base):
     product = relationship("Product", back_populates="passport")
 
 
+class MediaBlob(Base):
+    """
+    Содержимое медиафайла, общее для всех ProductMedia с тем же SHA-256.
+    ref_count — число ссылающихся ProductMedia; блоб с нулевым счетчиком удаляется
+    вместе с объектом в хранилище.
+    """
+    __tablename__ = "media_blobs"
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, unique=True, index=True)
+    size = Column(BigInteger, nullable=False)
+    storage_backend = Column(String(20), nullable=False, default="db", server_default="db")
+    object_key = Column(String(1024), nullable=False, index=True)
+    content = deferred(Column(LargeBinary, nullable=True))      # только для storage_backend="db"
+    mime_type = Column(String(100), nullable=False, default="application/octet-stream")
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class ProductMedia(Base):
     """
-    Теперь храним бинарные данные прямо в Postgres (LargeBinary).
-    Поле `object_key` удалено — вместо него есть `filename` и `content`.
+    Бинарные данные хранятся в объектном хранилище (utils.object_store) под ключом `object_key`;
+    `storage_backend` указывает, в каком именно. Для старых записей (storage_backend="db")
+    байты лежат в колонке `content`. Новые записи ссылаются на общий MediaBlob (blob_id),
+    object_key и storage_backend при этом совпадают с блобом.
     """
     __tablename__ = "product_media"
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
     object_key = Column(String(512), nullable=False)   
     filename = Column(String(1024), nullable=False)  
-    content = Column(LargeBinary, nullable=False)     
+    content = deferred(Column(LargeBinary, nullable=True))      # только для storage_backend="db"
+    storage_backend = Column(String(20), nullable=False, default="db", server_default="db")
+    content_sha256 = Column(String(64), nullable=True)   # hex, используется как ETag
+    content_size = Column(BigInteger, nullable=True)
     mime_type = Column(String(100), nullable=False, default="application/octet-stream")
     width = Column(Integer, nullable=True)
     height = Column(Integer, nullable=True)
+    blob_id = Column(Integer, ForeignKey("media_blobs.id"), nullable=True, index=True)   # общий блоб (дедупликация по SHA-256)
     is_primary = Column(Boolean, nullable=False, default=False)
     meta = Column(JSONB, nullable=False, default={})
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     product = relationship("Product", back_populates="media")
+    variants = relationship("ProductMediaVariant", back_populates="media", cascade="all, delete-orphan", passive_deletes=True)
 
     __table_args__ = (
         UniqueConstraint("product_id", "filename", name="uq_product_media_filename"),
+        Index("ix_product_media_object_key", "object_key"),
+    )
+
+
+class ProductMediaVariant(Base):
+    """
+    Уменьшенная копия изображения ProductMedia (thumb, medium) в одном из форматов (webp, avif, jpeg).
+    Создается фоновым конвейером utils.media_variants после подтверждения загрузки.
+    """
+    __tablename__ = "product_media_variants"
+    id = Column(Integer, primary_key=True, index=True)
+    media_id = Column(Integer, ForeignKey("product_media.id", ondelete="CASCADE"), nullable=False, index=True)
+    variant = Column(String(20), nullable=False)
+    format = Column(String(10), nullable=False)
+    object_key = Column(String(1024), nullable=False, index=True)
+    storage_backend = Column(String(20), nullable=False, default="db", server_default="db")
+    content = deferred(Column(LargeBinary, nullable=True))      # только для storage_backend="db"
+    content_sha256 = Column(String(64), nullable=False)
+    content_size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(100), nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    media = relationship("ProductMedia", back_populates="variants")
+
+    __table_args__ = (
+        UniqueConstraint("media_id", "variant", "format", name="uq_product_media_variants_media_variant_format"),
     )
 
 
 class StagedUpload(Base):
     """
     Временное хранилище для файлов, загружаемых через upload_url (эквивалент presign+upload).
-    После подтверждения (confirm) данные копируются в ProductMedia и запись StagedUpload удаляется.
+    Файл загружается целиком или частями (PATCH с Upload-Offset, с продолжением после обрыва).
+    После подтверждения (confirm) объект переходит к ProductMedia под тем же object_key
+    и запись StagedUpload удаляется.
     """
     __tablename__ = "staged_uploads"
     id = Column(Integer, primary_key=True, index=True)
     object_key = Column(String(1024), nullable=False, unique=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
     filename = Column(String(1024), nullable=False)
-    content = Column(LargeBinary, nullable=False)
+    content = deferred(Column(LargeBinary, nullable=True))      # только для storage_backend="db"
+    storage_backend = Column(String(20), nullable=False, default="db", server_default="db")
+    content_sha256 = Column(String(64), nullable=True)
+    content_size = Column(BigInteger, nullable=True)
     mime_type = Column(String(100), nullable=False, default="application/octet-stream")
+    # Загрузка частями: upload_state="uploading", пока не получены все total_size байт
+    upload_state = Column(String(20), nullable=False, default="complete", server_default="complete")
+    received_bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
+    total_size = Column(BigInteger, nullable=True)
+    upload_id = Column(String(1024), nullable=True)      # идентификатор multipart upload в хранилище
+    upload_parts = Column(JSONB, nullable=False, default=list, server_default="[]")
+    blob_id = Column(Integer, nullable=True)   # загрузка пропущена: файл с тем же SHA-256 уже есть (MediaBlob.id)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)   # последняя активность, для очистки
+
+
+
+class StagedUploadPart(Base):
+    """
+    Часть загрузки частями для storage_backend="db". Каждая часть — отдельная строка:
+    дописывание в один bytea переписывало бы весь накопленный файл на каждой части.
+    При завершении загрузки части склеиваются в StagedUpload.content одним UPDATE и удаляются.
+    """
+    __tablename__ = "staged_upload_parts"
+    id = Column(Integer, primary_key=True)
+    staged_id = Column(Integer, ForeignKey("staged_uploads.id", ondelete="CASCADE"), nullable=False)
+    part_number = Column(Integer, nullable=False)
+    content = deferred(Column(LargeBinary, nullable=False))
+
+    __table_args__ = (
+        UniqueConstraint("staged_id", "part_number", name="uq_staged_upload_parts_staged_part"),
+    )
\ No newline at end of file
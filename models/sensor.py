@@ -4,9 +4,10 @@ Sensor Models
 -------------
 SQLAlchemy модели для работы с датчиками и их показаниями.
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Numeric, ForeignKey, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.declarative import declared_attr
 from database.database import Base
 from datetime import datetime
 
@@ -35,18 +36,86 @@ class SensorReading(Base):
     """
     Модель показаний датчика.
     Хранит исторические данные с датчиков с привязкой ко времени.
+    Таблица секционирована по месяцам (RANGE по created_at), поэтому created_at
+    входит в первичный ключ. Секции создаются и удаляются utils/sensor_partitions.
     """
     __tablename__ = "sensor_readings"
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
     
-    id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(Integer, ForeignKey("sensor_devices.id", ondelete="CASCADE"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey("sensor_devices.id", ondelete="CASCADE"), nullable=False)
     temperature = Column(Numeric(5, 2), nullable=True)  # °C
     ph = Column(Numeric(4, 2), nullable=True)
     salinity = Column(Numeric(6, 2), nullable=True)    # ppm или %
     humidity = Column(Integer, nullable=True)         # %
     raw_data = Column(JSON, nullable=False, default=dict)
-    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, nullable=False, default=datetime.utcnow)
     
     # Связь с датчиком
     device = relationship("SensorDevice", back_populates="readings")
-    # product = relationship("Product", back_populates="sensor_devices")
\ No newline at end of file
+    # product = relationship("Product", back_populates="sensor_devices")
+
+
+# Составной индекс для выборок "показания датчика за период, новые первыми" и keyset-пагинации
+Index("ix_sensor_readings_device_created_id", SensorReading.device_id, SensorReading.created_at.desc(), SensorReading.id.desc())
+
+class SensorLastReading(Base):
+    """
+    Время последнего принятого показания по каждому датчику.
+    Используется для rate limiting без обращения к sensor_readings.
+    UNLOGGED-таблица: данные восстанавливаются из sensor_readings при холодном старте.
+    """
+    __tablename__ = "sensor_last_reading"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    device_id = Column(Integer, ForeignKey("sensor_devices.id", ondelete="CASCADE"), primary_key=True)
+    last_reading_at = Column(DateTime, nullable=False)
+
+
+
+class SensorRollupMixin:
+    """
+    Общие колонки предагрегированных показаний датчика за интервал.
+    Для каждой метрики хранятся сумма, количество, минимум и максимум,
+    поэтому интервалы можно досчитывать инкрементально и объединять.
+    """
+    @declared_attr
+    def device_id(cls):
+        return Column(Integer, ForeignKey("sensor_devices.id", ondelete="CASCADE"), primary_key=True)
+
+    bucket_start = Column(DateTime, primary_key=True)
+    readings_count = Column(Integer, nullable=False, default=0)
+
+    temperature_sum = Column(Numeric(18, 4), nullable=True)
+    temperature_count = Column(Integer, nullable=False, default=0)
+    temperature_min = Column(Numeric(5, 2), nullable=True)
+    temperature_max = Column(Numeric(5, 2), nullable=True)
+
+    ph_sum = Column(Numeric(18, 4), nullable=True)
+    ph_count = Column(Integer, nullable=False, default=0)
+    ph_min = Column(Numeric(4, 2), nullable=True)
+    ph_max = Column(Numeric(4, 2), nullable=True)
+
+    salinity_sum = Column(Numeric(18, 4), nullable=True)
+    salinity_count = Column(Integer, nullable=False, default=0)
+    salinity_min = Column(Numeric(6, 2), nullable=True)
+    salinity_max = Column(Numeric(6, 2), nullable=True)
+
+    humidity_sum = Column(Numeric(18, 4), nullable=True)
+    humidity_count = Column(Integer, nullable=False, default=0)
+    humidity_min = Column(Integer, nullable=True)
+    humidity_max = Column(Integer, nullable=True)
+
+
+class SensorReadingHourly(SensorRollupMixin, Base):
+    """
+    Почасовые агрегаты показаний датчика.
+    """
+    __tablename__ = "sensor_readings_hourly"
+
+
+class SensorReadingDaily(SensorRollupMixin, Base):
+    """
+    Посуточные агрегаты показаний датчика.
+    """
+    __tablename__ = "sensor_readings_daily"
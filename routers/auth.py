@@ -6,15 +6,19 @@ Auth Router
 """
 
 from fastapi import APIRouter, Depends, HTTPException, Response, status, Request, Cookie, Body
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import timedelta, datetime, timezone
+from typing import Optional, Tuple
 
-from database.database import get_db
+from database.database import get_async_db, get_db
+from models.refresh_token import RefreshToken
 from models.user import User
 from schemas.user import User as UserSchema
-from utils.security import verify_password
-from utils.refresh_tokens import create_refresh_token, verify_and_rotate_refresh_token, ReuseDetected, _hash_token_hmac
-from utils.auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from utils.security import verify_and_update_password_async, password_pool_stats
+from utils.refresh_tokens import new_refresh_token_values, verify_and_rotate_refresh_token, ReuseDetected, _hash_token_hmac
+from utils.auth import TokenClaims, create_access_token, require_roles, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(tags=["auth"], prefix="/api/auth")
 
@@ -28,48 +32,115 @@ REFRESH_COOKIE_SAMESITE = os.getenv("REFRESH_COOKIE_SAMESITE", "lax")
 REFRESH_COOKIE_SECURE = bool(os.getenv("REFRESH_COOKIE_SECURE", "1") == "1")
 
 
-@router.post("/login", summary="Аутентификация пользователя")
-def login(response: Response, payload: dict = Body(...), db: Session = Depends(get_db), request: Request = None):
+_CREDENTIALS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "email": {"type": "string", "example": "test.exemple@mail.ru"},
+        "password": {"type": "string", "example": "ABCabc.123321"},
+    },
+    "required": ["email", "password"],
+}
+
+
+async def _read_credentials(request: Request) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Читает email и пароль из тела запроса — один раз, парсером по Content-Type
+    (JSON или форма); без тела — из query-параметров (для старых клиентов).
+    
+    Args:
+        request (Request): Объект запроса.
+        
+    Returns:
+        Tuple[Optional[str], Optional[str]]: email и пароль (None, если не переданы).
+        
+    Raises:
+        HTTPException: 400 при некорректном JSON.
+    """
+    content_type = (request.headers.get("content-type") or "").split(";", 1)[0].strip().lower()
+    if content_type == "application/json":
+        try:
+            data = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(data, dict):
+            data = {}
+    elif content_type in ("application/x-www-form-urlencoded", "multipart/form-data"):
+        data = await request.form()
+    else:
+        data = request.query_params
+    email = data.get("email") or data.get("email_form")
+    password = data.get("password") or data.get("password_form")
+    return (email if isinstance(email, str) else None), (password if isinstance(password, str) else None)
+
+
+@router.post(
+    "/login",
+    summary="Аутентификация пользователя",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": _CREDENTIALS_SCHEMA},
+                "application/x-www-form-urlencoded": {"schema": _CREDENTIALS_SCHEMA},
+                "multipart/form-data": {"schema": _CREDENTIALS_SCHEMA},
+            },
+        }
+    },
+)
+async def login(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """
     Аутентификация пользователя по email и паролю.
     
-    Принимает JSON с полями email и password, возвращает access токен
-    и устанавливает refresh токен в cookie.
+    Принимает JSON, application/x-www-form-urlencoded или multipart/form-data с полями
+    email и password (тело разбирается один раз по Content-Type). Пользователь ищется
+    через AsyncSession, пароль проверяется в пуле хеширования (utils.security), а refresh
+    токен и пересчитанный хеш пароля (если изменились параметры Argon2) записываются
+    одной транзакцией. Возвращает access токен, refresh токен устанавливается в cookie.
     
     Args:
+        request (Request): Объект запроса (тело и информация об устройстве).
         response (Response): Объект ответа FastAPI.
-        payload (dict): Словарь с email и password.
-        db (Session): Сессия базы данных.
-        request (Request): Объект запроса для получения информации об устройстве.
+        db (AsyncSession): Асинхронная сессия базы данных.
         
     Returns:
         dict: Словарь с access_token, token_type и expires_in.
         
     Raises:
-        HTTPException: При неверных учетных данных или неактивном пользователе.
+        HTTPException: 400 без email/пароля, 401 при неверных учетных данных,
+            403 для неактивного пользователя; 503 — если пул хеширования перегружен.
     """
-    email = payload.get("email")
-    password = payload.get("password")
+    email, password = await _read_credentials(request)
     if not email or not password:
         raise HTTPException(status_code=400, detail="email and password required")
 
-    user = db.query(User).filter(User.email == email).first()
+    user = (await db.execute(
+        select(User.id, User.hashed_password, User.role, User.is_active).where(User.email == email)
+    )).first()
     if not user or not user.hashed_password:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     if not user.is_active:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is inactive")
 
+    plain_refresh, refresh_values = new_refresh_token_values(user.id, device_info=request.headers.get("user-agent"))
+    await db.execute(insert(RefreshToken).values(**refresh_values))
+    if new_hash:
+        # Хеш со старыми параметрами Argon2 — заменяем, пока пароль известен
+        await db.execute(
+            update(User)
+            .where(User.id == user.id, User.hashed_password == user.hashed_password)
+            .values(hashed_password=new_hash)
+        )
+    await db.commit()
+
     access_token = create_access_token({"sub": str(user.id), "role": user.role},
                                        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
 
-    device_info = (request.headers.get("user-agent") if request else None)
-    plain_refresh, db_rt = create_refresh_token(db, user.id, device_info=device_info)
-
-    max_age = int((db_rt.expires_at - datetime.now(timezone.utc)).total_seconds())
+    max_age = int((refresh_values["expires_at"] - datetime.now(timezone.utc)).total_seconds())
     response.set_cookie(
         key=REFRESH_COOKIE_NAME,
         value=plain_refresh,
@@ -112,18 +183,19 @@ def refresh(response: Response, refresh_token: str = Cookie(None), db: Session =
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing refresh token")
 
     try:
-        user_id, new_plain, new_db = verify_and_rotate_refresh_token(db, token)
+        rotated = verify_and_rotate_refresh_token(db, token)
     except ReuseDetected:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Refresh token reuse detected; all sessions revoked")
     except ValueError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired refresh token")
 
-    access_token = create_access_token({"sub": str(user_id)}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    # Роль в claims нужна для проверок по токену без запроса к БД (utils.auth.require_roles)
+    access_token = create_access_token({"sub": str(rotated.user_id), "role": rotated.role}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
 
-    max_age = int((new_db.expires_at - datetime.now(timezone.utc)).total_seconds())
+    max_age = int((rotated.expires_at - datetime.now(timezone.utc)).total_seconds())
     response.set_cookie(
         key=REFRESH_COOKIE_NAME,
-        value=new_plain,
+        value=rotated.plain,
         httponly=True,
         secure=REFRESH_COOKIE_SECURE,
         samesite=REFRESH_COOKIE_SAMESITE,
@@ -160,4 +232,19 @@ def logout(response: Response, refresh_token: str = Cookie(None), db: Session =
         db.commit()
 
     response.delete_cookie(key=REFRESH_COOKIE_NAME, path=REFRESH_COOKIE_PATH)
-    return {"detail": "Logged out"}
\ No newline at end of file
+    return {"detail": "Logged out"}
+
+
+@router.get("/admin/password-pool", summary="Состояние пула хеширования паролей")
+def password_pool_status(current_user: TokenClaims = Depends(require_roles("admin"))):
+    """
+    Глубина очереди, отказы (503) и среднее время ожидания/вычисления Argon2.
+    Только для администратора.
+    
+    Args:
+        current_user (TokenClaims): Claims токена администратора.
+        
+    Returns:
+        dict: Счетчики пула текущего процесса.
+    """
+    return password_pool_stats()
@@ -4,7 +4,7 @@ Gamification Router
 -------------------
 API для геймификации: магазин, усыновления, действия, баланс.
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 import logging
@@ -27,7 +27,8 @@ from schemas.gamification import (
     ProductGrowthInfo,
     CommunityGoalOut
 )
-from utils.auth import get_current_user
+from utils.auth import Principal, get_current_principal, get_current_user, load_balance
+from utils.cursors import paginate_desc, next_page_cursor
 
 logger = logging.getLogger("gamification_router")
 router = APIRouter(prefix="/api/game", tags=["gamification"])
@@ -103,16 +104,16 @@ def get_game_item(item_id: int, db: Session = Depends(get_db)):
 
 @router.get("/balance", response_model=BalanceOut)
 def get_balance(
-    current_user: UserModel = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить текущий баланс пользователя."""
-    return {"balance": current_user.balance or 0}
+    return {"balance": load_balance(db, current_user.id)}
 
 
 @router.get("/stats")
 def get_user_stats(
-    current_user: UserModel = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить статистику и достижения пользователя."""
@@ -166,7 +167,7 @@ def get_user_stats(
             "adoptions": adoptions_count,
             "boosts": actions_count,
             "total_spent": total_spent,
-            "balance": current_user.balance or 0
+            "balance": load_balance(db, current_user.id)
         },
         "level": level_info,
         "achievements": unlocked_achievements
@@ -440,7 +441,7 @@ def adopt_product(
 
 @router.get("/adoptions", response_model=List[AdoptionWithProduct])
 def get_my_adoptions(
-    current_user: UserModel = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """Получить список моих усыновлённых растений."""
@@ -606,18 +607,28 @@ def perform_action(
 @router.get("/actions/{product_id}", response_model=List[UserActionOut])
 def get_product_actions(
     product_id: int,
+    response: Response,
     limit: int = 50,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Получить историю действий над продуктом.
     Видно всем (публичная история ухода).
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor.
     """
-    actions = db.query(UserAction).filter(
+    query = db.query(UserAction).filter(
         UserAction.product_id == product_id
     ).options(
         joinedload(UserAction.item)
-    ).order_by(UserAction.created_at.desc()).limit(limit).all()
+    )
+    try:
+        actions = paginate_desc(query, UserAction.created_at, UserAction.id, cursor, limit).all()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    next_cursor = next_page_cursor(actions, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     result = []
     for action in actions:
@@ -637,16 +648,25 @@ def get_product_actions(
 
 @router.get("/my-actions", response_model=List[UserActionOut])
 def get_my_actions(
+    response: Response,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: UserModel = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Получить мои действия."""
-    actions = db.query(UserAction).filter(
+    """Получить мои действия (курсор следующей страницы — в заголовке X-Next-Cursor)."""
+    query = db.query(UserAction).filter(
         UserAction.user_id == current_user.id
     ).options(
         joinedload(UserAction.item)
-    ).order_by(UserAction.created_at.desc()).limit(limit).all()
+    )
+    try:
+        actions = paginate_desc(query, UserAction.created_at, UserAction.id, cursor, limit).all()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    next_cursor = next_page_cursor(actions, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     result = []
     for action in actions:
@@ -708,7 +728,7 @@ def get_community_goals(
 @router.get("/growth/{product_id}", response_model=ProductGrowthInfo)
 def get_product_growth(
     product_id: int,
-    current_user: UserModel = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
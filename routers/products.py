@@ -2,19 +2,26 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status, Body, UploadFile, File, Request, Query
 from fastapi.responses import JSONResponse, StreamingResponse
-from sqlalchemy.orm import Session, joinedload
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional, Any
+from typing import AsyncIterator, List, Optional, Any, Union
+import base64
+import binascii
 import logging
 import importlib
 from uuid import uuid4
-from datetime import datetime
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from fastapi import Response
 from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
-from database.database import get_db
+from database.database import get_db, get_async_db
 from models.sensor import SensorDevice
 from schemas.sensor import SensorDeviceOut
-from models.product import Product, ProductPassport, ProductMedia
+from models.product import Product, ProductPassport, ProductMedia, ProductMediaVariant, MediaBlob
 from models.farm import Farm
 from schemas.product import (
     ProductCreate, ProductOut, ProductUpdate,
@@ -22,21 +29,42 @@ from schemas.product import (
     ProductMediaIn, ProductMediaConfirm
 )
 from models.user import User as UserModel
-from utils.auth import get_current_user, get_current_user_optional
+from utils.auth import Principal, TokenClaims, get_current_principal, get_current_principal_optional, get_current_user, require_roles
 from urllib.parse import quote as _urlquote
-from utils import ai_recommendation
+from pathlib import PurePath
+from utils.ai_jobs import enqueue_recommendation, needs_recommendation, latest_job, RECOMMENDATION_FIELD
+from utils import ai_backfill, media_gc
+from utils.sensor_auth import invalidate_sensor_cache
+from utils.cursors import paginate_desc, next_page_cursor
+from utils.object_store import ObjectNotFound
+from utils import media_variants
+from utils.media_variants import VARIANT_SIZES, pick_format, schedule_media_variants
+from utils.image_variants import EXTENSIONS as VARIANT_EXTENSIONS
 
 logger = logging.getLogger("products_router")
 router = APIRouter(prefix="/api/products", tags=["products"])
 
 media_db = importlib.import_module('utils.media_db')
 
-def _require_farmer_or_admin(user: UserModel):
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", "86400"))
+MEDIA_VARIANT_FALLBACK_MAX_AGE = int(os.getenv("MEDIA_VARIANT_FALLBACK_MAX_AGE", "60"))   # оригинал вместо еще не готовой копии
+
+# Связи, которые сериализует ProductOut. В асинхронной сессии ленивая загрузка
+# недоступна, поэтому они загружаются заранее.
+PRODUCT_OUT_OPTIONS = (
+    selectinload(Product.media),
+    joinedload(Product.farm),
+    joinedload(Product.passport),
+    selectinload(Product.sensor_devices),
+)
+
+def _require_farmer_or_admin(user: Union[UserModel, Principal, TokenClaims]):
     """
     Проверяет, является ли пользователь farmer или admin.
+    Достаточно роли из claims токена — запрос к БД не нужен.
     
     Args:
-        user (UserModel): Пользователь для проверки.
+        user (Union[UserModel, Principal, TokenClaims]): Пользователь для проверки.
         
     Raises:
         HTTPException: Если у пользователя недостаточно прав.
@@ -131,13 +159,69 @@ def _apply_price_markup(raw_price) -> Decimal:
     return Decimal(marked_up_kopecks) / Decimal(100)
 
 
+@router.post("/admin/ai-recommendations/backfill", status_code=202)
+def backfill_ai_recommendations(limit: int = Query(1000, ge=1, le=10000), current_user: TokenClaims = Depends(require_roles("admin")), db: Session = Depends(get_db)):
+    """
+    Постановка в фоновую очередь генерации ИИ рекомендаций для собранных товаров,
+    у которых ее нет. Только для администратора.
+    
+    Args:
+        limit (int): Максимальное количество товаров за вызов.
+        current_user (TokenClaims): Claims токена администратора.
+        db (Session): Сессия базы данных.
+        
+    Returns:
+        dict: Количество товаров, поставленных в очередь.
+    """
+    try:
+        queued = ai_backfill.enqueue_backfill(db, limit=limit)
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to enqueue AI recommendation backfill: %s", exc)
+        raise HTTPException(status_code=500, detail="Failed to enqueue backfill")
+    return {"queued": queued}
+
+
+@router.get("/admin/media/gc")
+def media_gc_status(current_user: TokenClaims = Depends(require_roles("admin"))):
+    """
+    Статистика очистки неподтвержденных загрузок (удалено записей, освобождено байт).
+    Только для администратора.
+    
+    Args:
+        current_user (TokenClaims): Claims токена администратора.
+        
+    Returns:
+        dict: Счетчики очистки текущего процесса и ее настройки.
+    """
+    return {
+        **media_gc.gc_stats(),
+        "ttl_hours": media_gc.MEDIA_STAGED_TTL_HOURS,
+        "interval_seconds": media_gc.MEDIA_GC_INTERVAL,
+    }
+
+
+@router.post("/admin/media/gc")
+def run_media_gc(current_user: TokenClaims = Depends(require_roles("admin"))):
+    """
+    Внеочередной проход очистки устаревших staged_uploads. Только для администратора.
+    
+    Args:
+        current_user (TokenClaims): Claims токена администратора.
+        
+    Returns:
+        dict: Удалено записей и освобождено байт в Postgres и хранилищах.
+    """
+    return media_gc.run_gc_once()
+
+
 @router.get("/me", response_model=List[ProductOut])
-def my_products(current_user: UserModel = Depends(get_current_user), db: Session = Depends(get_db)):
+def my_products(current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     Получение списка продуктов текущего пользователя.
     
     Args:
-        current_user (UserModel): Текущий аутентифицированный пользователь.
+        current_user (Principal): Текущий аутентифицированный пользователь.
         db (Session): Сессия базы данных.
         
     Returns:
@@ -150,20 +234,21 @@ def my_products(current_user: UserModel = Depends(get_current_user), db: Session
             if m.is_primary:
                 try:
                     m.presigned_url = media_db.public_media_url(m.id)
+                    m.thumbnail_url = media_db.public_media_url(m.id, size="thumb")
                 except Exception:
                     m.presigned_url = None
         p.farm_name = p.farm.name if p.farm else None
     return products
 
 @router.post("/", response_model=ProductOut, status_code=201)
-def create_product(payload: ProductCreate, current_user: UserModel = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_product(payload: ProductCreate, current_user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     Создание нового продукта с опциональным паспортом.
     Логирует входящий payload для отладки.
     
     Args:
         payload (ProductCreate): Данные для создания продукта.
-        current_user (UserModel): Текущий аутентифицированный пользователь.
+        current_user (Principal): Текущий пользователь (из кеша, с проверкой is_active).
         db (Session): Сессия базы данных.
         
     Returns:
@@ -218,6 +303,7 @@ def create_product(payload: ProductCreate, current_user: UserModel = Depends(get
                 sensor.product_id = product.id
                 db.commit()
                 db.refresh(sensor)
+                invalidate_sensor_cache(sensor.api_key_hash)
                 logger.info(f"Sensor {sensor.id} successfully assigned to product {product.id}")
             else:
                 logger.warning(f"Sensor with ID {payload.sensor_id} not found for product {product.id}")
@@ -275,55 +361,16 @@ def create_product(payload: ProductCreate, current_user: UserModel = Depends(get
         except Exception as exc:
             logger.exception("Error processing passport payload for product %s: %s", product.id, exc)
 
-    # Генерация ИИ рекомендации для собранных товаров
-    if not product.is_growing:
-        try:
-            # Получаем паспорт, если он был создан
-            passport = db.query(ProductPassport).filter(ProductPassport.product_id == product.id).first()
-            
-            # Если рекомендация еще не была сгенерирована
-            if passport and passport.data:
-                existing_recommendation = passport.data.get("Краткая рекомендация от ИИ")
-                if not existing_recommendation or existing_recommendation.strip() == "":
-                    # Формируем данные паспорта для генерации
-                    passport_data = {
-                        "origin": passport.origin,
-                        "variety": passport.variety,
-                        "harvest_date": passport.harvest_date.isoformat() if passport.harvest_date else None,
-                        "certifications": passport.certifications or [],
-                        "data": passport.data or {}
-                    }
-                    
-                    # Генерируем рекомендацию
-                    recommendation = ai_recommendation.generate_product_recommendation(
-                        product_name=product.name,
-                        product_category=product.category or "",
-                        short_description=product.short_description or "",
-                        passport_data=passport_data
-                    )
-                    
-                    if recommendation:
-                        # Обновляем паспорт с новой рекомендацией
-                        passport_data_update = passport.data.copy()
-                        passport_data_update["Краткая рекомендация от ИИ"] = recommendation
-                        passport.data = passport_data_update
-                        db.add(passport)
-                        try:
-                            db.commit()
-                            db.refresh(passport)
-                            logger.info(f"Successfully generated AI recommendation for product {product.id}")
-                        except Exception as exc:
-                            db.rollback()
-                            logger.exception(f"Failed to save AI recommendation for product {product.id}: {exc}")
-                    else:
-                        logger.warning(f"Failed to generate AI recommendation for product {product.id}")
-        except Exception as exc:
-            logger.exception(f"Error generating AI recommendation for product {product.id}: {exc}")
+    # Генерация ИИ рекомендации для собранных товаров — в фоновой очереди
+    passport = db.query(ProductPassport).filter(ProductPassport.product_id == product.id).first()
+    if needs_recommendation(product, passport):
+        enqueue_recommendation(db, product.id)
     
     for m in getattr(product, "media", []) or []:
         if m.is_primary:
             try:
                 m.presigned_url = media_db.public_media_url(m.id)
+                m.thumbnail_url = media_db.public_media_url(m.id, size="thumb")
             except Exception:
                 m.presigned_url = None
 
@@ -338,6 +385,7 @@ def create_product(payload: ProductCreate, current_user: UserModel = Depends(get
             sensor.product_id = product.id
             db.commit()
             db.refresh(sensor)
+            invalidate_sensor_cache(sensor.api_key_hash)
     
     try:
         db.refresh(product)
@@ -349,30 +397,45 @@ def create_product(payload: ProductCreate, current_user: UserModel = Depends(get
 
 
 @router.get("/", response_model=List[ProductOut])
-def list_products(q: Optional[str] = None, limit: int = 50, offset: int = 0, db: Session = Depends(get_db)):
+async def list_products(response: Response, q: Optional[str] = None, limit: int = 50, offset: int = 0, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
     """
     Получение списка продуктов с опциональным поиском.
+    Предпочтительна keyset-пагинация: курсор следующей страницы возвращается
+    в заголовке X-Next-Cursor и передается в параметре cursor (offset при этом игнорируется).
     
     Args:
+        response (Response): Объект ответа FastAPI (для заголовка X-Next-Cursor).
         q (Optional[str]): Поисковый запрос.
         limit (int): Ограничение на количество результатов.
-        offset (int): Смещение для пагинации.
-        db (Session): Сессия базы данных.
+        offset (int): Смещение для пагинации (устаревший способ).
+        cursor (Optional[str]): Курсор следующей страницы.
+        db (AsyncSession): Асинхронная сессия базы данных.
         
     Returns:
         List[ProductOut]: Список продуктов.
     """
-    query = db.query(Product).options(joinedload(Product.media), joinedload(Product.farm)).filter(Product.is_active == True)
+    limit = min(limit, 200)
+    query = select(Product).options(*PRODUCT_OUT_OPTIONS).filter(Product.is_active == True)
     if q:
         ilike = f"%{q}%"
         query = query.filter((Product.name.ilike(ilike)) | (Product.short_description.ilike(ilike)))
-    products = query.order_by(Product.created_at.desc()).limit(min(limit, 200)).offset(max(offset, 0)).all()
+    try:
+        query = paginate_desc(query, Product.created_at, Product.id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not cursor and offset > 0:
+        query = query.offset(offset)
+    products = (await db.execute(query)).scalars().all()
+    next_cursor = next_page_cursor(products, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     for p in products:
         for m in p.media:
             if m.is_primary:
                 try:
                     m.presigned_url = media_db.public_media_url(m.id)
+                    m.thumbnail_url = media_db.public_media_url(m.id, size="thumb")
                 except Exception:
                     m.presigned_url = None
         p.farm_name = p.farm.name if p.farm else None
@@ -380,27 +443,26 @@ def list_products(q: Optional[str] = None, limit: int = 50, offset: int = 0, db:
 
 
 @router.get("/{product_id}", response_model=ProductOut)
-def get_product(product_id: int, db: Session = Depends(get_db)):
+async def get_product(product_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Получение конкретного продукта по ID.
     
     Args:
         product_id (int): ID продукта.
-        db (Session): Сессия базы данных.
+        db (AsyncSession): Асинхронная сессия базы данных.
         
     Returns:
         ProductOut: Данные продукта.
     """
-    product = db.query(Product).options(
-        joinedload(Product.media), 
-        joinedload(Product.farm),
-        joinedload(Product.sensor_devices)  
-    ).filter(Product.id == product_id, Product.is_active == True).first()
+    product = (await db.execute(
+        select(Product).options(*PRODUCT_OUT_OPTIONS).filter(Product.id == product_id, Product.is_active == True)
+    )).scalars().first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     for m in product.media:
         try:
             m.presigned_url = media_db.public_media_url(m.id)
+            m.thumbnail_url = media_db.public_media_url(m.id, size="thumb")
         except Exception:
             m.presigned_url = None
     product.farm_name = product.farm.name if product.farm else None
@@ -464,6 +526,7 @@ def update_product(product_id: int, payload: ProductUpdate, current_user: UserMo
     for m in product.media:
         try:
             m.presigned_url = media_db.public_media_url(m.id)
+            m.thumbnail_url = media_db.public_media_url(m.id, size="thumb")
         except Exception:
             m.presigned_url = None
     product.farm_name = product.farm.name if product.farm else None
@@ -486,12 +549,17 @@ def delete_product(product_id: int, current_user: UserModel = Depends(get_curren
     _require_owner_or_admin(current_user, product)
 
     try:
+        # Медиа удаляются каскадно — освобождаем их блобы и объекты
+        cleanup = media_db.prepare_media_delete(db, ProductMedia.product_id == product_id)
         db.delete(product)
         db.commit()
     except Exception as exc:
         db.rollback()
         logger.exception("Failed to delete product %s: %s", product_id, exc)
         raise HTTPException(status_code=500, detail="Failed to delete product")
+    media_db.finish_media_delete(db, cleanup)
+    # Датчики продукта удаляются каскадно — сбрасываем кеш аутентификации датчиков
+    invalidate_sensor_cache()
     return {}
 
 
@@ -512,6 +580,32 @@ def get_passport(product_id: int, db: Session = Depends(get_db)):
     if not passport:
         raise HTTPException(status_code=404, detail="Passport not found")
     return passport
+
+
+@router.get("/{product_id}/passport/ai-recommendation")
+def get_ai_recommendation_status(product_id: int, db: Session = Depends(get_db)):
+    """
+    Статус фоновой генерации ИИ рекомендации для паспорта продукта.
+
+    Args:
+        product_id (int): ID продукта.
+        db (Session): Сессия базы данных.
+
+    Returns:
+        dict: Статус последнего задания (pending/running/done/failed или none) и рекомендация, если она готова.
+    """
+    passport = db.query(ProductPassport).filter(ProductPassport.product_id == product_id).first()
+    if not passport:
+        raise HTTPException(status_code=404, detail="Passport not found")
+    job = latest_job(db, product_id)
+    return {
+        "status": job.status if job else "none",
+        "attempts": job.attempts if job else 0,
+        "last_error": job.last_error if job else None,
+        "recommendation": (passport.data or {}).get(RECOMMENDATION_FIELD),
+    }
+
+
 @router.post("/{product_id}/passport", response_model=ProductPassportOut, status_code=201)
 def upsert_passport(product_id: int, payload: ProductPassportCreate = Body(...), current_user: UserModel = Depends(get_current_user), db: Session = Depends(get_db)):
     """
@@ -555,42 +649,9 @@ def upsert_passport(product_id: int, payload: ProductPassportCreate = Body(...),
             logger.exception("Failed to update passport for product %s: %s", product_id, exc)
             raise HTTPException(status_code=500, detail="Failed to update passport")
         
-        # Генерация ИИ рекомендации для собранных товаров
-        if not product.is_growing:
-            try:
-                existing_recommendation = passport.data.get("Краткая рекомендация от ИИ") if passport.data else None
-                if not existing_recommendation or existing_recommendation.strip() == "":
-                    passport_data_for_ai = {
-                        "origin": passport.origin,
-                        "variety": passport.variety,
-                        "harvest_date": passport.harvest_date.isoformat() if passport.harvest_date else None,
-                        "certifications": passport.certifications or [],
-                        "data": passport.data or {}
-                    }
-                    
-                    recommendation = ai_recommendation.generate_product_recommendation(
-                        product_name=product.name,
-                        product_category=product.category or "",
-                        short_description=product.short_description or "",
-                        passport_data=passport_data_for_ai
-                    )
-                    
-                    if recommendation:
-                        passport_data_update = passport.data.copy() if passport.data else {}
-                        passport_data_update["Краткая рекомендация от ИИ"] = recommendation
-                        passport.data = passport_data_update
-                        db.add(passport)
-                        try:
-                            db.commit()
-                            db.refresh(passport)
-                            logger.info(f"Successfully generated AI recommendation for product {product_id}")
-                        except Exception as exc:
-                            db.rollback()
-                            logger.exception(f"Failed to save AI recommendation for product {product_id}: {exc}")
-                    else:
-                        logger.warning(f"Failed to generate AI recommendation for product {product_id}")
-            except Exception as exc:
-                logger.exception(f"Error generating AI recommendation for product {product_id}: {exc}")
+        # Генерация ИИ рекомендации для собранных товаров — в фоновой очереди
+        if needs_recommendation(product, passport):
+            enqueue_recommendation(db, product_id)
         
         return passport
 
@@ -605,42 +666,9 @@ def upsert_passport(product_id: int, payload: ProductPassportCreate = Body(...),
         logger.exception("Failed to create passport for product %s: %s", product_id, exc)
         raise HTTPException(status_code=500, detail="Failed to create passport")
     
-    # Генерация ИИ рекомендации для собранных товаров после создания паспорта
-    if not product.is_growing:
-        try:
-            existing_recommendation = passport.data.get("Краткая рекомендация от ИИ") if passport.data else None
-            if not existing_recommendation or existing_recommendation.strip() == "":
-                passport_data_for_ai = {
-                    "origin": passport.origin,
-                    "variety": passport.variety,
-                    "harvest_date": passport.harvest_date.isoformat() if passport.harvest_date else None,
-                    "certifications": passport.certifications or [],
-                    "data": passport.data or {}
-                }
-                
-                recommendation = ai_recommendation.generate_product_recommendation(
-                    product_name=product.name,
-                    product_category=product.category or "",
-                    short_description=product.short_description or "",
-                    passport_data=passport_data_for_ai
-                )
-                
-                if recommendation:
-                    passport_data_update = passport.data.copy() if passport.data else {}
-                    passport_data_update["Краткая рекомендация от ИИ"] = recommendation
-                    passport.data = passport_data_update
-                    db.add(passport)
-                    try:
-                        db.commit()
-                        db.refresh(passport)
-                        logger.info(f"Successfully generated AI recommendation for product {product_id}")
-                    except Exception as exc:
-                        db.rollback()
-                        logger.exception(f"Failed to save AI recommendation for product {product_id}: {exc}")
-                else:
-                    logger.warning(f"Failed to generate AI recommendation for product {product_id}")
-        except Exception as exc:
-            logger.exception(f"Error generating AI recommendation for product {product_id}: {exc}")
+    # Генерация ИИ рекомендации для собранных товаров после создания паспорта — в фоновой очереди
+    if needs_recommendation(product, passport):
+        enqueue_recommendation(db, product_id)
     
     return passport
 
@@ -668,9 +696,80 @@ def presign_media(product_id: int, payload: ProductMediaIn, db: Session = Depend
 
     filename = payload.filename or "upload.bin"
     object_key = media_db.gen_object_key(product_id=product_id, filename=filename)
-    media_db.create_staged_placeholder(db=db, object_key=object_key, product_id=product_id, filename=filename, mime_type=getattr(payload, "mime_type", "application/octet-stream"))
+
+    # Файл с тем же содержимым уже есть у владельца продукта — загрузка не нужна, сразу confirm
+    sha256 = getattr(payload, "sha256", None)
+    blob = media_db.find_reusable_blob(db, sha256, owner_id=product.owner_id) if sha256 else None
+    if blob is not None and (payload.size is None or payload.size == blob.size):
+        media_db.create_staged_from_blob(db=db, object_key=object_key, product_id=product_id, filename=filename, blob=blob, mime_type=getattr(payload, "mime_type", None))
+        return {"object_key": object_key, "upload_url": None, "upload_required": False}
+
+    media_db.create_staged_placeholder(db=db, object_key=object_key, product_id=product_id, filename=filename, mime_type=getattr(payload, "mime_type", "application/octet-stream"), total_size=getattr(payload, "size", None))
     upload_url = getattr(payload, "upload_url", None) or f"/api/products/{product_id}/media/upload?object_key={object_key}"
-    return {"object_key": object_key, "upload_url": upload_url}
+    # upload_url принимает файл целиком (POST/PUT) или частями (PATCH с Upload-Offset, HEAD — текущее смещение)
+    return {"object_key": object_key, "upload_url": upload_url, "upload_required": True, "chunk_size": media_db.MEDIA_UPLOAD_CHUNK_SIZE}
+
+
+async def _iter_upload_file(upload) -> AsyncIterator[bytes]:
+    # UploadFile хранится Starlette во временном файле — читаем его частями
+    while True:
+        chunk = await upload.read(media_db.MEDIA_UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _store_upload_stream(db: Session, object_key: str, product_id: int, filename: str, mime: str, chunks: AsyncIterator[bytes]) -> int:
+    """
+    Записывает поток загрузки в хранилище частями по MEDIA_UPLOAD_CHUNK_SIZE,
+    не держа файл целиком в памяти.
+
+    Последняя часть всегда остается в буфере и передается с полным размером файла:
+    хранилище принимает ее меньше min_part_size, а загрузка завершается тем же вызовом.
+
+    Returns:
+        int: Количество записанных байт.
+
+    Raises:
+        HTTPException: 400 для пустого или некорректного файла (в том числе размер
+            не совпал с указанным в presign), 409 при параллельной загрузке того же object_key.
+    """
+    await run_in_threadpool(media_db.begin_chunked_upload, db, object_key, product_id, filename, mime)
+    offset = 0
+    buffer = bytearray()
+    try:
+        async for piece in chunks:
+            buffer += piece
+            while len(buffer) > media_db.MEDIA_UPLOAD_CHUNK_SIZE:
+                data = bytes(buffer[:media_db.MEDIA_UPLOAD_CHUNK_SIZE])
+                del buffer[:media_db.MEDIA_UPLOAD_CHUNK_SIZE]
+                await run_in_threadpool(media_db.append_upload_chunk, db, object_key, offset, data)
+                offset += len(data)
+        if not offset and not buffer:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        total_size = offset + len(buffer)
+        staged = await run_in_threadpool(media_db.append_upload_chunk, db, object_key, offset, bytes(buffer), None, total_size)
+        if staged.upload_state != media_db.UPLOAD_COMPLETE:
+            await run_in_threadpool(media_db.complete_chunked_upload, db, object_key)
+        offset = total_size
+    except media_db.UploadConflict as exc:
+        # Запись уже принадлежит другой загрузке этого object_key — не отменяем ее
+        raise HTTPException(status_code=409, detail=str(exc))
+    except BaseException as exc:
+        await run_in_threadpool(media_db.abort_chunked_upload, db, object_key)
+        if isinstance(exc, ValueError):
+            raise HTTPException(status_code=400, detail=str(exc))
+        raise
+    return offset
+
+
+async def _require_upload_access(db: Session, product_id: int, current_user: Principal) -> Product:
+    product = await run_in_threadpool(lambda: db.query(Product).filter(Product.id == product_id).first())
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if product.owner_id != int(current_user.id) and not getattr(current_user, "is_admin", False):
+        raise HTTPException(status_code=403, detail="Not allowed to upload for this product")
+    return product
 
 
 @router.api_route("/{product_id}/media/upload", methods=["POST", "PUT"])
@@ -679,27 +778,29 @@ async def upload_media(
     request: Request,
     file: UploadFile | None = File(None),
     object_key: str | None = Query(None),
-    current_user: UserModel = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db),
 ):
     """
     Поддержка multipart form upload или raw body; сохраняет staged upload.
+    Тело записывается в хранилище потоково, частями.
     
     Args:
         product_id (int): ID продукта.
         request (Request): Запрос FastAPI.
         file (UploadFile | None): Загружаемый файл.
         object_key (str | None): Ключ объекта.
-        current_user (UserModel): Текущий аутентифицированный пользователь.
+        current_user (Principal): Текущий аутентифицированный пользователь.
         db (Session): Сессия базы данных.
         
     Returns:
         JSONResponse: Ответ с object_key.
     """
     try:
-        
+        await _require_upload_access(db, product_id, current_user)
+
         if file is not None:
-            data = await file.read()
+            chunks = _iter_upload_file(file)
             filename = file.filename or "upload"
             mime = file.content_type or "application/octet-stream"
         else:
@@ -709,15 +810,13 @@ async def upload_media(
                 f = form.get("file")
                 if f is None:
                     raise HTTPException(status_code=400, detail="file field is required")
-                data = await f.read()
+                chunks = _iter_upload_file(f)
                 filename = getattr(f, "filename", "upload")
                 mime = getattr(f, "content_type", "application/octet-stream")
             else:
-                data = await request.body()
-                if not data:
-                    raise HTTPException(status_code=400, detail="empty body")
                 if not object_key:
                     raise HTTPException(status_code=400, detail="object_key query param required for raw upload")
+                chunks = request.stream()
                 filename = object_key.split("/")[-1]
                 mime = content_type or "application/octet-stream"
 
@@ -727,16 +826,11 @@ async def upload_media(
             except Exception:
                 object_key = f"{product_id}/{uuid4().hex}_{filename}"
 
-        product = db.query(Product).filter(Product.id == product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        if product.owner_id != int(current_user.id) and not getattr(current_user, "is_admin", False):
-            raise HTTPException(status_code=403, detail="Not allowed to upload for this product")
+        staged = await run_in_threadpool(media_db.get_staged_by_object_key, db, object_key)
+        if staged is not None and int(staged.product_id) != int(product_id):
+            raise HTTPException(status_code=400, detail="object_key does not belong to the given product")
 
-        if not data:
-            raise HTTPException(status_code=400, detail="Empty upload")
-
-        staged = media_db.store_staged_upload(db=db, object_key=object_key, product_id=product_id, filename=filename, content=data, mime_type=mime)
+        await _store_upload_stream(db, object_key, product_id, filename, mime, chunks)
         return JSONResponse({"object_key": object_key}, status_code=200)
 
     except HTTPException:
@@ -746,6 +840,166 @@ async def upload_media(
         raise HTTPException(status_code=500, detail="Failed to store upload")
 
 
+def _upload_headers(staged) -> dict:
+    headers = {
+        "Upload-Offset": str(staged.received_bytes or 0),
+        "Upload-State": staged.upload_state,
+        "Cache-Control": "no-store",
+    }
+    if staged.total_size is not None:
+        headers["Upload-Length"] = str(staged.total_size)
+    return headers
+
+
+def _parse_upload_checksum(value: Optional[str]) -> Optional[bytes]:
+    """
+    Заголовок Upload-Checksum: "sha256 <base64 digest>".
+    """
+    if not value:
+        return None
+    algorithm, _, encoded = value.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise HTTPException(status_code=400, detail="Only sha256 Upload-Checksum is supported")
+    try:
+        digest = base64.b64decode(encoded.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid Upload-Checksum")
+    if len(digest) != 32:
+        raise HTTPException(status_code=400, detail="Invalid Upload-Checksum")
+    return digest
+
+
+def _parse_non_negative_header(request: Request, name: str, required: bool = False) -> Optional[int]:
+    value = request.headers.get(name)
+    if value is None:
+        if required:
+            raise HTTPException(status_code=400, detail=f"{name} header required")
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} header")
+    return number
+
+
+async def _staged_for_product(db: Session, product_id: int, object_key: str):
+    staged = await run_in_threadpool(media_db.get_staged_by_object_key, db, object_key)
+    if staged is None:
+        raise HTTPException(status_code=404, detail="staged upload not found")
+    if int(staged.product_id) != int(product_id):
+        raise HTTPException(status_code=400, detail="object_key does not belong to the given product")
+    return staged
+
+
+@router.head("/{product_id}/media/upload")
+async def upload_media_status(
+    product_id: int,
+    object_key: str = Query(...),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db),
+):
+    """
+    Состояние загрузки частями: сколько байт уже получено (Upload-Offset) —
+    с этого места клиент продолжает после обрыва.
+    
+    Args:
+        product_id (int): ID продукта.
+        object_key (str): Ключ объекта.
+        current_user (Principal): Текущий аутентифицированный пользователь.
+        db (Session): Сессия базы данных.
+        
+    Returns:
+        Response: Пустой ответ с заголовками Upload-Offset, Upload-Length, Upload-State.
+    """
+    await _require_upload_access(db, product_id, current_user)
+    staged = await _staged_for_product(db, product_id, object_key)
+    return Response(status_code=200, headers=_upload_headers(staged))
+
+
+@router.patch("/{product_id}/media/upload")
+async def upload_media_chunk(
+    product_id: int,
+    request: Request,
+    object_key: str = Query(...),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db),
+):
+    """
+    Прием одной части загрузки. Заголовки:
+      - Upload-Offset (обязательный) — смещение части; должно совпадать с уже полученным;
+      - Upload-Length — полный размер файла (если не передан в presign);
+      - Upload-Checksum: sha256 <base64> — контрольная сумма части.
+    Часть с Upload-Offset: 0 начинает загрузку (начать заново можно после DELETE). Когда получены все
+    Upload-Length байт, загрузка завершается и ее можно подтвердить (confirm).
+    
+    Args:
+        product_id (int): ID продукта.
+        request (Request): Запрос FastAPI (тело — байты части).
+        object_key (str): Ключ объекта из presign.
+        current_user (Principal): Текущий аутентифицированный пользователь.
+        db (Session): Сессия базы данных.
+        
+    Returns:
+        JSONResponse: object_key, offset и признак завершения; 409 с актуальным Upload-Offset при рассинхронизации.
+    """
+    await _require_upload_access(db, product_id, current_user)
+    offset = _parse_non_negative_header(request, "Upload-Offset", required=True)
+    total_size = _parse_non_negative_header(request, "Upload-Length")
+    checksum = _parse_upload_checksum(request.headers.get("Upload-Checksum"))
+    staged = await _staged_for_product(db, product_id, object_key)
+
+    # Часть читается в ограниченный буфер: размер одной части, а не всего файла
+    data = bytearray()
+    async for piece in request.stream():
+        data += piece
+        if len(data) > media_db.MEDIA_UPLOAD_MAX_CHUNK_SIZE:
+            raise HTTPException(status_code=413, detail=f"Chunk exceeds {media_db.MEDIA_UPLOAD_MAX_CHUNK_SIZE} bytes")
+
+    try:
+        if offset == 0 and staged.upload_state != media_db.UPLOAD_UPLOADING:
+            staged = await run_in_threadpool(
+                media_db.begin_chunked_upload, db, object_key, product_id, staged.filename, staged.mime_type,
+                total_size if total_size is not None else staged.total_size,
+            )
+        staged = await run_in_threadpool(media_db.append_upload_chunk, db, object_key, offset, bytes(data), checksum, total_size)
+    except media_db.UploadConflict as exc:
+        return JSONResponse({"detail": str(exc), "offset": exc.offset}, status_code=409, headers={"Upload-Offset": str(exc.offset)})
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Exception as exc:
+        logger.exception("Chunk upload failed for product %s, object_key=%s: %s", product_id, object_key, exc)
+        raise HTTPException(status_code=500, detail="Failed to store upload chunk")
+
+    return JSONResponse(
+        {"object_key": object_key, "offset": staged.received_bytes, "complete": staged.upload_state == media_db.UPLOAD_COMPLETE},
+        headers=_upload_headers(staged),
+    )
+
+
+@router.delete("/{product_id}/media/upload", status_code=204)
+async def abort_media_upload(
+    product_id: int,
+    object_key: str = Query(...),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db),
+):
+    """
+    Отмена неподтвержденной загрузки: части удаляются из хранилища вместе со staged записью.
+    
+    Args:
+        product_id (int): ID продукта.
+        object_key (str): Ключ объекта.
+        current_user (Principal): Текущий аутентифицированный пользователь.
+        db (Session): Сессия базы данных.
+    """
+    await _require_upload_access(db, product_id, current_user)
+    await _staged_for_product(db, product_id, object_key)
+    await run_in_threadpool(media_db.abort_chunked_upload, db, object_key)
+    return Response(status_code=204)
+
+
 @router.post("/{product_id}/media/confirm", status_code=201)
 def confirm_media_upload(product_id: int, payload: ProductMediaConfirm = Body(...), db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
     """
@@ -775,6 +1029,8 @@ def confirm_media_upload(product_id: int, payload: ProductMediaConfirm = Body(..
         raise HTTPException(status_code=404, detail="staged upload not found")
     if int(staged.product_id) != int(product_id):
         raise HTTPException(status_code=400, detail="object_key does not belong to the given product")
+    if staged.upload_state == media_db.UPLOAD_UPLOADING:
+        raise HTTPException(status_code=409, detail=f"upload is incomplete ({staged.received_bytes} bytes received)")
 
     try:
         media = media_db.create_media_from_staged(db=db, object_key=object_key, is_primary=bool(getattr(payload, "is_primary", False)), meta=(getattr(payload, "meta", {}) or {}), mime_type=getattr(payload, "mime_type", None))
@@ -786,6 +1042,10 @@ def confirm_media_upload(product_id: int, payload: ProductMediaConfirm = Body(..
         logger.exception("Failed to create media from staged: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create media")
 
+    # Размеры и уменьшенные копии изображения — в фоновом пуле процессов
+    if media_variants.is_image(media.mime_type):
+        schedule_media_variants(media.id)
+
     out = {
         "id": media.id,
         "product_id": media.product_id,
@@ -816,66 +1076,188 @@ def delete_media(product_id: int, media_id: int, current_user: UserModel = Depen
     _require_owner_or_admin(current_user, product)
 
     try:
+        cleanup = media_db.prepare_media_delete(db, ProductMedia.id == media_id)
         db.delete(media)
         db.commit()
     except Exception as exc:
         db.rollback()
         logger.exception("Failed to delete media record %s: %s", media_id, exc)
         raise HTTPException(status_code=500, detail="Failed to delete media")
+    media_db.finish_media_delete(db, cleanup)
     return {}
 
+def _http_date(value: Optional[datetime]) -> Optional[str]:
+    """
+    Дата в формате HTTP (RFC 7231); наивные datetime считаются UTC.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Слабое сравнение (RFC 7232, 2.3.2): W/ не учитывается
+    values = [value.strip() for value in header.split(",")]
+    return "*" in values or any(value.removeprefix("W/") == etag for value in values)
+
+
+def _not_modified(request: Request, etag: str, modified_at: Optional[datetime]) -> bool:
+    """
+    Проверяет условия If-None-Match / If-Modified-Since (If-Modified-Since — только без If-None-Match).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and modified_at is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if modified_at.tzinfo is None:
+            modified_at = modified_at.replace(tzinfo=timezone.utc)
+        return modified_at.replace(microsecond=0) <= since
+    return False
+
+
+def _if_range_matches(request: Request, etag: str, last_modified: Optional[str]) -> bool:
+    # If-Range: диапазон отдается только для неизмененного представления
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    return last_modified is not None and if_range == last_modified
+
+
+def _parse_byte_range(header: str, size: int):
+    """
+    Разбирает заголовок Range с одним диапазоном.
+
+    Returns:
+        (start, end) включительно; None — заголовок игнорируется (отдается весь файл);
+        False — диапазон неудовлетворим (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return False
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return False
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
 @router.get("/media/{media_id}/file")
-def serve_media_file(media_id: int, db: Session = Depends(get_db), current_user: Optional[UserModel] = Depends(get_current_user_optional)):
+async def serve_media_file(media_id: int, request: Request, variant: Optional[str] = Query(None, alias="size"), db: AsyncSession = Depends(get_async_db), current_user: Optional[Principal] = Depends(get_current_principal_optional)):
     """
-    Обслуживание медиафайла.
+    Обслуживание медиафайла: потоковая отдача, Range (206), ETag/Last-Modified и условные запросы (304).
+    С ?size=thumb|medium отдается уменьшенная копия в формате по заголовку Accept (AVIF/WebP/JPEG);
+    пока копии нет, отдается оригинал с коротким max-age, чтобы копия подхватилась после генерации.
     
     Args:
         media_id (int): ID медиафайла.
-        db (Session): Сессия базы данных.
-        current_user (Optional[UserModel]): Текущий аутентифицированный пользователь.
+        request (Request): Запрос (заголовки Accept, If-None-Match, If-Modified-Since, Range, If-Range).
+        variant (Optional[str]): Уменьшенная копия (параметр size).
+        db (AsyncSession): Асинхронная сессия базы данных.
+        current_user (Optional[Principal]): Текущий аутентифицированный пользователь.
         
     Returns:
-        Response: Ответ с содержимым файла.
+        Response: Содержимое файла (200/206) или 304 Not Modified.
     """
-    media = db.query(ProductMedia).filter(ProductMedia.id == media_id).first()
-    if not media:
+    # Метаданные медиафайла и права доступа продукта — одним запросом, без колонки content
+    row = (await db.execute(
+        select(
+            ProductMedia.id, ProductMedia.object_key, ProductMedia.filename, ProductMedia.mime_type,
+            ProductMedia.storage_backend, ProductMedia.content_sha256, ProductMedia.content_size,
+            ProductMedia.blob_id, ProductMedia.created_at, Product.is_active, Product.owner_id,
+        )
+        .join(Product, Product.id == ProductMedia.product_id)
+        .filter(ProductMedia.id == media_id)
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Media not found")
-    product = db.query(Product).filter(Product.id == media.product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
 
     # Публичный продукт — доступен без авторизации
-    if not getattr(product, "is_active", False):
+    if not row.is_active:
         if not current_user:
             raise HTTPException(status_code=403, detail="Forbidden")
-        if current_user.role != "admin" and current_user.id != product.owner_id:
+        if current_user.role != "admin" and current_user.id != row.owner_id:
             raise HTTPException(status_code=403, detail="Forbidden")
 
-    content = getattr(media, "content", b"") or b""
-    try:
-        if isinstance(content, memoryview):
-            content_bytes = content.tobytes()
-        elif isinstance(content, bytearray):
-            content_bytes = bytes(content)
-        elif isinstance(content, str):
-            content_bytes = content.encode("utf-8")
-        else:
-            content_bytes = content
-    except Exception:
-        logger.exception("Failed to coerce media.content to bytes for media_id=%s", media_id)
-        content_bytes = b""
-
-    media_type = media.mime_type or "application/octet-stream"
-    filename = getattr(media, "filename", "file")
-
-    if filename is None:
-        filename = "file"
+    source_model, source_id = ProductMedia, media_id
+    if row.blob_id is not None and (row.storage_backend or "db") == "db":
+        # Общий блоб в Postgres — байты в media_blobs.content
+        source_model, source_id = MediaBlob, row.blob_id
+    backend, object_key, media_type = row.storage_backend, row.object_key, row.mime_type or "application/octet-stream"
+    sha, size, modified_at = row.content_sha256, row.content_size, row.created_at
+    filename = row.filename or "file"
     if isinstance(filename, bytes):
         try:
             filename = filename.decode("utf-8")
         except Exception:
             filename = filename.decode("latin-1", "ignore")
 
+    vary = {}
+    max_age = MEDIA_CACHE_MAX_AGE
+    if variant is not None:
+        if variant not in VARIANT_SIZES:
+            raise HTTPException(status_code=400, detail=f"size must be one of: {', '.join(VARIANT_SIZES)}")
+        vary = {"Vary": "Accept"}
+        variants = (await db.execute(
+            select(
+                ProductMediaVariant.id, ProductMediaVariant.format, ProductMediaVariant.object_key,
+                ProductMediaVariant.storage_backend, ProductMediaVariant.content_sha256, ProductMediaVariant.content_size,
+                ProductMediaVariant.mime_type, ProductMediaVariant.created_at,
+            ).filter(ProductMediaVariant.media_id == media_id, ProductMediaVariant.variant == variant)
+        )).all()
+        fmt = pick_format(request.headers.get("accept"), [v.format for v in variants])
+        if fmt is not None:
+            chosen = next(v for v in variants if v.format == fmt)
+            source_model, source_id = ProductMediaVariant, chosen.id
+            backend, object_key, media_type = chosen.storage_backend, chosen.object_key, chosen.mime_type
+            sha, size, modified_at = chosen.content_sha256, chosen.content_size, chosen.created_at
+            filename = f"{PurePath(filename).stem or 'file'}-{variant}.{VARIANT_EXTENSIONS[fmt]}"
+        else:
+            max_age = min(max_age, MEDIA_VARIANT_FALLBACK_MAX_AGE)
+
+    if sha is None or size is None:
+        # Запись создана до появления хеша — вычисляем один раз и сохраняем
+        try:
+            digest = await run_in_threadpool(media_db.ensure_content_digest, media_id)
+        except ObjectNotFound:
+            logger.error("Media %s object %s is missing in %s", media_id, object_key, backend)
+            raise HTTPException(status_code=404, detail="Media content not found")
+        if digest is None:
+            raise HTTPException(status_code=404, detail="Media not found")
+        sha, size = digest
+
+    etag = f'"{sha}"'
+    last_modified = _http_date(modified_at)
+    cache_control = f"public, max-age={max_age}" if row.is_active else "private, max-age=0, must-revalidate"
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes", **vary}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+
+    if _not_modified(request, etag, modified_at):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
     # ascii fallback — удаляем символы вне ASCII; если пусто, используем "file"
     ascii_filename = (filename.encode("ascii", "ignore").decode("ascii") or "file")
 
@@ -883,6 +1265,36 @@ def serve_media_file(media_id: int, db: Session = Depends(get_db), current_user:
     quoted_filename = _urlquote(filename, safe="")
 
     # Формируем Content-Disposition: ASCII-fallback + filename* (UTF-8)
-    content_disp = f'inline; filename="{ascii_filename}"; filename*=UTF-8\'\'{quoted_filename}'
-
-    return Response(content=content_bytes, media_type=media_type, headers={"Content-Disposition": content_disp})
+    headers["Content-Disposition"] = f'inline; filename="{ascii_filename}"; filename*=UTF-8\'\'{quoted_filename}'
+
+    status_code = status.HTTP_200_OK
+    start, end = 0, size - 1
+    range_header = request.headers.get("range")
+    if range_header and size and _if_range_matches(request, etag, last_modified):
+        byte_range = _parse_byte_range(range_header, size)
+        if byte_range is False:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1 if size else 0)
+    if not size:
+        return Response(content=b"", media_type=media_type, headers=headers)
+
+    chunks = media_db.iter_stored_content(backend, object_key, source_id, start=start, end=end, model=source_model)
+    try:
+        # Первая часть читается до отправки заголовков, чтобы отсутствующий объект дал 404, а не обрыв ответа
+        first_chunk = await run_in_threadpool(next, chunks, b"")
+    except ObjectNotFound:
+        logger.error("Media %s object %s is missing in %s", media_id, object_key, backend)
+        raise HTTPException(status_code=404, detail="Media content not found")
+
+    def body():
+        if first_chunk:
+            yield first_chunk
+        yield from chunks
+
+    return StreamingResponse(body(), status_code=status_code, media_type=media_type, headers=headers)
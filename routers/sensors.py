@@ -4,22 +4,36 @@ Sensors Router
 --------------
 API для работы с датчиками и их показаниями.
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, func, select, tuple_, DateTime
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional
+from typing import List, Optional, Iterator
+import csv
+import io
+import json
 import logging
+import zlib
+from bisect import bisect_left
 from datetime import datetime, timedelta
 import pytz
-from database.database import get_db
+from database.database import get_db, get_async_db, SessionLocal
 from models.sensor import SensorDevice, SensorReading
 from schemas.sensor import (
     SensorReadingCreate, 
     SensorReadingOut,
+    SensorReadingBatchCreate,
+    SensorReadingBatchOut,
+    SensorReadingBucketOut,
     SensorDeviceCreate,
     SensorDeviceOut
 )
-from utils.sensor_auth import verify_sensor_api_key, hash_api_key
+from utils.sensor_auth import verify_sensor_api_key, hash_api_key, invalidate_sensor_cache
+from utils.reading_rate_limit import get_last_reading_store
+from utils import sensor_rollups
+from utils.cursors import encode_cursor, decode_cursor, paginate_desc, next_page_cursor
 from utils.auth import get_current_user, get_current_user_optional
 from models.user import User as UserModel
 
@@ -28,24 +42,59 @@ router = APIRouter(prefix="/api/sensors", tags=["sensors"])
 
 # Пока минута для теста, потом 10 надо сделать 
 MIN_READING_INTERVAL = timedelta(minutes=1)
+# Допустимое расхождение часов датчика "в будущее" для пакетного приема
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+# Пространство ключей advisory lock пакетного приема (второй ключ — ID датчика)
+BATCH_LOCK_NAMESPACE = 7301
+
+# Допустимые интервалы агрегации показаний
+AGGREGATE_BUCKETS = {
+    "1m": timedelta(minutes=1),
+    "5m": timedelta(minutes=5),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+# Начало отсчета интервалов для date_bin
+AGGREGATE_ORIGIN = datetime(2000, 1, 1)
+# Ограничение на количество интервалов в одном ответе
+MAX_AGGREGATE_BUCKETS = 5000
+AGGREGATE_METRICS = sensor_rollups.METRICS
+# Интервалы, которые отдаются из предагрегированных таблиц
+ROLLUP_BUCKETS = {"1h": "hour", "1d": "day"}
+
+# Экспорт истории показаний
+EXPORT_BATCH_SIZE = 2000          # строк за одну выборку из серверного курсора
+EXPORT_FLUSH_BYTES = 64 * 1024    # размер порции, отправляемой клиенту
+EXPORT_COLUMNS = ("id", "created_at", "temperature", "ph", "salinity", "humidity", "raw_data")
 
 def get_moscow_time():
     moscow_tz = pytz.timezone('Europe/Moscow')
     return datetime.now(moscow_tz).replace(tzinfo=None)
 
 
+def _to_moscow_naive(value: datetime) -> datetime:
+    """
+    Приводит время датчика к московскому времени без tzinfo (формат хранения в БД).
+    Время без часового пояса считается уже московским.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(pytz.timezone('Europe/Moscow')).replace(tzinfo=None)
+
+
 @router.post("/readings", response_model=SensorReadingOut, status_code=201)
-def create_sensor_reading(
+async def create_sensor_reading(
     payload: SensorReadingCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Прием показаний от датчика.
     Аутентификация по API-ключу в теле запроса.
     Rate limiting: не чаще чем раз в 10 минут.(ПОКА 1 МИНУТА, НО НА ПРОДЕ ОНЛИ 10, ИНАЧЕ БД ОЧЕНЬ БЫСТРО КОНЕЦ ПРИДЕТ)
+    Работает на асинхронной сессии (asyncpg); синхронные утилиты вызываются через run_sync.
     """
     # 1. Аутентификация датчика
-    sensor = verify_sensor_api_key(db, payload.api_key)
+    sensor = await db.run_sync(verify_sensor_api_key, payload.api_key)
     if not sensor:
         logger.warning("Invalid API key attempt")
         raise HTTPException(
@@ -55,11 +104,8 @@ def create_sensor_reading(
     
     # 2. Проверка rate limiting (используем московское время)
     current_time = get_moscow_time()
-    last_reading = db.query(SensorReading).filter(
-        SensorReading.device_id == sensor.id
-    ).order_by(SensorReading.created_at.desc()).first()
-    
-    if last_reading and (current_time - last_reading.created_at) < MIN_READING_INTERVAL:
+    rate_store = get_last_reading_store()
+    if not await db.run_sync(rate_store.try_acquire, sensor.id, current_time, MIN_READING_INTERVAL):
         logger.warning(f"Rate limit exceeded for sensor {sensor.id}")
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -86,10 +132,17 @@ def create_sensor_reading(
     
     db.add(reading)
     try:
-        db.commit()
-        db.refresh(reading)
+        await db.run_sync(sensor_rollups.apply_readings, sensor.id, [{
+            "created_at": current_time,
+            "temperature": payload.temperature,
+            "ph": payload.ph,
+            "salinity": payload.salinity,
+            "humidity": payload.humidity,
+        }])
+        await db.commit()
     except Exception as exc:
-        db.rollback()
+        await db.rollback()
+        rate_store.forget(sensor.id)
         logger.exception("Database error creating sensor reading: %s", exc)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -99,6 +152,116 @@ def create_sensor_reading(
     logger.info(f"Sensor reading saved for device {sensor.id} at {current_time}")
     return reading
 
+@router.post("/readings/batch", response_model=SensorReadingBatchOut, status_code=201)
+async def create_sensor_readings_batch(
+    payload: SensorReadingBatchCreate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Пакетный прием показаний от датчика (повторная отправка буфера после потери связи).
+    Аутентификация выполняется один раз на пакет.
+    Rate limiting не сравнивает показания с последним сохраненным: буфер, накопленный
+    офлайн, обычно старше него. Показание отсеивается, если оно ближе MIN_READING_INTERVAL
+    к предыдущему принятому из пакета или к уже сохраненному показанию рядом с ним
+    (повторная отправка того же буфера). Пакеты одного датчика обрабатываются по очереди
+    (advisory lock до конца транзакции), чтобы параллельные повторы не прошли оба.
+    Все строки пишутся одним multi-row INSERT в одной транзакции.
+    """
+    # 1. Аутентификация датчика (один раз на пакет)
+    sensor = await db.run_sync(verify_sensor_api_key, payload.api_key)
+    if not sensor:
+        logger.warning("Invalid API key attempt (batch)")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid sensor API key"
+        )
+
+    current_time = get_moscow_time()
+    latest_allowed = current_time + MAX_CLOCK_SKEW
+    rate_store = get_last_reading_store()
+
+    # 2. Нормализация времени, отсев показаний из будущего
+    stamped = []
+    out_of_window = 0
+    for item in payload.readings:
+        created_at = _to_moscow_naive(item.recorded_at) if item.recorded_at else current_time
+        if created_at > latest_allowed:
+            out_of_window += 1
+            continue
+        stamped.append((created_at, item))
+    stamped.sort(key=lambda pair: pair[0])
+    if not stamped:
+        raise HTTPException(status_code=400, detail="All readings have timestamps in the future")
+
+    # 3. Сохраненные показания рядом с пакетом — под блокировкой датчика до commit
+    await db.execute(select(func.pg_advisory_xact_lock(BATCH_LOCK_NAMESPACE, sensor.id)))
+    stored = (await db.execute(
+        select(SensorReading.created_at)
+        .filter(
+            SensorReading.device_id == sensor.id,
+            SensorReading.created_at > stamped[0][0] - MIN_READING_INTERVAL,
+            SensorReading.created_at < stamped[-1][0] + MIN_READING_INTERVAL,
+        )
+        .order_by(SensorReading.created_at)
+    )).scalars().all()
+
+    rows = []
+    rate_limited = 0
+    previous = None
+    for created_at, item in stamped:
+        if previous is not None and (created_at - previous) < MIN_READING_INTERVAL:
+            rate_limited += 1
+            continue
+        # Ближайшие сохраненные показания слева и справа
+        index = bisect_left(stored, created_at)
+        neighbours = stored[max(index - 1, 0):index + 1]
+        if any(abs(created_at - other) < MIN_READING_INTERVAL for other in neighbours):
+            rate_limited += 1
+            continue
+        rows.append({
+            "device_id": sensor.id,
+            "temperature": item.temperature,
+            "ph": item.ph,
+            "salinity": item.salinity,
+            "humidity": item.humidity,
+            "raw_data": item.raw_data,
+            "created_at": created_at,
+        })
+        previous = created_at
+
+    if not rows:
+        await db.rollback()
+        logger.warning(f"Rate limit exceeded for sensor {sensor.id} (batch of {len(payload.readings)})")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Readings can be submitted no more than once every {MIN_READING_INTERVAL.total_seconds()//60} minutes"
+        )
+
+    # 4. Запись одним multi-row INSERT в одной транзакции
+    try:
+        await db.execute(insert(SensorReading), rows)
+        await db.run_sync(sensor_rollups.apply_readings, sensor.id, rows)
+        await db.run_sync(rate_store.record, sensor.id, rows[-1]["created_at"])
+        await db.commit()
+    except Exception as exc:
+        await db.rollback()
+        rate_store.forget(sensor.id)
+        logger.exception("Database error creating sensor readings batch: %s", exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to save sensor readings"
+        )
+
+    logger.info(f"Sensor readings batch saved for device {sensor.id}: accepted={len(rows)} rate_limited={rate_limited} out_of_window={out_of_window}")
+    return SensorReadingBatchOut(
+        device_id=sensor.id,
+        accepted=len(rows),
+        rate_limited=rate_limited,
+        out_of_window=out_of_window,
+        first_created_at=rows[0]["created_at"],
+        last_created_at=rows[-1]["created_at"],
+    )
+
 @router.post("/devices", response_model=SensorDeviceOut, status_code=201)
 def register_sensor_device(
     payload: SensorDeviceCreate,
@@ -221,18 +384,22 @@ def toggle_sensor_device(
     sensor.is_active = not sensor.is_active
     db.commit()
     db.refresh(sensor)
+    invalidate_sensor_cache(sensor.api_key_hash)
     return sensor
 
 @router.get("/devices/{device_id}/readings", response_model=List[SensorReadingOut])
 def get_sensor_readings(
     device_id: int,
+    response: Response,
     limit: int = 15000,
     hours: Optional[int] = 24,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     Получение показаний датчика за указанный период 
     Используем московское время для фильтрации.
+    Keyset-пагинация: курсор следующей страницы возвращается в заголовке X-Next-Cursor.
     """
     sensor = db.query(SensorDevice).filter(SensorDevice.id == device_id).first()
     if not sensor:
@@ -246,9 +413,222 @@ def get_sensor_readings(
         since = current_time - timedelta(hours=hours)
         query = query.filter(SensorReading.created_at >= since)
     
-    readings = query.order_by(SensorReading.created_at.desc()).limit(limit).all()
+    try:
+        readings = paginate_desc(query, SensorReading.created_at, SensorReading.id, cursor, limit).all()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    next_cursor = next_page_cursor(readings, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return readings
 
+def _metric_stats(row, name: str) -> dict:
+    """
+    Собирает статистику метрики из строки агрегирующего запроса.
+    """
+    def _num(value):
+        return float(value) if value is not None else None
+    return {
+        "min": _num(row[f"{name}_min"]),
+        "avg": _num(row[f"{name}_avg"]),
+        "max": _num(row[f"{name}_max"]),
+        "count": int(row[f"{name}_count"] or 0),
+    }
+
+@router.get("/devices/{device_id}/readings/aggregate", response_model=List[SensorReadingBucketOut])
+def get_sensor_readings_aggregate(
+    device_id: int,
+    bucket: str = Query("5m", description="Интервал агрегации: 1m, 5m, 1h, 1d"),
+    hours: int = Query(24, ge=1, description="Период в часах"),
+    db: Session = Depends(get_db)
+):
+    """
+    Агрегированные показания датчика (min/avg/max/count по каждой метрике) за период.
+    Интервалы 1h/1d читаются из почасовых/посуточных агрегатов, остальные считаются
+    в SQL (date_bin). В ответ попадают только интервалы с данными.
+    """
+    step = AGGREGATE_BUCKETS.get(bucket)
+    if step is None:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(AGGREGATE_BUCKETS)}")
+    if timedelta(hours=hours) / step > MAX_AGGREGATE_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Too many buckets requested (max {MAX_AGGREGATE_BUCKETS})")
+
+    sensor = db.query(SensorDevice.id).filter(SensorDevice.id == device_id).first()
+    if not sensor:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    since = get_moscow_time() - timedelta(hours=hours)
+
+    # Часовые и суточные интервалы читаем из агрегатов (десятки строк вместо сотен тысяч);
+    # неполный первый интервал — по сырым показаниям, чтобы не захватить время до since
+    if bucket in ROLLUP_BUCKETS:
+        level = ROLLUP_BUCKETS[bucket]
+        first_full = sensor_rollups.first_full_bucket(since, level)
+        result = _raw_buckets(db, device_id, step, since, first_full) if first_full > since else []
+        for rollup in sensor_rollups.read_rollups(db, device_id, level, since):
+            item = {"bucket_start": rollup.bucket_start, "count": rollup.readings_count}
+            for name in AGGREGATE_METRICS:
+                total = getattr(rollup, f"{name}_sum")
+                count = getattr(rollup, f"{name}_count") or 0
+                item[name] = _metric_stats({
+                    f"{name}_min": getattr(rollup, f"{name}_min"),
+                    f"{name}_avg": (total / count) if count and total is not None else None,
+                    f"{name}_max": getattr(rollup, f"{name}_max"),
+                    f"{name}_count": count,
+                }, name)
+            result.append(item)
+        return result
+
+    return _raw_buckets(db, device_id, step, since)
+
+def _raw_buckets(db: Session, device_id: int, step: timedelta, since: datetime, until: Optional[datetime] = None) -> List[dict]:
+    """
+    Агрегирует сырые показания датчика по интервалам step (date_bin) в SQL.
+    """
+    bucket_start = func.date_bin(step, SensorReading.created_at, AGGREGATE_ORIGIN, type_=DateTime).label("bucket_start")
+    columns = [bucket_start, func.count().label("total")]
+    for name in AGGREGATE_METRICS:
+        column = getattr(SensorReading, name)
+        columns += [
+            func.min(column).label(f"{name}_min"),
+            func.avg(column).label(f"{name}_avg"),
+            func.max(column).label(f"{name}_max"),
+            func.count(column).label(f"{name}_count"),
+        ]
+
+    query = db.query(*columns).filter(
+        SensorReading.device_id == device_id,
+        SensorReading.created_at >= since,
+    )
+    if until is not None:
+        query = query.filter(SensorReading.created_at < until)
+    rows = query.group_by(bucket_start).order_by(bucket_start).all()
+
+    result = []
+    for row in rows:
+        mapping = row._mapping
+        item = {"bucket_start": mapping["bucket_start"], "count": int(mapping["total"])}
+        for name in AGGREGATE_METRICS:
+            item[name] = _metric_stats(mapping, name)
+        result.append(item)
+    return result
+
+def _export_value(value):
+    """
+    Приводит значение колонки к JSON-совместимому виду.
+    """
+    if value is None or isinstance(value, (int, str, dict, list)):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return float(value)
+
+def _iter_export(device_id: int, fmt: str, compress: bool, since: Optional[datetime],
+                 until: Optional[datetime], after: Optional[tuple], limit: Optional[int]) -> Iterator[bytes]:
+    """
+    Потоково выгружает показания датчика через серверный курсор.
+    Использует собственную сессию: она живет, пока клиент читает ответ.
+    Если достигнут limit и данные еще есть, последней строкой отдается курсор продолжения.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+
+    def _drain(final: bool = False) -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        if compressor is not None:
+            data = compressor.compress(data)
+            if final:
+                data += compressor.flush()
+        return data
+
+    db = SessionLocal()
+    try:
+        query = db.query(*(getattr(SensorReading, name) for name in EXPORT_COLUMNS)).filter(
+            SensorReading.device_id == device_id
+        )
+        if since is not None:
+            query = query.filter(SensorReading.created_at >= since)
+        if until is not None:
+            query = query.filter(SensorReading.created_at < until)
+        if after is not None:
+            query = query.filter(tuple_(SensorReading.created_at, SensorReading.id) > tuple_(*after))
+        query = query.order_by(SensorReading.created_at.asc(), SensorReading.id.asc()).yield_per(EXPORT_BATCH_SIZE)
+
+        if writer is not None:
+            writer.writerow(EXPORT_COLUMNS)
+
+        emitted = 0
+        last = None
+        for row in query:
+            if limit is not None and emitted >= limit:
+                next_cursor = encode_cursor(last.created_at, last.id)
+                if writer is not None:
+                    writer.writerow(["#next_cursor", next_cursor])
+                else:
+                    buffer.write(json.dumps({"next_cursor": next_cursor}) + "\n")
+                break
+            if writer is not None:
+                values = [_export_value(getattr(row, name)) for name in EXPORT_COLUMNS]
+                values[-1] = json.dumps(values[-1] or {}, ensure_ascii=False)
+                writer.writerow(values)
+            else:
+                record = {name: _export_value(getattr(row, name)) for name in EXPORT_COLUMNS}
+                buffer.write(json.dumps(record, ensure_ascii=False) + "\n")
+            emitted += 1
+            last = row
+            if buffer.tell() >= EXPORT_FLUSH_BYTES:
+                chunk = _drain()
+                if chunk:
+                    yield chunk
+        chunk = _drain(final=True)
+        if chunk:
+            yield chunk
+    finally:
+        db.close()
+
+@router.get("/devices/{device_id}/readings/export")
+def export_sensor_readings(
+    device_id: int,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="Формат: ndjson или csv"),
+    since: Optional[datetime] = Query(None, description="Начало периода (московское время)"),
+    until: Optional[datetime] = Query(None, description="Конец периода, не включительно"),
+    cursor: Optional[str] = Query(None, description="Курсор продолжения из предыдущей выгрузки"),
+    limit: Optional[int] = Query(None, ge=1, description="Максимальное количество строк"),
+    compress: bool = Query(False, alias="gzip", description="Сжать выгрузку gzip"),
+    db: Session = Depends(get_db)
+):
+    """
+    Потоковая выгрузка истории показаний датчика (NDJSON или CSV, опционально gzip).
+    Строки идут по возрастанию времени; память сервера не зависит от длины периода.
+    При указании limit выгрузка завершается строкой с курсором продолжения
+    (NDJSON: {"next_cursor": ...}, CSV: #next_cursor,...), который передается в cursor.
+    """
+    sensor = db.query(SensorDevice.id).filter(SensorDevice.id == device_id).first()
+    if not sensor:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    filename = f"sensor_{device_id}_readings.{fmt}"
+    media_type = "text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson"
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        _iter_export(device_id, fmt, compress, since, until, after, limit),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @router.post("/devices/{device_id}/assign-product/{product_id}")
 def assign_sensor_to_product(
     device_id: int,
@@ -283,4 +663,5 @@ def assign_sensor_to_product(
     
     sensor.product_id = product_id
     db.commit()
+    invalidate_sensor_cache(sensor.api_key_hash)
     return {"status": "success"}
\ No newline at end of file
@@ -67,6 +67,10 @@ class ProductMediaIn(BaseModel):
     filename: constr(strip_whitespace=True, min_length=3, max_length=255)
     mime_type: Optional[constr(strip_whitespace=True, min_length=3, max_length=100)] = None
     upload_url: Optional[str] = None
+    size: Optional[int] = Field(None, gt=0, description="Размер файла в байтах (для загрузки частями)")
+    sha256: Optional[constr(strip_whitespace=True, to_lower=True, pattern=r"^[0-9a-fA-F]{64}$")] = Field(
+        None, description="SHA-256 файла (hex): если такой файл уже загружен, загрузка не требуется"
+    )
 
 class ProductMediaConfirm(BaseModel):
     object_key: constr(strip_whitespace=True, min_length=5, max_length=1024)
@@ -81,7 +85,10 @@ class ProductMediaOut(BaseModel):
     mime_type: Optional[str] = None
     is_primary: bool
     meta: Dict[str, Any]
+    width: Optional[int] = None
+    height: Optional[int] = None
     presigned_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
 
     class Config:
         orm_mode = True
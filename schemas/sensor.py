@@ -8,12 +8,11 @@ from pydantic import BaseModel, Field, field_validator, ConfigDict
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
-class SensorReadingCreate(BaseModel):
+class SensorReadingValues(BaseModel):
     """
-    Схема для создания нового показания датчика.
-    Используется для приема данных от ESP32.
+    Значения показания датчика с проверкой диапазонов.
+    Общая часть для одиночного и пакетного приема.
     """
-    api_key: str = Field(..., min_length=20, max_length=100, description="API ключ датчика")
     temperature: Optional[float] = Field(None, ge=-50, le=100, description="Температура в °C")
     ph: Optional[float] = Field(None, ge=0, le=14, description="Уровень pH")
     salinity: Optional[float] = Field(None, ge=0, le=10000, description="Соленость почвы (ppm)")
@@ -31,6 +30,41 @@ class SensorReadingCreate(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class SensorReadingCreate(SensorReadingValues):
+    """
+    Схема для создания нового показания датчика.
+    Используется для приема данных от ESP32.
+    """
+    api_key: str = Field(..., min_length=20, max_length=100, description="API ключ датчика")
+
+# Максимальное количество показаний в одном пакете
+MAX_BATCH_READINGS = 1000
+
+class SensorReadingBatchItem(SensorReadingValues):
+    """
+    Одно показание из пакета.
+    ESP32 буферизует показания при потере Wi-Fi, поэтому время снятия передает сам датчик.
+    """
+    recorded_at: Optional[datetime] = Field(None, description="Время снятия показания (по умолчанию — время приема)")
+
+class SensorReadingBatchCreate(BaseModel):
+    """
+    Схема пакетного приема показаний от одного датчика.
+    """
+    api_key: str = Field(..., min_length=20, max_length=100, description="API ключ датчика")
+    readings: List[SensorReadingBatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_READINGS)
+
+class SensorReadingBatchOut(BaseModel):
+    """
+    Результат пакетного приема показаний.
+    """
+    device_id: int
+    accepted: int
+    rate_limited: int
+    out_of_window: int
+    first_created_at: Optional[datetime] = None
+    last_created_at: Optional[datetime] = None
+
 class SensorReadingOut(BaseModel):
     """
     Схема для возврата показаний датчика.
@@ -46,6 +80,26 @@ class SensorReadingOut(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class SensorMetricStats(BaseModel):
+    """
+    Статистика одной метрики в интервале агрегации.
+    """
+    min: Optional[float] = None
+    avg: Optional[float] = None
+    max: Optional[float] = None
+    count: int = 0
+
+class SensorReadingBucketOut(BaseModel):
+    """
+    Агрегированные показания датчика за один интервал (bucket).
+    """
+    bucket_start: datetime
+    count: int
+    temperature: SensorMetricStats
+    ph: SensorMetricStats
+    salinity: SensorMetricStats
+    humidity: SensorMetricStats
+
 class SensorDeviceCreate(BaseModel):
     """
     Схема для регистрации нового датчика (для админов).
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP Load Benchmark
+-------------------
+Нагрузочный прогон горячих маршрутов API с заданной конкурентностью.
+Выводит req/s, p50/p95/p99 и распределение статусов — для сравнения
+до/после (например, синхронная сессия против AsyncSession).
+
+Сценарии:
+  - ingest   — POST /api/sensors/readings (нужен --api-key; 429 — ожидаемый rate limit);
+  - products — GET /api/products/;
+  - product  — GET /api/products/{--product-id};
+  - media    — GET /api/products/media/{--media-id}/file;
+  - login    — POST /api/auth/login (нужны --email и --password; 503 — пул
+               хеширования паролей перегружен, см. PASSWORD_HASH_MAX_PENDING).
+               Потолок req/s задает проверка Argon2 (~0.25 с CPU на запрос), а не
+               обработчик: сравнивайте на одном железе и смотрите p99 и ошибки.
+
+Запуск:
+python -m scripts.bench_http_load products --base-url http://localhost:8000 -c 100 -n 5000
+python -m scripts.bench_http_load login --email user@example.com --password secret -c 20 -n 500
+"""
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import List, Optional
+
+import httpx
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _build_request(args):
+    if args.scenario == "ingest":
+        body = {
+            "api_key": args.api_key,
+            "temperature": round(random.uniform(15, 30), 2),
+            "humidity": random.randint(30, 80),
+        }
+        return "POST", "/api/sensors/readings", body
+    if args.scenario == "products":
+        return "GET", f"/api/products/?limit={args.limit}", None
+    if args.scenario == "product":
+        return "GET", f"/api/products/{args.product_id}", None
+    if args.scenario == "login":
+        return "POST", "/api/auth/login", {"email": args.email, "password": args.password}
+    return "GET", f"/api/products/media/{args.media_id}/file", None
+
+
+async def _worker(client: httpx.AsyncClient, args, remaining: List[int], latencies: List[float], statuses: Counter) -> None:
+    while True:
+        if remaining[0] <= 0:
+            return
+        remaining[0] -= 1
+        method, url, body = _build_request(args)
+        started = time.perf_counter()
+        try:
+            resp = await client.request(method, url, json=body)
+            statuses[resp.status_code] += 1
+        except httpx.HTTPError as exc:
+            statuses[type(exc).__name__] += 1
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(args) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else None
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    remaining = [args.requests]
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, headers=headers, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _worker(client, args, remaining, latencies, statuses) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    print(f"scenario={args.scenario} concurrency={args.concurrency} requests={len(latencies)}")
+    print(f"elapsed={elapsed:.2f}s  rps={len(latencies) / elapsed:.1f}")
+    print(
+        "latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+            _percentile(latencies, 0.50) * 1000,
+            _percentile(latencies, 0.95) * 1000,
+            _percentile(latencies, 0.99) * 1000,
+            (max(latencies) if latencies else 0.0) * 1000,
+        )
+    )
+    print("statuses: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Concurrent HTTP load benchmark for hot API routes")
+    parser.add_argument("scenario", choices=["ingest", "products", "product", "media", "login"])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--token", default=None, help="JWT для Authorization: Bearer")
+    parser.add_argument("--api-key", default=None, help="API-ключ датчика для сценария ingest")
+    parser.add_argument("--product-id", type=int, default=1)
+    parser.add_argument("--media-id", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--email", default=None, help="Email пользователя для сценария login")
+    parser.add_argument("--password", default=None, help="Пароль пользователя для сценария login")
+    args = parser.parse_args(argv)
+    if args.scenario == "ingest" and not args.api_key:
+        parser.error("--api-key is required for the ingest scenario")
+    if args.scenario == "login" and not (args.email and args.password):
+        parser.error("--email and --password are required for the login scenario")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
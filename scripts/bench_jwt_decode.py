@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+JWT Decode Benchmark
+--------------------
+Пропускная способность проверки access-токенов по бэкендам utils.jwt_backend
+(без кеша) и с DecodedTokenCache — для выбора JWT_BACKEND.
+
+Токены подписываются тем же бэкендом; --tokens задает число разных токенов,
+по которым ходят запросы (в кеше с попаданием считается только первый проход).
+
+Запуск:
+python -m scripts.bench_jwt_decode -n 20000 --tokens 1000
+"""
+import time
+import secrets
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from utils.jwt_backend import DecodedTokenCache, JoseBackend, PyJWTBackend, get_jwt_backend
+
+KEY = secrets.token_urlsafe(48)
+
+
+def _make_tokens(backend, count: int, algorithm: str) -> List[str]:
+    now = datetime.utcnow()
+    return [
+        backend.encode(
+            {"sub": str(i), "role": "consumer", "iat": now, "exp": now + timedelta(minutes=30), "jti": secrets.token_urlsafe(16)},
+            KEY,
+            algorithm,
+        )
+        for i in range(count)
+    ]
+
+
+def _run(label: str, decode, tokens: List[str], requests: int) -> None:
+    started = time.perf_counter()
+    for i in range(requests):
+        decode(tokens[i % len(tokens)])
+    elapsed = time.perf_counter() - started
+    print(f"{label:<14} {requests / elapsed:>12.0f} decodes/s  {elapsed / requests * 1e6:>8.1f} us/decode")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="JWT decode throughput per backend")
+    parser.add_argument("-n", "--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=1000, help="Число разных токенов")
+    parser.add_argument("--algorithm", default="HS256")
+    args = parser.parse_args(argv)
+
+    for name in (JoseBackend.name, PyJWTBackend.name):
+        try:
+            backend = get_jwt_backend(name)
+        except ImportError:
+            print(f"{name:<14} not installed")
+            continue
+        tokens = _make_tokens(backend, args.tokens, args.algorithm)
+        algorithms = [args.algorithm]
+        _run(name, lambda t: backend.decode(t, KEY, algorithms), tokens, args.requests)
+
+        cache = DecodedTokenCache(maxsize=args.tokens, ttl=300)
+
+        def cached(token: str) -> None:
+            if cache.get(token) is None:
+                cache.put(token, backend.decode(token, KEY, algorithms))
+
+        _run(f"{name}+cache", cached, tokens, args.requests)
+
+
+if __name__ == "__main__":
+    main()
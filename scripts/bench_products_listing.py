@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Products Listing Bytes Benchmark
+--------------------------------
+Регрессионный прогон GET /api/products/: сколько байтов Postgres отдает приложению
+на один запрос каталога. Байты медиа (колонки content) не должны попадать в списки —
+при их загрузке объем растет пропорционально размеру картинок и прогон падает.
+
+Приложение запускается в процессе (fastapi.testclient), соединения с БД идут через
+локальный TCP-прокси, который считает байты сервер -> клиент. Фоновые задачи
+(GC медиа, генерация копий, воркер AI-задач) на время прогона отключаются.
+
+С --seed создаются товары с медиа в Postgres (storage_backend="db") размером --blob-kb,
+чтобы регрессия была заметна; повторный запуск переиспользует созданные данные.
+
+Запуск:
+python -m scripts.bench_products_listing --seed -n 50 --limit 50 --max-db-bytes 262144
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+SEED_EMAIL = "bench-listing@example.invalid"
+
+
+class CountingProxy:
+    """
+    TCP-прокси к Postgres в отдельном потоке со счетчиком байтов от сервера.
+    """
+
+    def __init__(self, upstream_host: str, upstream_port: int):
+        self.upstream = (upstream_host, upstream_port)
+        self.server_bytes = 0
+        self.port: Optional[int] = None
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-db-proxy", daemon=True)
+
+    def start(self) -> int:
+        self._thread.start()
+        self._ready.wait()
+        return self.port
+
+    def reset(self) -> None:
+        self.server_bytes = 0
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        server = self._loop.run_until_complete(asyncio.start_server(self._handle, sock=sock))
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+
+    async def _pipe(self, reader, writer, count: bool) -> None:
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if count:
+                    self.server_bytes += len(data)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, client_reader, client_writer) -> None:
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(*self.upstream)
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(
+            self._pipe(client_reader, upstream_writer, count=False),
+            self._pipe(upstream_reader, client_writer, count=True),
+        )
+
+
+def _prepare_environment() -> CountingProxy:
+    # .env читается до подмены адреса — database.database его уже не перезапишет
+    load_dotenv()
+    proxy = CountingProxy(os.getenv("POSTGRES_HOST", "localhost"), int(os.getenv("POSTGRES_PORT", "5432")))
+    port = proxy.start()
+    os.environ["POSTGRES_HOST"] = "127.0.0.1"
+    os.environ["POSTGRES_PORT"] = str(port)
+    os.environ["MEDIA_GC_ENABLED"] = "false"
+    os.environ["MEDIA_VARIANTS_ENABLED"] = "false"
+    os.environ["AI_JOBS_WORKER_ENABLED"] = "false"
+    return proxy
+
+
+def seed(products: int, media_per_product: int, blob_kb: int) -> int:
+    """
+    Создает товары с медиа в Postgres, если их еще нет.
+
+    Returns:
+        int: Количество созданных товаров.
+    """
+    from database.database import SessionLocal
+    from models.user import User
+    from models.product import Product, ProductMedia
+
+    db = SessionLocal()
+    try:
+        owner = db.query(User).filter(User.email == SEED_EMAIL).first()
+        if owner is None:
+            owner = User(email=SEED_EMAIL, hashed_password="!", first_name="Bench", last_name="Listing", role="farmer")
+            db.add(owner)
+            db.flush()
+        existing = db.query(Product.id).filter(Product.owner_id == owner.id).count()
+        created = 0
+        for i in range(existing, products):
+            product = Product(name=f"bench-listing-{i}", short_description="bench", owner_id=owner.id, is_active=True)
+            db.add(product)
+            db.flush()
+            for j in range(media_per_product):
+                db.add(ProductMedia(
+                    product_id=product.id,
+                    object_key=f"products/{product.id}/bench-{j}.bin",
+                    filename=f"bench-{j}.bin",
+                    storage_backend="db",
+                    content=os.urandom(blob_kb * 1024),
+                    content_size=blob_kb * 1024,
+                    mime_type="image/jpeg",
+                    is_primary=(j == 0),
+                ))
+            db.commit()
+            created += 1
+        return created
+    finally:
+        db.close()
+
+
+def run(args, proxy: CountingProxy) -> int:
+    from fastapi.testclient import TestClient
+    from main import app
+
+    results: List[Tuple[int, int, float]] = []
+    statuses = set()
+    with TestClient(app) as client:
+        # Прогрев: подключения пула и кэши не должны попадать в замер
+        client.get("/api/products/", params={"limit": args.limit})
+        for _ in range(args.requests):
+            proxy.reset()
+            started = time.perf_counter()
+            resp = client.get("/api/products/", params={"limit": args.limit})
+            elapsed = time.perf_counter() - started
+            statuses.add(resp.status_code)
+            results.append((proxy.server_bytes, len(resp.content), elapsed))
+
+    db_bytes = [r[0] for r in results]
+    mean_db = sum(db_bytes) / len(db_bytes)
+    print(f"requests={len(results)} limit={args.limit} statuses={sorted(statuses)}")
+    print(f"db bytes/request: mean={mean_db:.0f} max={max(db_bytes)}")
+    print(f"http bytes/request: mean={sum(r[1] for r in results) / len(results):.0f}")
+    print(f"latency ms: mean={sum(r[2] for r in results) / len(results) * 1000:.1f} max={max(r[2] for r in results) * 1000:.1f}")
+
+    if statuses != {200}:
+        print("FAIL: unexpected response statuses", file=sys.stderr)
+        return 1
+    if max(db_bytes) > args.max_db_bytes:
+        print(f"FAIL: db bytes per request {max(db_bytes)} > {args.max_db_bytes}", file=sys.stderr)
+        return 1
+    print("OK")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Bytes-per-request regression benchmark for GET /api/products/")
+    parser.add_argument("-n", "--requests", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--max-db-bytes", type=int, default=256 * 1024, help="Порог байтов от Postgres на запрос")
+    parser.add_argument("--seed", action="store_true", help="Создать товары с медиа в Postgres")
+    parser.add_argument("--seed-products", type=int, default=50)
+    parser.add_argument("--media-per-product", type=int, default=3)
+    parser.add_argument("--blob-kb", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    proxy = _prepare_environment()
+    if args.seed:
+        created = seed(args.seed_products, args.media_per_product, args.blob_kb)
+        print(f"seeded products: {created}")
+    sys.exit(run(args, proxy))
+
+
+if __name__ == "__main__":
+    main()
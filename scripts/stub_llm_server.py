@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Stub LLM Server
+---------------
+Локальная заглушка OpenAI-совместимого /v1/chat/completions для проверки
+фоновой генерации ИИ рекомендаций без обращения к NeuroAPI.
+
+Запуск:
+python scripts/stub_llm_server.py --port 8089 --delay 2 --fail-rate 0.2
+NEUROAPI_URL=http://127.0.0.1:8089/v1/chat/completions uvicorn main:app
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_counter_lock = threading.Lock()
+_counter = 0
+
+
+def _make_handler(delay: float, fail_rate: float):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            global _counter
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                payload = {}
+
+            if delay > 0:
+                time.sleep(delay)
+            if random.random() < fail_rate:
+                self._reply(503, {"error": {"message": "stub upstream failure"}})
+                return
+
+            with _counter_lock:
+                _counter += 1
+                number = _counter
+            messages = payload.get("messages") or [{}]
+            prompt = messages[-1].get("content", "")
+            name = next((line.split(":", 1)[1].strip() for line in prompt.splitlines()
+                         if line.startswith("Название товара:")), "этот продукт")
+            content = f"Заглушка рекомендации #{number}: {name} — свежий фермерский продукт, рекомендуем попробовать."
+            self._reply(200, {
+                "id": f"stub-{number}",
+                "object": "chat.completion",
+                "model": payload.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            })
+
+        def _reply(self, status: int, body: dict) -> None:
+            raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stub of an OpenAI-compatible chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="Задержка ответа, секунды")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Доля ответов 503 (0..1)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(args.delay, args.fail_rate))
+    print(f"Stub LLM listening on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
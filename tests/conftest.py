@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Общие фикстуры тестов.
+
+Тесты, которым нужен Postgres, используют фикстуру db_session и пропускаются,
+если не заданы переменные POSTGRES_* (те же, что у приложения). Схема создается
+через Base.metadata.create_all; используйте отдельную тестовую базу.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _database_configured() -> bool:
+    return all(os.getenv(name) for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB"))
+
+
+@pytest.fixture(scope="session")
+def db_engine():
+    if not _database_configured():
+        pytest.skip("POSTGRES_* environment variables are not set")
+    os.environ.setdefault("SECRET_KEY", "test-secret-key-0123456789abcdef0123456789")
+    from database.database import Base, engine
+    import models.user, models.farm, models.product, models.sensor, models.gamification, models.ai_job, models.ai_cache, models.refresh_token  # noqa: F401
+
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def db_session(db_engine):
+    from database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+
+@pytest.fixture
+def make_user(db_session):
+    from models.user import User
+
+    def factory(role: str = "farmer", is_active: bool = True, balance: int = 0, password_hash: str = "!"):
+        user = User(
+            email=f"test-{uuid.uuid4().hex}@example.com", hashed_password=password_hash,
+            first_name="Test", last_name="User", role=role, is_active=is_active, balance=balance,
+        )
+        db_session.add(user)
+        db_session.commit()
+        return user
+
+    return factory
+
+
+@pytest.fixture
+def make_product(db_session, make_user):
+    from models.product import Product
+
+    def factory(owner=None):
+        owner = owner or make_user()
+        product = Product(name=f"test-{uuid.uuid4().hex[:8]}", short_description="test", owner_id=owner.id, is_active=True)
+        db_session.add(product)
+        db_session.commit()
+        return product
+
+    return factory
+
+
+@pytest.fixture(scope="session")
+def client(db_engine):
+    """
+    Приложение в процессе (TestClient) без фоновых задач.
+    """
+    for name in ("MEDIA_GC_ENABLED", "MEDIA_VARIANTS_ENABLED", "AI_JOBS_WORKER_ENABLED"):
+        os.environ[name] = "false"
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def auth_headers(user) -> dict:
+    from utils.auth import create_access_token
+
+    return {"Authorization": f"Bearer {create_access_token({'sub': str(user.id), 'role': user.role})}"}
+
+
+@pytest.fixture
+def make_sensor(db_session):
+    from models.sensor import SensorDevice
+    from utils.sensor_auth import hash_api_key
+
+    def factory(product_id=None):
+        api_key = uuid.uuid4().hex
+        device = SensorDevice(name="test sensor", api_key_hash=hash_api_key(api_key), is_active=True, product_id=product_id)
+        db_session.add(device)
+        db_session.commit()
+        return device, api_key
+
+    return factory
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты массовой генерации ИИ рекомендаций: повтор неудач при продолжении и постановка в очередь страницами.
+"""
+import json
+
+import pytest
+
+from models.ai_job import AiRecommendationJob
+from models.product import ProductPassport
+from utils import ai_backfill, ai_recommendation
+from utils.ai_jobs import RECOMMENDATION_FIELD
+
+
+@pytest.fixture
+def make_harvested(db_session, make_product):
+    def factory(recommendation: str = ""):
+        product = make_product()
+        db_session.add(ProductPassport(product_id=product.id, data={RECOMMENDATION_FIELD: recommendation}))
+        db_session.commit()
+        return product
+
+    return factory
+
+
+def _recommendation(db_session, product_id):
+    db_session.expire_all()
+    return db_session.query(ProductPassport).filter(ProductPassport.product_id == product_id).one().data[RECOMMENDATION_FIELD]
+
+
+def test_resume_retries_failed_products(db_session, make_harvested, monkeypatch, tmp_path):
+    retried, done_meanwhile, still_failing, fresh = (make_harvested() for _ in range(4))
+    ai_backfill.save_recommendations(db_session, {done_meanwhile.id: "написано вручную"})
+    calls = []
+    failing_name = still_failing.name
+
+    def fake_generate(product_name, **kwargs):
+        calls.append(product_name)
+        return None if product_name == failing_name else f"рекомендация для {product_name}"
+
+    monkeypatch.setattr(ai_recommendation, "generate_product_recommendation", fake_generate)
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({
+        "last_product_id": still_failing.id,
+        "generated": 5,
+        "failed": [retried.id, done_meanwhile.id, still_failing.id],
+    }))
+
+    state = ai_backfill.run_backfill(db_session, workers=2, rate=0, page_size=2, checkpoint_path=str(checkpoint))
+
+    assert sorted(calls) == sorted([retried.name, still_failing.name, fresh.name])
+    assert state["failed"] == [still_failing.id]
+    assert state["generated"] == 7
+    assert state["last_product_id"] == fresh.id
+    assert json.loads(checkpoint.read_text()) == state
+    assert _recommendation(db_session, retried.id) == f"рекомендация для {retried.name}"
+    assert _recommendation(db_session, done_meanwhile.id) == "написано вручную"
+    assert _recommendation(db_session, still_failing.id) == ""
+
+
+def test_enqueue_backfill_pages_past_queued_products(db_session, make_harvested, monkeypatch):
+    monkeypatch.setattr(ai_backfill, "wake_ai_job_worker", lambda: None)
+    # Товары, оставшиеся от других тестов, ставятся в очередь заранее
+    ai_backfill.enqueue_backfill(db_session, limit=100000)
+    products = [make_harvested() for _ in range(3)]
+    make_harvested("уже есть")
+
+    assert ai_backfill.enqueue_backfill(db_session, limit=2, page_size=1) == 2
+    assert ai_backfill.enqueue_backfill(db_session, limit=2, page_size=1) == 1
+    assert ai_backfill.enqueue_backfill(db_session, limit=2, page_size=1) == 0
+
+    queued = db_session.query(AiRecommendationJob.product_id).filter(
+        AiRecommendationJob.product_id.in_([product.id for product in products]),
+        AiRecommendationJob.status == "pending",
+    ).count()
+    assert queued == 3
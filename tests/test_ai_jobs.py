@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты очереди ИИ рекомендаций против локальной заглушки LLM (scripts/stub_llm_server.py).
+"""
+import threading
+import uuid
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from models.ai_job import AiRecommendationJob
+from models.product import ProductPassport
+from scripts.stub_llm_server import _make_handler
+from utils import ai_jobs, ai_recommendation
+from utils.http_client import CircuitBreaker, HttpClient
+
+
+@pytest.fixture
+def llm_stub(monkeypatch):
+    """
+    Запускает заглушку LLM с заданной долей отказов и направляет на нее клиент NeuroAPI.
+    """
+    servers = []
+
+    def start(fail_rate: float = 0.0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(0.0, fail_rate))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setattr(ai_recommendation, "NEUROAPI_URL", f"http://127.0.0.1:{server.server_port}/v1/chat/completions")
+        monkeypatch.setattr(ai_recommendation, "_client", HttpClient("neuroapi-test", retries=0, breaker=CircuitBreaker("neuroapi-test")))
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_job(db_session, make_product):
+    def factory(status: str = "pending", attempts: int = 0, max_attempts: int = 3, locked_at=None, passport_data=None):
+        product = make_product()
+        # Уникальное название: рекомендация не берется из кеша
+        product.name = f"Продукт {uuid.uuid4().hex[:8]}"
+        db_session.add(ProductPassport(product_id=product.id, origin="Тест", data=passport_data or {"Сорт": "ранний"}))
+        now = datetime.utcnow()
+        job = AiRecommendationJob(
+            product_id=product.id, status=status, attempts=attempts, max_attempts=max_attempts,
+            run_after=now - timedelta(seconds=1), locked_at=locked_at, created_at=now, updated_at=now,
+        )
+        db_session.add(job)
+        db_session.commit()
+        return job
+
+    return factory
+
+
+def _claimed(db_session, job):
+    rows = ai_jobs.claim_jobs(db_session, 1000)
+    return next((row for row in rows if row.id == job.id), None)
+
+
+def _reload(db_session, model, **filters):
+    db_session.expire_all()
+    return db_session.query(model).filter_by(**filters).one()
+
+
+def test_claim_marks_job_running_once(db_session, make_job):
+    job = make_job()
+
+    row = _claimed(db_session, job)
+    assert row is not None and row.attempts == 1
+    stored = _reload(db_session, AiRecommendationJob, id=job.id)
+    assert stored.status == "running" and stored.locked_at is not None
+
+    assert _claimed(db_session, job) is None
+
+
+def test_stale_running_job_is_reclaimed(db_session, make_job):
+    stale = datetime.utcnow() - timedelta(seconds=ai_jobs.AI_JOBS_LOCK_TIMEOUT + 60)
+    job = make_job(status="running", attempts=1, locked_at=stale)
+
+    row = _claimed(db_session, job)
+    assert row is not None and row.attempts == 2
+
+
+def test_stale_job_without_attempts_left_fails(db_session, make_job):
+    stale = datetime.utcnow() - timedelta(seconds=ai_jobs.AI_JOBS_LOCK_TIMEOUT + 60)
+    job = make_job(status="running", attempts=3, max_attempts=3, locked_at=stale)
+
+    assert _claimed(db_session, job) is None
+    stored = _reload(db_session, AiRecommendationJob, id=job.id)
+    assert stored.status == "failed" and stored.last_error == "Lock timeout"
+
+
+def test_successful_job_writes_passport(db_session, make_job, llm_stub):
+    llm_stub()
+    job = make_job()
+    row = _claimed(db_session, job)
+
+    ai_jobs.run_job(row.id, row.product_id, row.attempts, row.max_attempts)
+
+    assert _reload(db_session, AiRecommendationJob, id=job.id).status == "done"
+    data = _reload(db_session, ProductPassport, product_id=job.product_id).data
+    assert data[ai_jobs.RECOMMENDATION_FIELD].startswith("Заглушка рекомендации")
+    assert data["Сорт"] == "ранний"
+
+
+def test_failed_generation_is_retried_with_backoff(db_session, make_job, llm_stub):
+    llm_stub(fail_rate=1.0)
+    job = make_job()
+    row = _claimed(db_session, job)
+    started = datetime.utcnow()
+
+    ai_jobs.run_job(row.id, row.product_id, row.attempts, row.max_attempts)
+
+    stored = _reload(db_session, AiRecommendationJob, id=job.id)
+    assert stored.status == "pending" and stored.locked_at is None and stored.last_error
+    delay = (stored.run_after - started).total_seconds()
+    assert ai_jobs.AI_JOBS_RETRY_BASE_DELAY - 1 <= delay <= ai_jobs.AI_JOBS_RETRY_BASE_DELAY + 5
+
+    # Вторая неудачная попытка — задержка удваивается
+    ai_jobs.run_job(row.id, row.product_id, 2, row.max_attempts)
+    stored = _reload(db_session, AiRecommendationJob, id=job.id)
+    delay = (stored.run_after - started).total_seconds()
+    assert 2 * ai_jobs.AI_JOBS_RETRY_BASE_DELAY - 1 <= delay <= 2 * ai_jobs.AI_JOBS_RETRY_BASE_DELAY + 5
+
+
+def test_last_failed_attempt_fails_job(db_session, make_job, llm_stub):
+    llm_stub(fail_rate=1.0)
+    job = make_job(max_attempts=1)
+    row = _claimed(db_session, job)
+
+    ai_jobs.run_job(row.id, row.product_id, row.attempts, row.max_attempts)
+
+    assert _reload(db_session, AiRecommendationJob, id=job.id).status == "failed"
+
+
+def test_save_recommendation_keeps_existing_one(db_session, make_job):
+    job = make_job(passport_data={ai_jobs.RECOMMENDATION_FIELD: "написано вручную", "Сорт": "ранний"})
+
+    assert not ai_jobs.save_recommendation(db_session, job.product_id, "новая")
+    db_session.commit()
+    assert _reload(db_session, ProductPassport, product_id=job.product_id).data[ai_jobs.RECOMMENDATION_FIELD] == "написано вручную"
+
+
+def test_save_recommendation_merges_into_passport(db_session, make_job):
+    job = make_job(passport_data={ai_jobs.RECOMMENDATION_FIELD: "  ", "Сорт": "ранний"})
+
+    assert ai_jobs.save_recommendation(db_session, job.product_id, "новая")
+    db_session.commit()
+    data = _reload(db_session, ProductPassport, product_id=job.product_id).data
+    assert data == {ai_jobs.RECOMMENDATION_FIELD: "новая", "Сорт": "ранний"}
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты авторизации через кеш пользователей: состояние аккаунта и свежесть баланса.
+"""
+from conftest import auth_headers
+
+
+def test_deactivated_user_cannot_create_product(client, db_session, make_user):
+    from utils.auth import invalidate_principal
+
+    user = make_user(role="farmer")
+    headers = auth_headers(user)
+    payload = {"name": "Tomato", "short_description": "red", "price": "100.00", "category": "vegetables"}
+    assert client.post("/api/products/", json=payload, headers=headers).status_code == 201
+
+    user.is_active = False
+    db_session.commit()
+    invalidate_principal(user.id)
+
+    assert client.post("/api/products/", json=payload, headers=headers).status_code == 403
+
+
+def test_me_returns_current_balance(client, db_session, make_user):
+    user = make_user(balance=100)
+    headers = auth_headers(user)
+    assert client.get("/api/users/me", headers=headers).json()["balance"] == 100
+
+    # Изменение другим воркером: кеш этого процесса не сбрасывается
+    user.balance = 250
+    db_session.commit()
+
+    assert client.get("/api/users/me", headers=headers).json()["balance"] == 250
+    assert client.get("/api/game/balance", headers=headers).json()["balance"] == 250
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты HttpClient против локального HTTP-сервера: повторы, Retry-After и размыкатель цепи.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from utils import http_client
+from utils.http_client import CircuitBreaker, CircuitOpenError, HttpClient, UpstreamHTTPError
+
+
+class FakeUpstream:
+    """
+    Локальный сервер, отвечающий по заданному сценарию: список (status, headers).
+    Когда сценарий исчерпан, отвечает 200.
+    """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                upstream.calls += 1
+                status, headers = upstream.script.pop(0) if upstream.script else (200, {})
+                body = json.dumps({"status": status}).encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    servers = []
+
+    def start(*script):
+        server = FakeUpstream(*script)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Задержки перед повторами записываются вместо ожидания.
+    """
+    recorded = []
+    monkeypatch.setattr(http_client.time, "sleep", recorded.append)
+    return recorded
+
+
+def _client(**options) -> HttpClient:
+    options.setdefault("breaker", CircuitBreaker("test", failure_threshold=10, reset_timeout=30))
+    return HttpClient("test", backoff_base=0.5, backoff_max=4.0, **options)
+
+
+def test_retries_server_errors_until_success(upstream, sleeps):
+    server = upstream((503, {}), (502, {}))
+    client = _client(retries=2)
+
+    assert client.post_json(server.url, {}) == {"status": 200}
+    assert server.calls == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+    assert client.breaker.state == "closed"
+
+
+def test_gives_up_after_retries(upstream, sleeps):
+    server = upstream((503, {}), (503, {}), (503, {}))
+    client = _client(retries=1)
+
+    with pytest.raises(UpstreamHTTPError) as exc:
+        client.post_json(server.url, {})
+    assert exc.value.status_code == 503
+    assert server.calls == 2
+
+
+def test_retry_after_is_honored_and_capped(upstream, sleeps):
+    server = upstream((429, {"Retry-After": "1.5"}), (503, {"Retry-After": "120"}))
+    client = _client(retries=2)
+
+    assert client.post_json(server.url, {}) == {"status": 200}
+    assert sleeps == [1.5, 4.0]
+
+
+def test_client_errors_are_not_retried(upstream, sleeps):
+    server = upstream((400, {}))
+    client = _client(retries=2)
+
+    with pytest.raises(UpstreamHTTPError) as exc:
+        client.post_json(server.url, {})
+    assert exc.value.status_code == 400
+    assert server.calls == 1 and sleeps == []
+    assert client.breaker.state == "closed"
+
+
+def test_connection_errors_are_retried(sleeps):
+    client = _client(retries=2)
+
+    with pytest.raises(requests.ConnectionError):
+        client.post_json("http://127.0.0.1:9/v1/chat/completions", {})
+    assert len(sleeps) == 2
+
+
+def test_breaker_transitions(upstream):
+    server = upstream((503, {}), (503, {}), (503, {}))
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.2)
+    client = _client(retries=0, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamHTTPError):
+            client.post_json(server.url, {})
+    assert breaker.state == "open"
+
+    # Разомкнутая цепь отклоняет вызов без запроса
+    with pytest.raises(CircuitOpenError):
+        client.post_json(server.url, {})
+    assert server.calls == 2
+
+    # Неудачный пробный вызов снова размыкает цепь
+    time.sleep(0.25)
+    assert breaker.state == "half_open"
+    with pytest.raises(UpstreamHTTPError):
+        client.post_json(server.url, {})
+    assert breaker.state == "open"
+
+    # Удачный пробный вызов замыкает цепь
+    time.sleep(0.25)
+    assert client.post_json(server.url, {}) == {"status": 200}
+    assert breaker.state == "closed"
+    assert server.calls == 4
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.1)
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.cancel_call()
+    breaker.before_call()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты очистки брошенных staged_uploads (нужен Postgres, см. conftest).
+"""
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+from models.product import MediaBlob, StagedUpload
+from utils import media_gc
+from utils.media_db import UPLOAD_COMPLETE
+
+
+def test_sweep_staged_skips_blob_backed_uploads(db_session, make_product, monkeypatch):
+    deleted = []
+    monkeypatch.setattr(media_gc, "delete_stored_object", lambda backend, key: deleted.append(key))
+    product = make_product()
+    stale = datetime.utcnow() - timedelta(hours=48)
+    data = uuid.uuid4().bytes
+    sha = hashlib.sha256(data).hexdigest()
+    blob = MediaBlob(sha256=sha, size=len(data), storage_backend="local", object_key=f"blobs/{sha}", ref_count=1)
+    db_session.add(blob)
+    db_session.flush()
+
+    own = StagedUpload(
+        object_key=f"products/{product.id}/{uuid.uuid4().hex}.jpg", product_id=product.id, filename="own.jpg",
+        storage_backend="local", content_size=100, received_bytes=100, upload_state=UPLOAD_COMPLETE,
+        created_at=stale, updated_at=stale,
+    )
+    from_blob = StagedUpload(
+        object_key=f"products/{product.id}/{uuid.uuid4().hex}.jpg", product_id=product.id, filename="dup.jpg",
+        storage_backend="local", content_sha256=sha, content_size=len(data), received_bytes=len(data),
+        upload_state=UPLOAD_COMPLETE, blob_id=blob.id, created_at=stale, updated_at=stale,
+    )
+    db_session.add_all([own, from_blob])
+    db_session.commit()
+    own_key = own.object_key
+    before = media_gc.gc_stats()
+
+    result = media_gc.sweep_staged(db_session, ttl_hours=24, max_batches=None)
+
+    assert deleted == [own_key]
+    assert result["deleted"] >= 2
+    assert result["store_bytes"] == 100
+    after = media_gc.gc_stats()
+    assert after["objects_deleted"] - before["objects_deleted"] == 1
+    assert after["store_bytes_reclaimed"] - before["store_bytes_reclaimed"] == 100
+    assert db_session.query(StagedUpload).filter(StagedUpload.product_id == product.id).count() == 0
+    # Блоб остается: на него ссылаются другие медиа
+    assert db_session.query(MediaBlob).filter(MediaBlob.id == blob.id).count() == 1
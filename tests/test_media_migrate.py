@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты переноса медиа из Postgres в объектное хранилище (нужен Postgres, см. conftest).
+"""
+import hashlib
+
+from utils.object_store import LocalFileStore
+
+
+def test_migrate_variants_moves_bytes_out_of_postgres(db_session, make_product, tmp_path):
+    from models.product import ProductMedia, ProductMediaVariant
+    from utils.media_migrate import migrate_variants
+
+    product = make_product()
+    media = ProductMedia(product_id=product.id, object_key=f"products/{product.id}/orig.jpg", filename="orig.jpg",
+                         storage_backend="db", content=b"original", mime_type="image/jpeg")
+    db_session.add(media)
+    db_session.flush()
+    data = b"variant-bytes"
+    variant = ProductMediaVariant(
+        media_id=media.id, variant="thumb", format="webp",
+        object_key=f"products/{product.id}/variants/{media.id}/thumb.webp", storage_backend="db",
+        content=data, content_sha256=hashlib.sha256(data).hexdigest(), content_size=len(data),
+        mime_type="image/webp", width=10, height=10,
+    )
+    db_session.add(variant)
+    db_session.commit()
+    store = LocalFileStore(str(tmp_path))
+
+    assert migrate_variants(db_session, store, dry_run=True) >= 1
+    moved = migrate_variants(db_session, store)
+
+    assert moved >= 1
+    row = db_session.query(ProductMediaVariant.storage_backend, ProductMediaVariant.content).filter(
+        ProductMediaVariant.id == variant.id
+    ).one()
+    assert row.storage_backend == "local"
+    assert row.content is None
+    assert store.get(variant.object_key) == data
+    assert migrate_variants(db_session, store) == 0
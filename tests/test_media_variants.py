@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты пула генерации копий изображений: восстановление после падения процесса
+и отличие "не изображения" от сбоя пула.
+"""
+import os
+import signal
+from io import BytesIO
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("PIL")
+
+
+@pytest.fixture
+def variants(db_engine, monkeypatch):
+    from utils import media_variants
+
+    monkeypatch.setattr(media_variants, "MEDIA_VARIANTS_ENABLED", True)
+    monkeypatch.setattr(media_variants, "MEDIA_VARIANT_PROCESSES", 1)
+    media_variants.start_media_variant_workers()
+    yield media_variants
+    media_variants.stop_media_variant_workers()
+
+
+def _png() -> bytes:
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), (200, 10, 10)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_broken_process_pool_is_restarted(variants):
+    assert variants._render(_png())["width"] == 64
+    broken = variants._processes
+    for process in list(broken._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+
+    with pytest.raises(BrokenProcessPool):
+        variants._render(_png())
+
+    assert variants._processes is not broken
+    assert variants._render(_png())["height"] == 48
+
+
+def test_undecodable_file_is_not_a_pool_failure(variants):
+    from PIL import UnidentifiedImageError
+
+    with pytest.raises(UnidentifiedImageError):
+        variants._render(b"definitely not an image")
+    assert isinstance(UnidentifiedImageError("x"), variants.image_variants.decode_errors())
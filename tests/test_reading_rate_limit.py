@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты хранилищ времени последнего показания (rate limiting датчиков).
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import reading_rate_limit
+from utils.reading_rate_limit import InMemoryLastReadingStore, LastReadingStore, PostgresLastReadingStore
+
+INTERVAL = timedelta(seconds=30)
+T0 = datetime(2026, 3, 1, 12, 0, 0)
+
+
+class FakeHistory:
+    """
+    Подмена sensor_readings: время последнего сохраненного показания по датчику.
+    """
+
+    def __init__(self, last=None):
+        self.last = dict(last or {})
+        self.calls = 0
+
+    def __call__(self, db, device_id):
+        self.calls += 1
+        return self.last.get(device_id)
+
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        LastReadingStore()
+
+    class Incomplete(LastReadingStore):
+        def try_acquire(self, db, device_id, reading_at, interval):
+            return True
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_memory_store_enforces_interval(monkeypatch):
+    monkeypatch.setattr(reading_rate_limit, "_backfill_last_reading", FakeHistory())
+    store = InMemoryLastReadingStore()
+
+    assert store.try_acquire(None, 1, T0, INTERVAL)
+    assert not store.try_acquire(None, 1, T0 + timedelta(seconds=10), INTERVAL)
+    assert store.try_acquire(None, 1, T0 + INTERVAL, INTERVAL)
+    # Другой датчик независим
+    assert store.try_acquire(None, 2, T0, INTERVAL)
+
+
+def test_memory_store_backfills_once(monkeypatch):
+    history = FakeHistory({1: T0})
+    monkeypatch.setattr(reading_rate_limit, "_backfill_last_reading", history)
+    store = InMemoryLastReadingStore()
+
+    assert not store.try_acquire(None, 1, T0 + timedelta(seconds=5), INTERVAL)
+    assert store.last_reading_at(None, 1) == T0
+    assert store.try_acquire(None, 1, T0 + INTERVAL, INTERVAL)
+    assert history.calls == 1
+
+
+def test_memory_store_record_keeps_latest_and_forget_reloads(monkeypatch):
+    history = FakeHistory({1: T0})
+    monkeypatch.setattr(reading_rate_limit, "_backfill_last_reading", history)
+    store = InMemoryLastReadingStore()
+
+    store.record(None, 1, T0 + timedelta(minutes=5))
+    store.record(None, 1, T0 + timedelta(minutes=1))
+    assert store.last_reading_at(None, 1) == T0 + timedelta(minutes=5)
+
+    store.forget(1)
+    assert store.last_reading_at(None, 1) == T0
+    assert history.calls == 2
+
+
+def test_postgres_store_enforces_interval(db_session, make_sensor):
+    device, _ = make_sensor()
+    store = PostgresLastReadingStore()
+
+    assert store.try_acquire(db_session, device.id, T0, INTERVAL)
+    assert not store.try_acquire(db_session, device.id, T0 + timedelta(seconds=10), INTERVAL)
+    assert store.try_acquire(db_session, device.id, T0 + INTERVAL, INTERVAL)
+
+    store.record(db_session, device.id, T0)
+    assert store.last_reading_at(db_session, device.id) == T0 + INTERVAL
+
+
+def test_postgres_store_checks_history_on_cold_start(db_session, make_sensor):
+    from models.sensor import SensorReading
+
+    device, _ = make_sensor()
+    db_session.add(SensorReading(device_id=device.id, created_at=T0, temperature=20.0))
+    db_session.flush()
+    store = PostgresLastReadingStore()
+
+    assert not store.try_acquire(db_session, device.id, T0 + timedelta(seconds=5), INTERVAL)
+    assert store.last_reading_at(db_session, device.id) == T0
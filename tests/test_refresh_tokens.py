@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты ротации refresh токенов: обычная ротация, повторное использование и деактивированный пользователь.
+"""
+import warnings
+
+import pytest
+from sqlalchemy.exc import SAWarning
+
+from utils.refresh_tokens import create_refresh_token, verify_and_rotate_refresh_token, ReuseDetected
+
+
+def _refresh(client, token):
+    client.cookies.clear()
+    return client.post("/api/auth/refresh", json={"refresh_token": token})
+
+
+def test_rotate_statement_has_no_cartesian_product(db_session, make_user):
+    plain, _ = create_refresh_token(db_session, make_user().id)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", SAWarning)
+        rotated = verify_and_rotate_refresh_token(db_session, plain)
+
+    assert rotated.plain != plain
+    with pytest.raises(ReuseDetected):
+        verify_and_rotate_refresh_token(db_session, plain)
+
+
+def test_refresh_rotates_and_detects_reuse(client, db_session, make_user):
+    plain, _ = create_refresh_token(db_session, make_user().id)
+
+    first = _refresh(client, plain)
+    assert first.status_code == 200
+    assert first.json()["access_token"]
+    rotated = first.cookies.get("refresh_token")
+    assert rotated and rotated != plain
+
+    assert _refresh(client, plain).status_code == 403
+    assert _refresh(client, rotated).status_code == 200
+
+
+def test_refresh_rejects_inactive_user(client, db_session, make_user):
+    user = make_user(is_active=False)
+    plain, _ = create_refresh_token(db_session, user.id)
+
+    assert _refresh(client, plain).status_code == 401
+    # Ротация откатывается: токен не помечен использованным
+    assert _refresh(client, plain).status_code == 401
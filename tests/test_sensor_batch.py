@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты пакетного приема показаний: повторная отправка офлайн-буфера и интервал между показаниями.
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+MOSCOW = pytz.timezone("Europe/Moscow")
+
+
+def _batch(api_key, *minutes_ago):
+    now = datetime.now(MOSCOW)
+    return {
+        "api_key": api_key,
+        "readings": [{"temperature": 20.5, "humidity": 50, "recorded_at": (now - timedelta(minutes=m)).isoformat()} for m in minutes_ago],
+    }
+
+
+def test_offline_buffer_older_than_latest_reading_is_accepted(client, make_sensor):
+    _, api_key = make_sensor()
+
+    fresh = client.post("/api/sensors/readings/batch", json=_batch(api_key, 2))
+    assert fresh.status_code == 201 and fresh.json()["accepted"] == 1
+
+    # Буфер старше последнего сохраненного показания
+    buffered = client.post("/api/sensors/readings/batch", json=_batch(api_key, 60, 50, 40))
+    assert buffered.status_code == 201
+    assert buffered.json()["accepted"] == 3
+    assert buffered.json()["rate_limited"] == 0
+
+
+def test_replayed_buffer_is_rate_limited(client, make_sensor):
+    _, api_key = make_sensor()
+    assert client.post("/api/sensors/readings/batch", json=_batch(api_key, 30, 20)).status_code == 201
+
+    partial = client.post("/api/sensors/readings/batch", json=_batch(api_key, 30, 20, 10))
+    assert partial.status_code == 201
+    assert partial.json()["accepted"] == 1
+    assert partial.json()["rate_limited"] == 2
+
+    assert client.post("/api/sensors/readings/batch", json=_batch(api_key, 30, 20, 10)).status_code == 429
+
+
+def test_spacing_within_batch(client, make_sensor):
+    _, api_key = make_sensor()
+
+    response = client.post("/api/sensors/readings/batch", json=_batch(api_key, 15, 14.75, 14.5, 13))
+
+    assert response.status_code == 201
+    assert response.json()["accepted"] == 2
+    assert response.json()["rate_limited"] == 2
+
+
+def test_concurrent_replays_are_not_both_accepted(client, make_sensor):
+    from concurrent.futures import ThreadPoolExecutor
+
+    _, api_key = make_sensor()
+    payload = _batch(api_key, 50, 40, 30, 20)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda _: client.post("/api/sensors/readings/batch", json=payload), range(4)))
+
+    accepted = sum(r.json()["accepted"] for r in responses if r.status_code == 201)
+    assert accepted == 4
+    assert sorted(r.status_code for r in responses) == [201, 429, 429, 429]
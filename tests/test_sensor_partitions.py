@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты срока хранения показаний: просроченные строки секции DEFAULT.
+"""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import text
+
+from models.sensor import SensorReading
+from utils import sensor_partitions
+
+# Месяцы без своих секций: строки попадают в DEFAULT
+OLD_MONTHS = ("y2000m03", "y2000m04")
+TODAY = date(2000, 7, 15)
+
+
+@pytest.fixture
+def default_rows(db_engine, db_session, make_sensor):
+    sensor_partitions.ensure_partitions(db_engine)
+    device, _ = make_sensor()
+    for created_at in (datetime(2000, 3, 10), datetime(2000, 4, 10), datetime(2000, 4, 20), datetime(2000, 6, 10)):
+        db_session.add(SensorReading(device_id=device.id, created_at=created_at, temperature=20.0))
+    db_session.commit()
+    yield device
+    db_session.rollback()
+    db_session.query(SensorReading).filter(SensorReading.device_id == device.id).delete()
+    for suffix in OLD_MONTHS:
+        db_session.execute(text(f'DROP TABLE IF EXISTS "sensor_readings_{suffix}"'))
+    db_session.commit()
+
+
+def _count(db_session, table, device_id):
+    return db_session.execute(text(f'SELECT count(*) FROM "{table}" WHERE device_id = :id'), {"id": device_id}).scalar()
+
+
+def test_detach_moves_expired_default_rows_to_month_tables(db_engine, db_session, default_rows):
+    expired = sensor_partitions.apply_retention(db_engine, retention_months=2, mode="detach", today=TODAY)
+
+    assert expired == [f"sensor_readings_{suffix}" for suffix in OLD_MONTHS]
+    assert _count(db_session, "sensor_readings_y2000m03", default_rows.id) == 1
+    assert _count(db_session, "sensor_readings_y2000m04", default_rows.id) == 2
+    assert _count(db_session, sensor_partitions.DEFAULT_PARTITION, default_rows.id) == 1
+    # Перенесенные таблицы не входят в sensor_readings
+    assert db_session.query(SensorReading).filter(SensorReading.device_id == default_rows.id).count() == 1
+
+
+def test_drop_deletes_expired_default_rows(db_engine, db_session, default_rows):
+    expired = sensor_partitions.apply_retention(db_engine, retention_months=2, mode="drop", today=TODAY)
+
+    assert expired == [sensor_partitions.DEFAULT_PARTITION]
+    remaining = db_session.query(SensorReading.created_at).filter(SensorReading.device_id == default_rows.id).all()
+    assert [r.created_at for r in remaining] == [datetime(2000, 6, 10)]
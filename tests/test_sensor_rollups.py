@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Тесты агрегатов показаний: первичный пересчет истории и границы периода в /aggregate.
+"""
+from datetime import datetime, timedelta
+
+from models.sensor import SensorReading, SensorReadingDaily, SensorReadingHourly
+from utils import sensor_rollups
+
+
+def _add_readings(db, device_id, *times, rollups=True):
+    rows = [{"created_at": created_at, "temperature": 20.0, "humidity": 50.0} for created_at in times]
+    for row in rows:
+        db.add(SensorReading(device_id=device_id, **row))
+    if rollups:
+        sensor_rollups.apply_readings(db, device_id, rows)
+    db.commit()
+
+
+def test_first_full_bucket():
+    assert sensor_rollups.first_full_bucket(datetime(2026, 3, 1, 10, 0), "hour") == datetime(2026, 3, 1, 10, 0)
+    assert sensor_rollups.first_full_bucket(datetime(2026, 3, 1, 10, 37), "hour") == datetime(2026, 3, 1, 11, 0)
+    assert sensor_rollups.first_full_bucket(datetime(2026, 3, 1, 10, 37), "day") == datetime(2026, 3, 2)
+
+
+def test_ensure_rollups_backfills_history(db_engine, db_session, make_sensor):
+    device, _ = make_sensor()
+    now = sensor_rollups.get_moscow_time()
+    # Показания до появления агрегатов
+    _add_readings(db_session, device.id, now - timedelta(hours=5), now - timedelta(hours=3), rollups=False)
+    db_session.query(SensorReadingHourly).delete()
+    db_session.query(SensorReadingDaily).delete()
+    db_session.commit()
+
+    assert sensor_rollups.ensure_rollups(db_engine) is True
+    assert sensor_rollups.ensure_rollups(db_engine) is False
+
+    hourly = db_session.query(SensorReadingHourly).filter(SensorReadingHourly.device_id == device.id).all()
+    assert sum(rollup.readings_count for rollup in hourly) == 2
+
+
+def test_aggregate_excludes_readings_before_window(client, db_session, make_sensor):
+    device, _ = make_sensor()
+    now = sensor_rollups.get_moscow_time()
+    _add_readings(
+        db_session,
+        device.id,
+        now - timedelta(hours=2, minutes=1),
+        now - timedelta(hours=2) + timedelta(minutes=1),
+        now - timedelta(minutes=30),
+    )
+
+    for bucket in ("1h", "1d"):
+        response = client.get(f"/api/sensors/devices/{device.id}/readings/aggregate", params={"bucket": bucket, "hours": 2})
+        assert response.status_code == 200
+        assert sum(item["count"] for item in response.json()) == 2
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+AI Recommendation Backfill
+--------------------------
+Массовая генерация "Краткой рекомендации от ИИ" для собранных товаров (is_growing == False),
+у которых ее нет в ProductPassport.data.
+
+Товары обрабатываются страницами по возрастанию id: страница генерируется пулом
+потоков с ограничением частоты запросов (token bucket), результаты записываются
+одним пакетным UPDATE, после чего в файл контрольной точки сохраняется последний
+обработанный id. Повторный запуск сначала повторяет товары, для которых генерация
+не удалась (failed в контрольной точке), затем продолжает с сохраненного места.
+
+Запуск:
+python -m utils.ai_backfill run --workers 4 --rate 2 --checkpoint ai_backfill.json
+"""
+import os
+import json
+import time
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, exists, func, select
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.orm import Session, contains_eager
+
+from models.ai_job import AiRecommendationJob
+from models.product import Product, ProductPassport
+from utils import ai_recommendation
+from utils.ai_jobs import (
+    RECOMMENDATION_FIELD, ACTIVE_STATUSES, AI_JOBS_MAX_ATTEMPTS,
+    passport_data_for_ai, wake_ai_job_worker,
+)
+
+logger = logging.getLogger("ai_backfill")
+
+AI_BACKFILL_WORKERS = int(os.getenv("AI_BACKFILL_WORKERS", "4"))
+AI_BACKFILL_RATE = float(os.getenv("AI_BACKFILL_RATE", "2"))          # запросов к LLM в секунду
+AI_BACKFILL_PAGE_SIZE = int(os.getenv("AI_BACKFILL_PAGE_SIZE", "50"))
+AI_BACKFILL_CHECKPOINT = os.getenv("AI_BACKFILL_CHECKPOINT", "ai_backfill_checkpoint.json")
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: не более rate вызовов в секунду с запасом burst.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Блокирует поток до появления токена.
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _missing_recommendation():
+    return func.btrim(func.coalesce(ProductPassport.data[RECOMMENDATION_FIELD].astext, "")) == ""
+
+
+def _products_missing_recommendation(db: Session):
+    return db.query(Product).join(ProductPassport, ProductPassport.product_id == Product.id).options(
+        contains_eager(Product.passport)
+    ).filter(
+        Product.is_growing == False,
+        _missing_recommendation(),
+    )
+
+
+def find_products_missing_recommendation(db: Session, after_id: int = 0, limit: int = AI_BACKFILL_PAGE_SIZE, unqueued_only: bool = False) -> List[Product]:
+    """
+    Собранные товары с паспортом без ИИ рекомендации, id > after_id, по возрастанию id.
+    С unqueued_only пропускаются товары, для которых уже есть незавершенное задание.
+    """
+    query = _products_missing_recommendation(db).filter(Product.id > after_id)
+    if unqueued_only:
+        job = AiRecommendationJob
+        query = query.filter(~exists(
+            select(job.id).where(job.product_id == Product.id, job.status.in_(ACTIVE_STATUSES))
+        ))
+    return query.order_by(Product.id).limit(limit).all()
+
+
+def save_recommendations(db: Session, recommendations: Dict[int, str]) -> None:
+    """
+    Пакетно дописывает рекомендации в паспорта (один UPDATE на пакет, jsonb ||).
+    Паспорта, в которых рекомендация уже появилась, не трогаются. Фиксирует транзакцию.
+    """
+    if not recommendations:
+        return
+    table = ProductPassport.__table__
+    stmt = (
+        table.update()
+        .where(
+            table.c.product_id == bindparam("_product_id"),
+            func.btrim(func.coalesce(table.c.data[RECOMMENDATION_FIELD].astext, "")) == "",
+        )
+        .values(data=table.c.data.op("||")(bindparam("_patch", type_=JSONB)), updated_at=bindparam("_updated_at"))
+    )
+    now = datetime.utcnow()
+    db.execute(stmt, [
+        {"_product_id": product_id, "_patch": {RECOMMENDATION_FIELD: text}, "_updated_at": now}
+        for product_id, text in recommendations.items()
+    ])
+    db.commit()
+
+
+def load_checkpoint(path: str) -> Dict:
+    if not path or not os.path.exists(path):
+        return {"last_product_id": 0, "generated": 0, "failed": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, state: Dict) -> None:
+    """
+    Атомарно сохраняет контрольную точку (запись во временный файл и os.replace).
+    """
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _generate(bucket: TokenBucket, product_id: int, kwargs: Dict) -> Optional[str]:
+    # Пока цепь NeuroAPI разомкнута, не расходуем попытки впустую
+    while ai_recommendation.neuroapi_breaker.state == "open":
+        time.sleep(1)
+    bucket.acquire()
+    try:
+        return ai_recommendation.generate_product_recommendation(**kwargs)
+    except Exception:
+        logger.exception("Backfill generation failed for product %s", product_id)
+        return None
+
+
+def _generate_page(db: Session, executor: ThreadPoolExecutor, bucket: TokenBucket, products: List[Product]) -> Dict[int, Optional[str]]:
+    """
+    Генерирует рекомендации для страницы товаров в пуле потоков.
+
+    Returns:
+        Dict[int, Optional[str]]: product_id -> рекомендация (None — генерация не удалась).
+    """
+    tasks = {}
+    for product in products:
+        kwargs = {
+            "product_name": product.name,
+            "product_category": product.category or "",
+            "short_description": product.short_description or "",
+            "passport_data": passport_data_for_ai(db, product, product.passport),
+        }
+        tasks[product.id] = executor.submit(_generate, bucket, product.id, kwargs)
+    # Соединение не держим открытым на время генерации страницы
+    db.commit()
+    return {product_id: future.result() for product_id, future in tasks.items()}
+
+
+def run_backfill(
+    db: Session,
+    workers: int = AI_BACKFILL_WORKERS,
+    rate: float = AI_BACKFILL_RATE,
+    page_size: int = AI_BACKFILL_PAGE_SIZE,
+    checkpoint_path: Optional[str] = AI_BACKFILL_CHECKPOINT,
+    limit: Optional[int] = None,
+) -> Dict:
+    """
+    Генерирует недостающие рекомендации с продолжением с контрольной точки.
+
+    Args:
+        db (Session): Сессия базы данных.
+        workers (int): Размер пула потоков генерации.
+        rate (float): Ограничение запросов к LLM в секунду (0 — без ограничения).
+        page_size (int): Товаров на страницу (и в одном пакетном UPDATE).
+        checkpoint_path (Optional[str]): Файл контрольной точки (None — без нее).
+        limit (Optional[int]): Обработать не более limit товаров.
+
+    Returns:
+        Dict: Итоговое состояние (last_product_id, generated, failed).
+    """
+    state = load_checkpoint(checkpoint_path)
+    bucket = TokenBucket(rate)
+    processed = 0
+    # Неудачи прошлых запусков повторяются первыми; снова неудачные остаются в failed
+    retry_ids, state["failed"] = list(state.get("failed") or []), []
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-backfill") as executor:
+        while limit is None or processed < limit:
+            size = page_size if limit is None else min(page_size, limit - processed)
+            if retry_ids:
+                page_ids, retry_ids = retry_ids[:size], retry_ids[size:]
+                # Товары, у которых рекомендация уже появилась (или которые удалены), пропускаются
+                products = _products_missing_recommendation(db).filter(Product.id.in_(page_ids)).order_by(Product.id).all()
+                last_id = state["last_product_id"]
+                if not products:
+                    save_checkpoint(checkpoint_path, {**state, "failed": state["failed"] + retry_ids})
+                    continue
+            else:
+                products = find_products_missing_recommendation(db, state["last_product_id"], size)
+                if not products:
+                    break
+                last_id = products[-1].id
+
+            generated = _generate_page(db, executor, bucket, products)
+            results = {product_id: text for product_id, text in generated.items() if text}
+            state["failed"] += [product_id for product_id, text in generated.items() if not text]
+
+            save_recommendations(db, results)
+            processed += len(generated)
+            state["last_product_id"] = last_id
+            state["generated"] += len(results)
+            # Еще не повторенные неудачи остаются в контрольной точке на случай прерывания
+            save_checkpoint(checkpoint_path, {**state, "failed": state["failed"] + retry_ids})
+            logger.info(
+                "Backfill page done: up to product %s, generated %s, failed %s (total generated %s)",
+                state["last_product_id"], len(results), len(generated) - len(results), state["generated"],
+            )
+    state["failed"] += retry_ids
+    return state
+
+
+def enqueue_backfill(db: Session, limit: int = 1000, page_size: int = AI_BACKFILL_PAGE_SIZE) -> int:
+    """
+    Ставит в фоновую очередь генерацию для товаров без рекомендации, у которых еще нет
+    незавершенного задания: страницами по page_size (один INSERT на страницу), пока не
+    наберется limit товаров. Повторный вызов продолжает со следующих товаров.
+
+    Returns:
+        int: Количество товаров, для которых поставлены задания.
+    """
+    table = AiRecommendationJob.__table__
+    queued = 0
+    after_id = 0
+    while queued < limit:
+        products = find_products_missing_recommendation(db, after_id, min(page_size, limit - queued), unqueued_only=True)
+        if not products:
+            break
+        now = datetime.utcnow()
+        stmt = pg_insert(table).values([
+            {
+                "product_id": product.id,
+                "status": "pending",
+                "attempts": 0,
+                "max_attempts": AI_JOBS_MAX_ATTEMPTS,
+                "run_after": now,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for product in products
+        ]).on_conflict_do_nothing(
+            index_elements=[table.c.product_id],
+            index_where=table.c.status.in_(ACTIVE_STATUSES),
+        )
+        queued += db.execute(stmt).rowcount
+        db.commit()
+        after_id = products[-1].id
+    if queued:
+        wake_ai_job_worker()
+    return queued
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Backfill missing AI recommendations for harvested products")
+    parser.add_argument("command", choices=["run", "enqueue"])
+    parser.add_argument("--workers", type=int, default=AI_BACKFILL_WORKERS)
+    parser.add_argument("--rate", type=float, default=AI_BACKFILL_RATE, help="Запросов к LLM в секунду (0 — без ограничения)")
+    parser.add_argument("--page-size", type=int, default=AI_BACKFILL_PAGE_SIZE)
+    parser.add_argument("--checkpoint", default=AI_BACKFILL_CHECKPOINT)
+    parser.add_argument("--reset", action="store_true", help="Начать заново, удалив контрольную точку")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "enqueue":
+            count = enqueue_backfill(db, limit=args.limit or 1000)
+            logger.info("Enqueued AI recommendation jobs for %s products", count)
+            return
+        if args.reset and os.path.exists(args.checkpoint):
+            os.remove(args.checkpoint)
+        state = run_backfill(
+            db,
+            workers=args.workers,
+            rate=args.rate,
+            page_size=args.page_size,
+            checkpoint_path=args.checkpoint,
+            limit=args.limit,
+        )
+        logger.info("Backfill finished: generated %s, failed %s", state["generated"], len(state["failed"]))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+AI Recommendation Cache
+-----------------------
+Кеш ИИ рекомендаций, адресуемый по содержимому контекста промпта.
+
+Ключ — sha256 от версии шаблона промпта и нормализованного контекста товара
+(регистр и пробелы не влияют), поэтому одинаковые товары и повторные публикации
+не требуют нового запроса к LLM. Два уровня: LRU в памяти процесса (TTL) перед
+таблицей ai_recommendation_cache. Смена шаблона промпта меняет версию и тем самым
+инвалидирует все старые записи.
+
+Очистка устаревших записей: python -m utils.ai_cache purge
+"""
+import os
+import re
+import argparse
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database.database import SessionLocal
+from models.ai_cache import AiRecommendationCache
+
+logger = logging.getLogger("ai_cache")
+
+AI_RECOMMENDATION_CACHE_ENABLED = os.getenv("AI_RECOMMENDATION_CACHE_ENABLED", "true").lower() == "true"
+AI_RECOMMENDATION_CACHE_TTL = float(os.getenv("AI_RECOMMENDATION_CACHE_TTL", str(30 * 24 * 3600)))  # секунды
+AI_RECOMMENDATION_CACHE_SIZE = int(os.getenv("AI_RECOMMENDATION_CACHE_SIZE", "1000"))             # записей в памяти
+
+_lock = threading.Lock()
+_lru: "OrderedDict[str, tuple]" = OrderedDict()  # cache_key -> (expires_at monotonic, recommendation)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_ISO_DATE_RE = re.compile(r"\b\d{4}-(\d{2})-\d{2}(?:[t ][\d:.+]+)?\b")
+
+
+def normalize_context(context: str) -> str:
+    """
+    Нормализует контекст промпта: нижний регистр, схлопнутые пробелы, без пустых строк.
+    Даты сводятся к месяцу, чтобы сезонный товар, выставленный повторно, попадал в кеш.
+    """
+    lines = (_WHITESPACE_RE.sub(" ", line).strip().lower() for line in context.splitlines())
+    return "\n".join(_ISO_DATE_RE.sub(r"month-\1", line) for line in lines if line)
+
+
+def cache_key(context: str, prompt_version: str) -> str:
+    """
+    Ключ кеша: sha256(версия промпта + нормализованный контекст).
+    """
+    raw = f"{prompt_version}\n{normalize_context(context)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _lru_get(key: str) -> Optional[str]:
+    with _lock:
+        entry = _lru.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            _lru.pop(key, None)
+            return None
+        _lru.move_to_end(key)
+        return value
+
+
+def _lru_put(key: str, value: str, ttl: float) -> None:
+    with _lock:
+        _lru[key] = (time.monotonic() + ttl, value)
+        _lru.move_to_end(key)
+        while len(_lru) > AI_RECOMMENDATION_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def clear_memory_cache() -> None:
+    """
+    Очищает уровень кеша в памяти процесса.
+    """
+    with _lock:
+        _lru.clear()
+
+
+def get_cached(context: str, prompt_version: str) -> Optional[str]:
+    """
+    Ищет рекомендацию для контекста: сначала в памяти, затем в БД.
+
+    Args:
+        context (str): Контекст товара, из которого строится промпт.
+        prompt_version (str): Текущая версия шаблона промпта.
+
+    Returns:
+        Optional[str]: Рекомендация или None.
+    """
+    if not AI_RECOMMENDATION_CACHE_ENABLED:
+        return None
+    key = cache_key(context, prompt_version)
+    value = _lru_get(key)
+    if value is not None:
+        return value
+
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        row = db.query(AiRecommendationCache.recommendation, AiRecommendationCache.expires_at).filter(
+            AiRecommendationCache.cache_key == key,
+            AiRecommendationCache.prompt_version == prompt_version,
+            AiRecommendationCache.expires_at > now,
+        ).first()
+        if row is None:
+            return None
+        db.execute(
+            update(AiRecommendationCache)
+            .where(AiRecommendationCache.cache_key == key)
+            .values(hits=AiRecommendationCache.hits + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.warning("AI recommendation cache lookup failed: %s", exc)
+        return None
+    finally:
+        db.close()
+
+    _lru_put(key, row.recommendation, min(AI_RECOMMENDATION_CACHE_TTL, (row.expires_at - now).total_seconds()))
+    return row.recommendation
+
+
+def store(context: str, prompt_version: str, recommendation: str) -> None:
+    """
+    Сохраняет рекомендацию в памяти и в БД (ошибки записи в БД не пробрасываются).
+    """
+    if not AI_RECOMMENDATION_CACHE_ENABLED or not recommendation:
+        return
+    key = cache_key(context, prompt_version)
+    _lru_put(key, recommendation, AI_RECOMMENDATION_CACHE_TTL)
+
+    now = datetime.utcnow()
+    values = {
+        "cache_key": key,
+        "prompt_version": prompt_version,
+        "recommendation": recommendation,
+        "hits": 0,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=AI_RECOMMENDATION_CACHE_TTL),
+    }
+    stmt = pg_insert(AiRecommendationCache.__table__).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AiRecommendationCache.__table__.c.cache_key],
+        set_={name: stmt.excluded[name] for name in ("prompt_version", "recommendation", "created_at", "expires_at")},
+    )
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.warning("Failed to store AI recommendation in cache: %s", exc)
+    finally:
+        db.close()
+
+
+def purge(prompt_version: str) -> int:
+    """
+    Удаляет из БД просроченные записи и записи других версий промпта.
+
+    Returns:
+        int: Количество удаленных записей.
+    """
+    clear_memory_cache()
+    db = SessionLocal()
+    try:
+        deleted = db.query(AiRecommendationCache).filter(or_(
+            AiRecommendationCache.expires_at <= datetime.utcnow(),
+            AiRecommendationCache.prompt_version != prompt_version,
+        )).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from utils.ai_recommendation import PROMPT_VERSION
+
+    parser = argparse.ArgumentParser(description="Maintenance of the AI recommendation cache")
+    parser.add_argument("command", choices=["purge"])
+    parser.parse_args(argv)
+    deleted = purge(PROMPT_VERSION)
+    logger.info("Purged %s AI recommendation cache entries (current prompt version %s)", deleted, PROMPT_VERSION)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+AI Recommendation Jobs
+----------------------
+Фоновая очередь генерации ИИ рекомендаций для паспортов продуктов.
+
+Задания хранятся в таблице ai_recommendation_jobs, поэтому переживают перезапуск
+и распределяются между несколькими процессами API (SELECT ... FOR UPDATE SKIP LOCKED).
+В каждом процессе диспетчер забирает задания не больше, чем есть свободных слотов
+пула (AI_JOBS_CONCURRENCY); неудачные попытки повторяются с экспоненциальной задержкой.
+Запрос к LLM выполняется без открытой транзакции, соединение с БД на это время не держится.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import and_, or_, select, update, bindparam, func
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database.database import SessionLocal
+from models.ai_job import AiRecommendationJob
+from models.product import Product, ProductPassport
+from utils import ai_recommendation
+from utils.sensor_rollups import passport_sensor_averages
+
+logger = logging.getLogger("ai_jobs")
+
+RECOMMENDATION_FIELD = "Краткая рекомендация от ИИ"
+
+# Конфигурация очереди
+AI_JOBS_WORKER_ENABLED = os.getenv("AI_JOBS_WORKER_ENABLED", "true").lower() == "true"
+AI_JOBS_CONCURRENCY = int(os.getenv("AI_JOBS_CONCURRENCY", "4"))               # одновременных запросов к LLM
+AI_JOBS_MAX_ATTEMPTS = int(os.getenv("AI_JOBS_MAX_ATTEMPTS", "5"))
+AI_JOBS_POLL_INTERVAL = float(os.getenv("AI_JOBS_POLL_INTERVAL", "5"))          # секунды
+AI_JOBS_RETRY_BASE_DELAY = float(os.getenv("AI_JOBS_RETRY_BASE_DELAY", "30"))   # секунды
+AI_JOBS_RETRY_MAX_DELAY = float(os.getenv("AI_JOBS_RETRY_MAX_DELAY", "3600"))   # секунды
+AI_JOBS_LOCK_TIMEOUT = float(os.getenv("AI_JOBS_LOCK_TIMEOUT", "600"))          # секунды, после которых задание считается зависшим
+
+ACTIVE_STATUSES = ("pending", "running")
+
+_wake = threading.Event()
+_stop = threading.Event()
+_dispatcher_thread: Optional[threading.Thread] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_in_flight_lock = threading.Lock()
+_in_flight = 0
+
+
+def needs_recommendation(product: Optional[Product], passport: Optional[ProductPassport]) -> bool:
+    """
+    Нужна ли продукту ИИ рекомендация: товар собран, паспорт есть, рекомендации в нем нет.
+    """
+    if product is None or product.is_growing or passport is None:
+        return False
+    existing = (passport.data or {}).get(RECOMMENDATION_FIELD)
+    return not existing or not str(existing).strip()
+
+
+def passport_data_for_ai(db: Session, product: Product, passport: ProductPassport) -> Dict[str, Any]:
+    """
+    Формирует данные паспорта для генерации ИИ рекомендации.
+    Если в паспорте нет средних показаний датчиков, они берутся из посуточных агрегатов.
+
+    Args:
+        db (Session): Сессия базы данных.
+        product (Product): Продукт.
+        passport (ProductPassport): Паспорт продукта.
+
+    Returns:
+        dict: Данные паспорта для ai_recommendation.
+    """
+    data = dict(passport.data or {})
+    try:
+        averages = passport_sensor_averages(db, product.id)
+    except Exception:
+        logger.exception("Failed to read sensor rollups for product %s", product.id)
+        averages = {}
+    if averages:
+        for field, value in averages.items():
+            data.setdefault(field, value)
+        data.setdefault("Есть датчики", True)
+    return {
+        "origin": passport.origin,
+        "variety": passport.variety,
+        "harvest_date": passport.harvest_date.isoformat() if passport.harvest_date else None,
+        "certifications": passport.certifications or [],
+        "data": data
+    }
+
+
+def apply_cached_recommendation(db: Session, product_id: int) -> bool:
+    """
+    Записывает в паспорт рекомендацию из кеша, если такой же контекст товара уже встречался.
+    Фиксирует транзакцию при успехе.
+
+    Returns:
+        bool: True, если рекомендация взята из кеша.
+    """
+    product = db.query(Product).filter(Product.id == product_id).first()
+    passport = product.passport if product else None
+    if not needs_recommendation(product, passport):
+        return False
+    recommendation = ai_recommendation.cached_product_recommendation(
+        product_name=product.name,
+        product_category=product.category or "",
+        short_description=product.short_description or "",
+        passport_data=passport_data_for_ai(db, product, passport),
+    )
+    if not recommendation:
+        return False
+    save_recommendation(db, product_id, recommendation)
+    db.commit()
+    logger.info("AI recommendation for product %s taken from cache", product_id)
+    return True
+
+
+def enqueue_recommendation(db: Session, product_id: int) -> bool:
+    """
+    Ставит в очередь генерацию рекомендации для продукта и фиксирует транзакцию.
+    Если рекомендация для такого же товара уже есть в кеше, она записывается сразу, без задания.
+    Если для продукта уже есть незавершенное задание, новое не создается.
+
+    Args:
+        db (Session): Сессия базы данных.
+        product_id (int): ID продукта.
+
+    Returns:
+        bool: True, если задание поставлено (или уже было в очереди).
+    """
+    try:
+        if apply_cached_recommendation(db, product_id):
+            return True
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to apply cached AI recommendation for product %s: %s", product_id, exc)
+
+    now = datetime.utcnow()
+    table = AiRecommendationJob.__table__
+    stmt = pg_insert(table).values(
+        product_id=product_id,
+        status="pending",
+        attempts=0,
+        max_attempts=AI_JOBS_MAX_ATTEMPTS,
+        run_after=now,
+        created_at=now,
+        updated_at=now,
+    ).on_conflict_do_nothing(
+        index_elements=[table.c.product_id],
+        index_where=table.c.status.in_(ACTIVE_STATUSES),
+    )
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to enqueue AI recommendation for product %s: %s", product_id, exc)
+        return False
+    wake_ai_job_worker()
+    return True
+
+
+def latest_job(db: Session, product_id: int) -> Optional[AiRecommendationJob]:
+    """
+    Последнее задание генерации рекомендации для продукта.
+    """
+    return db.query(AiRecommendationJob).filter(
+        AiRecommendationJob.product_id == product_id
+    ).order_by(AiRecommendationJob.id.desc()).first()
+
+
+def claim_jobs(db: Session, limit: int) -> list:
+    """
+    Забирает до limit готовых к запуску заданий (включая зависшие) и помечает их running.
+    Задания, заблокированные другими процессами, пропускаются (SKIP LOCKED).
+
+    Returns:
+        list: Строки (id, product_id, attempts, max_attempts).
+    """
+    if limit <= 0:
+        return []
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=AI_JOBS_LOCK_TIMEOUT)
+    job = AiRecommendationJob
+
+    # Зависшие задания без оставшихся попыток больше не перезапускаются
+    db.execute(
+        update(job)
+        .where(job.status == "running", job.locked_at < stale_before, job.attempts >= job.max_attempts)
+        .values(status="failed", last_error="Lock timeout", updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+    candidates = (
+        select(job.id)
+        .where(or_(
+            and_(job.status == "pending", job.run_after <= now),
+            and_(job.status == "running", job.locked_at < stale_before),
+        ))
+        .order_by(job.run_after, job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.execute(
+        update(job)
+        .where(job.id.in_(candidates.scalar_subquery()))
+        .values(status="running", locked_at=now, attempts=job.attempts + 1, updated_at=now)
+        .returning(job.id, job.product_id, job.attempts, job.max_attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return rows
+
+
+def _finish_job(db: Session, job_id: int, status: str, error: Optional[str] = None, run_after: Optional[datetime] = None) -> None:
+    values = {"status": status, "locked_at": None, "last_error": error, "updated_at": datetime.utcnow()}
+    if run_after is not None:
+        values["run_after"] = run_after
+    db.execute(
+        update(AiRecommendationJob)
+        .where(AiRecommendationJob.id == job_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _retry_or_fail(db: Session, job_id: int, attempts: int, max_attempts: int, error: str) -> None:
+    if attempts >= max_attempts:
+        _finish_job(db, job_id, "failed", error)
+        logger.warning("AI recommendation job %s failed after %s attempts: %s", job_id, attempts, error)
+    else:
+        delay = min(AI_JOBS_RETRY_BASE_DELAY * (2 ** (attempts - 1)), AI_JOBS_RETRY_MAX_DELAY)
+        _finish_job(db, job_id, "pending", error, run_after=datetime.utcnow() + timedelta(seconds=delay))
+        logger.info("AI recommendation job %s will be retried in %.0fs: %s", job_id, delay, error)
+    db.commit()
+
+
+def save_recommendation(db: Session, product_id: int, recommendation: str) -> bool:
+    """
+    Дописывает рекомендацию в ProductPassport.data (jsonb ||), не затирая остальные поля
+    и не перезаписывая рекомендацию, появившуюся за время генерации. Без commit.
+
+    Returns:
+        bool: True, если паспорт обновлен.
+    """
+    patch = bindparam("recommendation_patch", {RECOMMENDATION_FIELD: recommendation}, type_=JSONB)
+    current = func.coalesce(ProductPassport.data[RECOMMENDATION_FIELD].astext, "")
+    result = db.execute(
+        update(ProductPassport)
+        .where(ProductPassport.product_id == product_id, func.btrim(current) == "")
+        .values(data=ProductPassport.data.op("||")(patch), updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def run_job(job_id: int, product_id: int, attempts: int, max_attempts: int) -> None:
+    """
+    Выполняет одно задание: генерирует рекомендацию и записывает ее в паспорт.
+    """
+    db = SessionLocal()
+    try:
+        product = db.query(Product).filter(Product.id == product_id).first()
+        passport = product.passport if product else None
+        if not needs_recommendation(product, passport):
+            _finish_job(db, job_id, "done")
+            db.commit()
+            return
+
+        kwargs = {
+            "product_name": product.name,
+            "product_category": product.category or "",
+            "short_description": product.short_description or "",
+            "passport_data": passport_data_for_ai(db, product, passport),
+        }
+        # Завершаем транзакцию чтения: соединение возвращается в пул на время запроса к LLM
+        db.commit()
+
+        recommendation = ai_recommendation.generate_product_recommendation(**kwargs)
+        if not recommendation:
+            _retry_or_fail(db, job_id, attempts, max_attempts, "Failed to generate AI recommendation")
+            return
+
+        save_recommendation(db, product_id, recommendation)
+        _finish_job(db, job_id, "done")
+        db.commit()
+        logger.info("Successfully generated AI recommendation for product %s", product_id)
+    except Exception as exc:
+        db.rollback()
+        logger.exception("AI recommendation job %s crashed: %s", job_id, exc)
+        try:
+            _retry_or_fail(db, job_id, attempts, max_attempts, str(exc)[:1000])
+        except Exception:
+            db.rollback()
+            logger.exception("Failed to record AI recommendation job %s failure", job_id)
+    finally:
+        db.close()
+
+
+def _run_and_release(row) -> None:
+    global _in_flight
+    try:
+        run_job(row.id, row.product_id, row.attempts, row.max_attempts)
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+        _wake.set()
+
+
+def _dispatch_once() -> int:
+    global _in_flight
+    with _in_flight_lock:
+        free = AI_JOBS_CONCURRENCY - _in_flight
+    if free <= 0:
+        return 0
+
+    db = SessionLocal()
+    try:
+        rows = claim_jobs(db, free)
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to claim AI recommendation jobs: %s", exc)
+        return 0
+    finally:
+        db.close()
+
+    for row in rows:
+        with _in_flight_lock:
+            _in_flight += 1
+        _executor.submit(_run_and_release, row)
+    return len(rows)
+
+
+def _dispatcher_loop() -> None:
+    while not _stop.is_set():
+        _wake.clear()
+        if _dispatch_once():
+            continue
+        _wake.wait(AI_JOBS_POLL_INTERVAL)
+
+
+def wake_ai_job_worker() -> None:
+    """
+    Будит диспетчер текущего процесса (например, сразу после постановки задания).
+    """
+    _wake.set()
+
+
+def start_ai_job_worker() -> None:
+    """
+    Запускает диспетчер и пул воркеров очереди (если AI_JOBS_WORKER_ENABLED).
+    """
+    global _dispatcher_thread, _executor
+    if not AI_JOBS_WORKER_ENABLED:
+        logger.info("AI recommendation worker is disabled")
+        return
+    if _dispatcher_thread is not None and _dispatcher_thread.is_alive():
+        return
+    _stop.clear()
+    _executor = ThreadPoolExecutor(max_workers=AI_JOBS_CONCURRENCY, thread_name_prefix="ai-recommendation")
+    _dispatcher_thread = threading.Thread(target=_dispatcher_loop, name="ai-recommendation-dispatcher", daemon=True)
+    _dispatcher_thread.start()
+
+
+def stop_ai_job_worker() -> None:
+    """
+    Останавливает диспетчер и дожидается выполняющихся заданий.
+    Невыполненные задания остаются в таблице и будут подхвачены после перезапуска.
+    """
+    global _dispatcher_thread, _executor
+    _stop.set()
+    _wake.set()
+    if _dispatcher_thread is not None:
+        _dispatcher_thread.join(timeout=5)
+        _dispatcher_thread = None
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
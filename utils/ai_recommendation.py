@@ -6,29 +6,126 @@ AI Recommendation Utilities
 """
 
 import os
+import hashlib
 import logging
+import threading
 import requests
 from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 
+from utils import ai_cache
+from utils.http_client import HttpClient, CircuitBreaker, CircuitOpenError, UpstreamBusyError, UpstreamHTTPError
+
 load_dotenv()
 
 logger = logging.getLogger("ai_recommendation")
 
 # Конфигурация NeuroAPI
-NEUROAPI_URL = "https://neuroapi.host/v1/chat/completions"
+NEUROAPI_URL = os.getenv("NEUROAPI_URL", "https://neuroapi.host/v1/chat/completions")
 NEUROAPI_KEY = os.getenv("NEUROAPI_KEY")
 NEUROAPI_MODEL = os.getenv("NEUROAPI_MODEL", "gpt-5-nano")
 
+# Параметры HTTP-клиента NeuroAPI
+NEUROAPI_MAX_CONCURRENCY = int(os.getenv("NEUROAPI_MAX_CONCURRENCY", "8"))
+NEUROAPI_POOL_SIZE = int(os.getenv("NEUROAPI_POOL_SIZE", "10"))
+NEUROAPI_RETRIES = int(os.getenv("NEUROAPI_RETRIES", "2"))
+NEUROAPI_BACKOFF_BASE = float(os.getenv("NEUROAPI_BACKOFF_BASE", "0.5"))      # секунды
+NEUROAPI_BACKOFF_MAX = float(os.getenv("NEUROAPI_BACKOFF_MAX", "8"))          # секунды
+NEUROAPI_CONNECT_TIMEOUT = float(os.getenv("NEUROAPI_CONNECT_TIMEOUT", "5"))  # секунды
+NEUROAPI_READ_TIMEOUT = float(os.getenv("NEUROAPI_READ_TIMEOUT", "60"))       # секунды
+NEUROAPI_QUEUE_TIMEOUT = float(os.getenv("NEUROAPI_QUEUE_TIMEOUT", "10"))     # ожидание свободного слота, секунды
+NEUROAPI_BREAKER_THRESHOLD = int(os.getenv("NEUROAPI_BREAKER_THRESHOLD", "5"))
+NEUROAPI_BREAKER_RESET = float(os.getenv("NEUROAPI_BREAKER_RESET", "30"))     # секунды
 
-def generate_product_recommendation(
+# Размыкатель цепи NeuroAPI
+neuroapi_breaker = CircuitBreaker("neuroapi", NEUROAPI_BREAKER_THRESHOLD, NEUROAPI_BREAKER_RESET)
+
+_clients_lock = threading.Lock()
+_client: Optional[HttpClient] = None
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "headers": {"Authorization": f"Bearer {NEUROAPI_KEY}", "Content-Type": "application/json"},
+        "max_concurrency": NEUROAPI_MAX_CONCURRENCY,
+        "pool_size": NEUROAPI_POOL_SIZE,
+        "retries": NEUROAPI_RETRIES,
+        "backoff_base": NEUROAPI_BACKOFF_BASE,
+        "backoff_max": NEUROAPI_BACKOFF_MAX,
+        "connect_timeout": NEUROAPI_CONNECT_TIMEOUT,
+        "read_timeout": NEUROAPI_READ_TIMEOUT,
+        "queue_timeout": NEUROAPI_QUEUE_TIMEOUT,
+        "breaker": neuroapi_breaker,
+    }
+
+
+def get_neuroapi_client() -> HttpClient:
+    """
+    Общий клиент NeuroAPI (пул keep-alive соединений).
+    """
+    global _client
+    if _client is None:
+        with _clients_lock:
+            if _client is None:
+                _client = HttpClient("neuroapi", **_client_options())
+    return _client
+
+
+def close_neuroapi_clients() -> None:
+    """
+    Закрывает соединения клиента NeuroAPI (при остановке приложения).
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+# Шаблоны промпта. Любое их изменение меняет PROMPT_VERSION и инвалидирует кеш рекомендаций.
+SYSTEM_MESSAGE = """Ты эксперт по описанию фермерских продуктов. Твоя задача - создавать краткие, привлекательные рекомендации для покупателей, которые подчеркивают уникальные качества продукта."""
+
+USER_MESSAGE_TEMPLATE = """На основе следующей информации о товаре создай краткую рекомендацию для покупателей (3-4 предложения). 
+Рекомендация должна быть привлекательной, информативной и подчеркивать уникальные качества продукта.
+
+Постарайся не повторять информацию из описания товара. Выдай что нибудь общее и конкретное на основе информаци что тебе предоставлена
+
+Информация о товаре:
+{context}
+
+Пример хорошей рекомендации:
+"Этот нут отличается мягким, чуть сладковатым вкусом и равномерным размером зёрен. После варки сохраняет форму и кремовую текстуру — идеально подходит для хумуса и восточных блюд. Рекомендуется покупателям, которые ищут качественную альтернативу импортным бобовым с минимальным следом углерода."
+
+Создай похожую рекомендацию для этого товара:"""
+
+PROMPT_VERSION = hashlib.sha256(
+    "\n".join([NEUROAPI_MODEL, SYSTEM_MESSAGE, USER_MESSAGE_TEMPLATE]).encode("utf-8")
+).hexdigest()[:16]
+
+
+def _request_payload(context: str) -> Dict[str, Any]:
+    return {
+        "model": NEUROAPI_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": USER_MESSAGE_TEMPLATE.format(context=context)}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 1500
+    }
+
+
+def _parse_recommendation(result: Dict[str, Any]) -> str:
+    return result.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+
+
+def build_recommendation_context(
     product_name: str,
     product_category: str,
     short_description: Optional[str] = None,
     passport_data: Optional[Dict[str, Any]] = None
-) -> Optional[str]:
+) -> str:
     """
-    Генерирует краткую рекомендацию для товара на основе его данных.
+    Формирует контекст товара для промпта.
     
     Args:
         product_name (str): Название товара.
@@ -37,105 +134,121 @@ def generate_product_recommendation(
         passport_data (Optional[Dict[str, Any]]): Данные паспорта товара.
         
     Returns:
-        Optional[str]: Сгенерированная рекомендация или None в случае ошибки.
+        str: Контекст (по одному факту о товаре на строку).
     """
-    try:
-        # Формируем контекст из данных товара
-        context_parts = [f"Название товара: {product_name}"]
-        context_parts.append(f"Категория: {product_category}")
-        
-        if short_description:
-            context_parts.append(f"Описание: {short_description}")
-        
-        if passport_data:
-            origin = passport_data.get("origin")
-            variety = passport_data.get("variety")
-            harvest_date = passport_data.get("harvest_date")
-            certifications = passport_data.get("certifications", [])
-            sensor_data = passport_data.get("data", {})
-            
-            if origin:
-                context_parts.append(f"Происхождение: {origin}")
-            if variety:
-                context_parts.append(f"Сорт/вид: {variety}")
-            if harvest_date:
-                context_parts.append(f"Дата сбора урожая: {harvest_date}")
-            
-            if certifications:
-                cert_names = [c.get("name", "") for c in certifications if c.get("name")]
-                if cert_names:
-                    context_parts.append(f"Сертификаты: {', '.join(cert_names)}")
-            
-            # Добавляем важные данные сенсоров, если они есть
-            if sensor_data:
-                if sensor_data.get("Есть датчики"):
-                    avg_ph = sensor_data.get("Средний pH за время выращивания")
-                    if avg_ph:
-                        context_parts.append(f"Средний pH за время выращивания: {avg_ph}")
-                    
-                    salinity = sensor_data.get("Средняя соленость почвы за время выращивания")
-                    if salinity:
-                        context_parts.append(f"Средняя соленость почвы: {salinity}")
-                    
-                    temp = sensor_data.get("Средняя температура за время выращивания")
-                    if temp:
-                        context_parts.append(f"Средняя температура: {temp}")
+    context_parts = [f"Название товара: {product_name}"]
+    context_parts.append(f"Категория: {product_category}")
+    
+    if short_description:
+        context_parts.append(f"Описание: {short_description}")
+    
+    if passport_data:
+        origin = passport_data.get("origin")
+        variety = passport_data.get("variety")
+        harvest_date = passport_data.get("harvest_date")
+        certifications = passport_data.get("certifications", [])
+        sensor_data = passport_data.get("data", {})
         
-        context = "\n".join(context_parts)
+        if origin:
+            context_parts.append(f"Происхождение: {origin}")
+        if variety:
+            context_parts.append(f"Сорт/вид: {variety}")
+        if harvest_date:
+            context_parts.append(f"Дата сбора урожая: {harvest_date}")
         
-        # Формируем промпт для ИИ
-        system_message = """Ты эксперт по описанию фермерских продуктов. Твоя задача - создавать краткие, привлекательные рекомендации для покупателей, которые подчеркивают уникальные качества продукта."""
+        if certifications:
+            cert_names = [c.get("name", "") for c in certifications if c.get("name")]
+            if cert_names:
+                context_parts.append(f"Сертификаты: {', '.join(cert_names)}")
         
-        user_message = f"""На основе следующей информации о товаре создай краткую рекомендацию для покупателей (3-4 предложения). 
-Рекомендация должна быть привлекательной, информативной и подчеркивать уникальные качества продукта.
+        # Добавляем важные данные сенсоров, если они есть
+        if sensor_data:
+            if sensor_data.get("Есть датчики"):
+                avg_ph = sensor_data.get("Средний pH за время выращивания")
+                if avg_ph:
+                    context_parts.append(f"Средний pH за время выращивания: {avg_ph}")
+                
+                salinity = sensor_data.get("Средняя соленость почвы за время выращивания")
+                if salinity:
+                    context_parts.append(f"Средняя соленость почвы: {salinity}")
+                
+                temp = sensor_data.get("Средняя температура за время выращивания")
+                if temp:
+                    context_parts.append(f"Средняя температура: {temp}")
+    
+    return "\n".join(context_parts)
 
-Постарайся не повторять информацию из описания товара. Выдай что нибудь общее и конкретное на основе информаци что тебе предоставлена
 
-Информация о товаре:
-{context}
-
-Пример хорошей рекомендации:
-"Этот нут отличается мягким, чуть сладковатым вкусом и равномерным размером зёрен. После варки сохраняет форму и кремовую текстуру — идеально подходит для хумуса и восточных блюд. Рекомендуется покупателям, которые ищут качественную альтернативу импортным бобовым с минимальным следом углерода."
+def cached_product_recommendation(
+    product_name: str,
+    product_category: str,
+    short_description: Optional[str] = None,
+    passport_data: Optional[Dict[str, Any]] = None
+) -> Optional[str]:
+    """
+    Рекомендация из кеша для такого же контекста товара (без запроса к NeuroAPI).
+    
+    Returns:
+        Optional[str]: Рекомендация или None, если в кеше ее нет.
+    """
+    context = build_recommendation_context(product_name, product_category, short_description, passport_data)
+    return ai_cache.get_cached(context, PROMPT_VERSION)
 
-Создай похожую рекомендацию для этого товара:"""
 
-        # Выполняем запрос к NeuroAPI
+def generate_product_recommendation(
+    product_name: str,
+    product_category: str,
+    short_description: Optional[str] = None,
+    passport_data: Optional[Dict[str, Any]] = None,
+    use_cache: bool = True
+) -> Optional[str]:
+    """
+    Генерирует краткую рекомендацию для товара на основе его данных.
+    Для уже встречавшегося контекста рекомендация берется из кеша.
+    
+    Args:
+        product_name (str): Название товара.
+        product_category (str): Категория товара.
+        short_description (Optional[str]): Краткое описание товара.
+        passport_data (Optional[Dict[str, Any]]): Данные паспорта товара.
+        use_cache (bool): Использовать кеш рекомендаций.
+        
+    Returns:
+        Optional[str]: Сгенерированная рекомендация или None в случае ошибки.
+    """
+    try:
+        context = build_recommendation_context(product_name, product_category, short_description, passport_data)
+        if use_cache:
+            cached = ai_cache.get_cached(context, PROMPT_VERSION)
+            if cached:
+                logger.info(f"Using cached recommendation for product: {product_name}")
+                return cached
+        
         try:
-            response = requests.post(
-                NEUROAPI_URL,
-                headers={
-                    "Authorization": f"Bearer {NEUROAPI_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": NEUROAPI_MODEL,
-                    "messages": [
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 1500
-                },
-                timeout=60.0
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"NeuroAPI returned status {response.status_code}: {response.text}")
-                return None
-            
-            result = response.json()
+            result = get_neuroapi_client().post_json(NEUROAPI_URL, _request_payload(context))
+        except CircuitOpenError:
+            logger.warning("NeuroAPI circuit is open, skipping AI recommendation")
+            return None
+        except UpstreamBusyError:
+            logger.warning("NeuroAPI concurrency limit reached, skipping AI recommendation")
+            return None
+        except UpstreamHTTPError as e:
+            logger.error(f"NeuroAPI returned status {e.status_code}: {e.body}")
+            return None
         except requests.Timeout:
             logger.error("Timeout while generating AI recommendation")
             return None
         except requests.RequestException as e:
             logger.error(f"Request error while generating AI recommendation: {e}")
             return None
-        recommendation = result.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+        recommendation = _parse_recommendation(result)
         
         if not recommendation:
             logger.warning("Empty recommendation received from NeuroAPI")
             return None
         
+        if use_cache:
+            ai_cache.store(context, PROMPT_VERSION, recommendation)
         logger.info(f"Successfully generated recommendation for product: {product_name}")
         return recommendation
         
@@ -2,21 +2,32 @@
 """
 utils/auth.py
 Утилиты аутентификации: создание токенов, получение текущего пользователя (строгое и опциональное).
+
+Для маршрутов, которым не нужна ORM-модель пользователя, есть get_current_principal:
+снимок пользователя (Principal) берется из кеша процесса (TTL + LRU) и не стоит запроса к БД.
+Кеш сбрасывается при изменении строки users через ORM (в том числе в других сессиях
+этого процесса); в других процессах устаревший снимок живет не дольше PRINCIPAL_CACHE_TTL.
+Проверки только по роли (require_roles) авторизуют прямо по claims токена.
+Подпись проверяется бэкендом utils.jwt_backend, результат кешируется (decode_access_token).
 """
 
 import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, NamedTuple, Optional, Set
 
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt, ExpiredSignatureError
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 
 from database.database import get_db
 from models.user import User
+from utils.jwt_backend import DecodedTokenCache, TokenExpired, TokenInvalid, get_jwt_backend
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -29,6 +40,17 @@ if not SECRET_KEY or len(SECRET_KEY) < 32:
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Кеш проверенных токенов (запись живет не дольше exp токена)
+JWT_DECODE_CACHE_SIZE = int(os.getenv("JWT_DECODE_CACHE_SIZE", "20000"))    # записей
+JWT_DECODE_CACHE_TTL = float(os.getenv("JWT_DECODE_CACHE_TTL", "300"))      # секунды
+
+_jwt = get_jwt_backend()
+_decoded_tokens = DecodedTokenCache(JWT_DECODE_CACHE_SIZE, JWT_DECODE_CACHE_TTL)
+
+# Конфигурация кеша пользователей (Principal)
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))        # секунды
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "50000"))     # записей
+
 # Две схемы аутентификации
 security_required = HTTPBearer(auto_error=True)   # Строгое поведение: вызывает исключение при отсутствии/ошибке токена
 security_optional = HTTPBearer(auto_error=False)  # Опциональное: возвращает None при отсутствии токена
@@ -51,10 +73,204 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     # Добавление уникального идентификатора токена
     to_encode.update({"jti": secrets.token_urlsafe(16)})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = _jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+class Principal(NamedTuple):
+    """
+    Снимок пользователя для авторизации и чтения профиля без ORM-сессии.
+    Поля совпадают с schemas.user.User, поэтому Principal можно вернуть как ответ;
+    balance в снимке может отставать — для ответов используйте load_balance.
+    """
+    id: int
+    email: str
+    first_name: str
+    last_name: str
+    middle_name: Optional[str]
+    role: str
+    is_active: bool
+    balance: int
+
+
+class TokenClaims(NamedTuple):
+    """
+    Данные пользователя из claims access-токена (без обращения к БД).
+    """
+    id: int
+    role: Optional[str]
+
+
+_principal_lock = threading.Lock()
+_principal_cache: "OrderedDict[int, tuple]" = OrderedDict()  # user_id -> (expires_at, Principal)
+# Счетчик изменений пользователя: снимок, прочитанный до изменения, не попадает в кеш
+_principal_versions: Dict[int, int] = {}
+
+
+def principal_from_user(user: User) -> Principal:
+    return Principal(
+        id=user.id,
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        middle_name=user.middle_name,
+        role=user.role,
+        is_active=bool(user.is_active),
+        balance=user.balance or 0,
+    )
+
+
+def _principal_get(user_id: int) -> Optional[Principal]:
+    now = time.monotonic()
+    with _principal_lock:
+        entry = _principal_cache.get(user_id)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at <= now:
+            del _principal_cache[user_id]
+            return None
+        _principal_cache.move_to_end(user_id)
+        return principal
+
+
+def _principal_version(user_id: int) -> int:
+    with _principal_lock:
+        return _principal_versions.get(user_id, 0)
+
+
+def _principal_put(principal: Principal, version: int) -> None:
+    if PRINCIPAL_CACHE_TTL <= 0:
+        return
+    with _principal_lock:
+        if _principal_versions.get(principal.id, 0) != version:
+            return
+        _principal_cache[principal.id] = (time.monotonic() + PRINCIPAL_CACHE_TTL, principal)
+        _principal_cache.move_to_end(principal.id)
+        while len(_principal_cache) > PRINCIPAL_CACHE_SIZE:
+            _principal_cache.popitem(last=False)
+
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Сбрасывает снимок пользователя в кеше процесса.
+    Вызывается автоматически при изменении User через ORM; после массовых
+    UPDATE/DELETE по таблице users его нужно вызвать явно.
+
+    Args:
+        user_id (int): ID пользователя.
+    """
+    with _principal_lock:
+        _principal_cache.pop(user_id, None)
+        _principal_versions[user_id] = _principal_versions.get(user_id, 0) + 1
+
+
+def clear_principal_cache() -> None:
+    """
+    Полностью очищает кеш пользователей.
+    """
+    with _principal_lock:
+        for user_id in _principal_cache:
+            _principal_versions[user_id] = _principal_versions.get(user_id, 0) + 1
+        _principal_cache.clear()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _on_user_changed(mapper, connection, target) -> None:
+    invalidate_principal(target.id)
+    # Повторный сброс после commit: между flush и commit другой поток мог прочитать
+    # еще не измененную строку и положить ее в кеш
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("principal_invalidate", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _on_session_commit(session) -> None:
+    changed: Set[int] = session.info.pop("principal_invalidate", None)
+    if changed:
+        for user_id in changed:
+            invalidate_principal(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _on_session_rollback(session, previous_transaction) -> None:
+    session.info.pop("principal_invalidate", None)
+
+
+def load_balance(db: Session, user_id: int) -> int:
+    """
+    Баланс пользователя из БД одной колонкой. Principal кешируется в процессе
+    и не видит списаний и пополнений, выполненных другими воркерами, поэтому
+    ответы с балансом читают его здесь.
+
+    Args:
+        db (Session): Сессия базы данных.
+        user_id (int): ID пользователя.
+
+    Returns:
+        int: Текущий баланс (0, если пользователь не найден).
+    """
+    return db.query(User.balance).filter(User.id == user_id).scalar() or 0
+
+
+def load_principal(db: Session, user_id: int) -> Optional[Principal]:
+    """
+    Снимок пользователя из кеша, при промахе — из БД (с записью в кеш).
+
+    Args:
+        db (Session): Сессия базы данных (используется только при промахе).
+        user_id (int): ID пользователя.
+
+    Returns:
+        Optional[Principal]: Снимок пользователя или None, если пользователь не найден.
+    """
+    principal = _principal_get(user_id)
+    if principal is not None:
+        return principal
+    version = _principal_version(user_id)
+    row = db.query(
+        User.id, User.email, User.first_name, User.last_name, User.middle_name,
+        User.role, User.is_active, User.balance,
+    ).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    principal = Principal(
+        id=row.id,
+        email=row.email,
+        first_name=row.first_name,
+        last_name=row.last_name,
+        middle_name=row.middle_name,
+        role=row.role,
+        is_active=bool(row.is_active),
+        balance=row.balance or 0,
+    )
+    _principal_put(principal, version)
+    return principal
+
+
+def decode_access_token(token: str) -> dict:
+    """
+    Проверка подписи и срока действия токена с кешированием результата.
+
+    Args:
+        token (str): JWT токен.
+
+    Returns:
+        dict: Данные токена (не изменять — объект общий для всех запросов с этим токеном).
+
+    Raises:
+        TokenExpired: Если срок действия истек.
+        TokenInvalid: Если токен невалиден.
+    """
+    payload = _decoded_tokens.get(token)
+    if payload is None:
+        payload = _jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        _decoded_tokens.put(token, payload)
+    return payload
+
+
 def _decode_token_no_raise(token: str) -> Optional[dict]:
     """
     Декодирование токена без выброса исключений.
@@ -66,31 +282,29 @@ def _decode_token_no_raise(token: str) -> Optional[dict]:
         Optional[dict]: Данные токена или None в случае ошибки декодирования.
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except (ExpiredSignatureError, JWTError):
+        return decode_access_token(token)
+    except (TokenExpired, TokenInvalid):
         return None
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security_required),
-    db: Session = Depends(get_db),
-) -> User:
+def _user_id_from_payload(payload: Optional[dict]) -> Optional[int]:
+    if not payload:
+        return None
+    try:
+        return int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _decode_access_token(credentials: Optional[HTTPAuthorizationCredentials]) -> dict:
     """
-    Получение текущего пользователя (строгая проверка).
-    
-    Вызывает HTTPException(401/403) при отсутствии, невалидности или истечении срока токена.
-    Сохраняет предыдущее поведение.
-    
-    Args:
-        credentials (HTTPAuthorizationCredentials): Авторизационные данные из заголовка.
-        db (Session): Сессия базы данных.
-        
+    Декодирует access-токен из заголовка Authorization.
+
     Returns:
-        User: Объект пользователя.
-        
+        dict: Данные токена (sub гарантированно есть).
+
     Raises:
-        HTTPException: При отсутствии аутентификации или невалидном токене.
+        HTTPException: 401 при отсутствии, невалидности или истечении срока токена.
     """
     if not credentials:
         raise HTTPException(
@@ -107,27 +321,56 @@ def get_current_user(
     )
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         sub = payload.get("sub")
         if sub is None:
             raise credentials_exception
-    except ExpiredSignatureError:
+    except TokenExpired:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Срок действия токена истек",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except JWTError:
+    except TokenInvalid:
         raise credentials_exception
 
-    try:
-        user_id = int(sub)
-    except (TypeError, ValueError):
+    if _user_id_from_payload(payload) is None:
         raise credentials_exception
+    return payload
+
 
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security_required),
+    db: Session = Depends(get_db),
+) -> User:
+    """
+    Получение текущего пользователя (строгая проверка).
+    
+    Вызывает HTTPException(401/403) при отсутствии, невалидности или истечении срока токена.
+    Возвращает ORM-объект в сессии db — для маршрутов, которые изменяют пользователя
+    или связывают его с другими объектами. Остальным достаточно get_current_principal.
+    
+    Args:
+        credentials (HTTPAuthorizationCredentials): Авторизационные данные из заголовка.
+        db (Session): Сессия базы данных.
+        
+    Returns:
+        User: Объект пользователя.
+        
+    Raises:
+        HTTPException: При отсутствии аутентификации или невалидном токене.
+    """
+    user_id = _user_id_from_payload(_decode_access_token(credentials))
+
+    version = _principal_version(user_id)
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Не удалось проверить учетные данные",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    _principal_put(principal_from_user(user), version)
     if not getattr(user, "is_active", True):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Аккаунт пользователя деактивирован")
 
@@ -142,8 +385,7 @@ def get_current_user_optional(
     Получение текущего пользователя (опциональная проверка).
     
     Возвращает пользователя или None. Не вызывает исключение при отсутствии,
-    истечении срока или невалидности токена. Полезно для маршрутов,
-    где разрешен анонимный доступ (например, для обслуживания публичных медиа).
+    истечении срока или невалидности токена.
     
     Args:
         credentials (Optional[HTTPAuthorizationCredentials]): Авторизационные данные из заголовка.
@@ -155,15 +397,8 @@ def get_current_user_optional(
     if not credentials:
         return None
 
-    token = credentials.credentials
-    payload = _decode_token_no_raise(token)
-    if not payload:
-        return None
-
-    sub = payload.get("sub")
-    try:
-        user_id = int(sub)
-    except (TypeError, ValueError):
+    user_id = _user_id_from_payload(_decode_token_no_raise(credentials.credentials))
+    if user_id is None:
         return None
 
     user = db.query(User).filter(User.id == user_id).first()
@@ -172,4 +407,103 @@ def get_current_user_optional(
     if not getattr(user, "is_active", True):
         return None
 
-    return user
\ No newline at end of file
+    return user
+
+
+def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security_required),
+    db: Session = Depends(get_db),
+) -> Principal:
+    """
+    Текущий пользователь как Principal (строгая проверка, как get_current_user).
+    При попадании в кеш запрос к БД не выполняется.
+
+    Args:
+        credentials (HTTPAuthorizationCredentials): Авторизационные данные из заголовка.
+        db (Session): Сессия базы данных (используется только при промахе кеша).
+
+    Returns:
+        Principal: Снимок пользователя.
+
+    Raises:
+        HTTPException: 401 при невалидном токене, 403 для деактивированного аккаунта.
+    """
+    user_id = _user_id_from_payload(_decode_access_token(credentials))
+    principal = load_principal(db, user_id)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Не удалось проверить учетные данные",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Аккаунт пользователя деактивирован")
+    return principal
+
+
+def get_current_principal_optional(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security_optional),
+    db: Session = Depends(get_db),
+) -> Optional[Principal]:
+    """
+    Текущий пользователь как Principal или None (как get_current_user_optional).
+
+    Args:
+        credentials (Optional[HTTPAuthorizationCredentials]): Авторизационные данные из заголовка.
+        db (Session): Сессия базы данных (используется только при промахе кеша).
+
+    Returns:
+        Optional[Principal]: Снимок пользователя или None.
+    """
+    if not credentials:
+        return None
+    user_id = _user_id_from_payload(_decode_token_no_raise(credentials.credentials))
+    if user_id is None:
+        return None
+    principal = load_principal(db, user_id)
+    if principal is None or not principal.is_active:
+        return None
+    return principal
+
+
+def get_token_claims(
+    credentials: HTTPAuthorizationCredentials = Depends(security_required),
+    db: Session = Depends(get_db),
+) -> TokenClaims:
+    """
+    ID и роль пользователя из claims access-токена. Роль берется из токена,
+    выданного при входе; если ее там нет — из кеша пользователей.
+    Смена роли или деактивация вступают в силу не позже истечения токена.
+
+    Args:
+        credentials (HTTPAuthorizationCredentials): Авторизационные данные из заголовка.
+        db (Session): Сессия базы данных (только для токенов без роли).
+
+    Returns:
+        TokenClaims: ID и роль пользователя.
+    """
+    payload = _decode_access_token(credentials)
+    user_id = _user_id_from_payload(payload)
+    role = payload.get("role")
+    if role is None:
+        principal = get_current_principal(credentials, db)
+        return TokenClaims(id=principal.id, role=principal.role)
+    return TokenClaims(id=user_id, role=role)
+
+
+def require_roles(*roles: str):
+    """
+    Зависимость FastAPI: пропускает только пользователей с одной из ролей (по claims токена).
+
+    Args:
+        *roles (str): Допустимые роли.
+
+    Returns:
+        Callable: Зависимость, возвращающая TokenClaims.
+    """
+    def dependency(claims: TokenClaims = Depends(get_token_claims)) -> TokenClaims:
+        if claims.role not in roles:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions")
+        return claims
+
+    return dependency
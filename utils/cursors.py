@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Pagination Cursors
+------------------
+Непрозрачные курсоры для keyset-пагинации по паре (created_at, id).
+"""
+import base64
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    Кодирует позицию (created_at, id) в непрозрачный токен.
+
+    Args:
+        created_at (datetime): Время создания последней выданной записи.
+        row_id (int): ID последней выданной записи.
+
+    Returns:
+        str: Токен курсора (base64url без выравнивания).
+    """
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    """
+    Декодирует токен курсора.
+
+    Args:
+        token (str): Токен, выданный encode_cursor.
+
+    Returns:
+        Tuple[datetime, int]: Пара (created_at, id).
+
+    Raises:
+        ValueError: Если токен поврежден.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_raw, id_raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(created_raw), int(id_raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def paginate_desc(query, created_at_column, id_column, cursor: Optional[str], limit: int):
+    """
+    Keyset-пагинация "новые первыми": WHERE (created_at, id) < курсор
+    ORDER BY created_at DESC, id DESC LIMIT limit.
+
+    Args:
+        query: SQLAlchemy Query.
+        created_at_column: Колонка времени создания.
+        id_column: Колонка ID.
+        cursor (Optional[str]): Токен курсора предыдущей страницы.
+        limit (int): Размер страницы.
+
+    Returns:
+        Query: Запрос страницы.
+
+    Raises:
+        ValueError: Если курсор поврежден.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_at_column, id_column) < tuple_(created_at, row_id))
+    return query.order_by(created_at_column.desc(), id_column.desc()).limit(limit)
+
+
+def next_page_cursor(items: Sequence, limit: int) -> Optional[str]:
+    """
+    Курсор следующей страницы или None, если страница неполная.
+    Элементы должны иметь атрибуты created_at и id.
+    """
+    if limit <= 0 or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor(last.created_at, last.id)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP Client Utilities
+---------------------
+Общий HTTP-клиент для внешних API с пулом keep-alive соединений (requests.Session).
+Вызывается из фоновых потоков (очередь ИИ рекомендаций), а не из event loop.
+
+Клиент ограничивает число одновременных запросов, повторяет сетевые ошибки
+и ответы 429/5xx с экспоненциальной задержкой и случайным разбросом (full jitter)
+и использует CircuitBreaker: после серии ошибок вызовы отклоняются сразу,
+без ожидания таймаута, пока не истечет reset_timeout.
+"""
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("http_client")
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class UpstreamError(Exception):
+    """
+    Базовая ошибка обращения к внешнему API.
+    """
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    Вызов отклонен: внешний API недавно многократно отвечал ошибками.
+    """
+
+
+class UpstreamBusyError(UpstreamError):
+    """
+    Все слоты одновременных запросов заняты дольше допустимого ожидания.
+    """
+
+
+class UpstreamHTTPError(UpstreamError):
+    """
+    Внешний API ответил статусом, отличным от 200.
+    """
+
+    def __init__(self, status_code: int, body: str = ""):
+        super().__init__(f"Upstream returned status {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи: closed -> open после failure_threshold ошибок подряд,
+    open -> half_open по истечении reset_timeout (пропускается один пробный вызов),
+    half_open -> closed при успехе или снова open при ошибке.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        """
+        Проверяет, можно ли выполнить вызов.
+
+        Raises:
+            CircuitOpenError: Если цепь разомкнута (или пробный вызов уже выполняется).
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+        raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit '%s' closed", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            half_open = self._probe_in_flight
+            self._probe_in_flight = False
+            if half_open or self._failures >= self.failure_threshold:
+                if self._opened_at is None or half_open:
+                    logger.warning("Circuit '%s' opened after %s failures", self.name, self._failures)
+                self._opened_at = time.monotonic()
+
+    def cancel_call(self) -> None:
+        """
+        Вызов, разрешенный before_call, не состоялся (например, нет свободного слота).
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Задержка перед повтором attempt (с 0): случайная в [0, min(cap, base * 2^attempt)].
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_after(headers, cap: float) -> Optional[float]:
+    value = headers.get("Retry-After") if headers is not None else None
+    try:
+        return min(float(value), cap) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """
+    Синхронный клиент с пулом соединений, ограничением конкурентности, повторами и CircuitBreaker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        headers: Optional[Dict[str, str]] = None,
+        max_concurrency: int = 8,
+        pool_size: int = 10,
+        retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        queue_timeout: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = (connect_timeout, read_timeout)
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker(name)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def post_json(self, url: str, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        POST с JSON-телом; возвращает JSON ответа 200.
+
+        Raises:
+            CircuitOpenError, UpstreamBusyError, UpstreamHTTPError, requests.RequestException.
+        """
+        self.breaker.before_call()
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            self.breaker.cancel_call()
+            raise UpstreamBusyError(f"{self.name}: no free request slots")
+        try:
+            attempt = 0
+            while True:
+                delay = None
+                try:
+                    response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+                except requests.RequestException as exc:
+                    self.breaker.record_failure()
+                    # Повторяем только ошибки соединения: ожидание ответа уже могло занять read_timeout
+                    if not isinstance(exc, requests.ConnectionError) or attempt >= self.retries or self.breaker.is_open():
+                        raise
+                else:
+                    if response.status_code == 200:
+                        self.breaker.record_success()
+                        return response.json()
+                    error = UpstreamHTTPError(response.status_code, response.text[:500])
+                    if response.status_code not in RETRY_STATUSES:
+                        # Сервис отвечает — ошибка запроса, а не деградация
+                        self.breaker.record_success()
+                        raise error
+                    self.breaker.record_failure()
+                    if attempt >= self.retries or self.breaker.is_open():
+                        raise error
+                    delay = _retry_after(response.headers, self.backoff_max)
+
+                if delay is None:
+                    delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                logger.info("%s: retrying in %.2fs (attempt %s)", self.name, delay, attempt + 1)
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            self._semaphore.release()
+
+    def close(self) -> None:
+        self.session.close()
+
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Image Variants
+--------------
+Декодирование изображения и построение уменьшенных копий (Pillow).
+
+Модуль намеренно не зависит от БД и приложения: render_variants выполняется
+в дочерних процессах пула utils.media_variants, которые импортируют только его.
+"""
+from io import BytesIO
+from typing import Any, Dict, List, Tuple
+
+MIME_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg"}
+EXTENSIONS = {"webp": "webp", "avif": "avif", "jpeg": "jpg"}
+
+
+def supported_formats() -> List[str]:
+    """
+    Форматы копий в порядке предпочтения; jpeg (запасной вариант) — всегда последний.
+    AVIF доступен в Pillow >= 11.2 или с плагином pillow-avif-plugin.
+    """
+    from PIL import features
+
+    formats = []
+    if features.check("webp"):
+        formats.append("webp")
+    try:
+        has_avif = features.check("avif")
+    except ValueError:  # Pillow < 11.2 не знает про avif
+        has_avif = False
+    if not has_avif:
+        try:
+            import pillow_avif  # noqa: F401
+            has_avif = True
+        except ImportError:
+            pass
+    if has_avif:
+        formats.append("avif")
+    formats.append("jpeg")
+    return formats
+
+
+def decode_errors() -> Tuple[type, ...]:
+    """
+    Исключения Pillow, означающие, что файл не изображение или слишком велик, — повторять бесполезно.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    return (UnidentifiedImageError, Image.DecompressionBombError)
+
+
+def init_worker(max_pixels: int) -> None:
+    """
+    Инициализатор дочернего процесса: ограничение размера декодируемого изображения.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def _for_format(image, fmt: str):
+    # JPEG не поддерживает прозрачность — накладываем на белый фон
+    if fmt != "jpeg" or image.mode in ("RGB", "L"):
+        return image
+    from PIL import Image
+
+    rgba = image.convert("RGBA")
+    background = Image.new("RGB", rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel("A"))
+    return background
+
+
+def render_variants(data: bytes, sizes: Dict[str, int], formats: List[str], quality: int = 80) -> Dict[str, Any]:
+    """
+    Декодирует изображение и строит копии, вписанные в квадрат max_side (без увеличения).
+
+    Args:
+        data (bytes): Исходный файл.
+        sizes (Dict[str, int]): Имя копии -> максимальная сторона в пикселях.
+        formats (List[str]): Форматы копий (webp, avif, jpeg).
+        quality (int): Качество сжатия.
+
+    Returns:
+        Dict[str, Any]: width/height оригинала и список копий
+        (variant, format, width, height, data).
+
+    Raises:
+        PIL.UnidentifiedImageError, Image.DecompressionBombError: Если файл не изображение или слишком велик.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as opened:
+        width, height = opened.size
+        # EXIF-ориентация 5-8 — поворот на 90°, стороны оригинала меняются местами
+        if opened.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+        # Для JPEG декодер сразу уменьшает изображение в 2-8 раз — быстрее и меньше памяти
+        largest = max(sizes.values())
+        opened.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(opened)
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        variants: List[Dict[str, Any]] = []
+        for name, max_side in sorted(sizes.items(), key=lambda item: -item[1]):
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+            for fmt in formats:
+                frame = _for_format(resized, fmt)
+                buffer = BytesIO()
+                options: Dict[str, Any] = {"quality": quality}
+                if fmt == "jpeg":
+                    options.update(optimize=True, progressive=True)
+                elif fmt == "webp":
+                    options.update(method=4)
+                frame.save(buffer, format=fmt.upper(), **options)
+                variants.append({
+                    "variant": name,
+                    "format": fmt,
+                    "width": frame.width,
+                    "height": frame.height,
+                    "data": buffer.getvalue(),
+                })
+    return {"width": width, "height": height, "variants": variants}
+
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+JWT Backend
+-----------
+Подписание и проверка JWT через сменную библиотеку.
+
+  - jose  — python-jose (исторический вариант, чистый Python);
+  - pyjwt — PyJWT (нужен пакет PyJWT).
+
+Бэкенд выбирается переменной JWT_BACKEND (по умолчанию jose; auto — pyjwt, если установлен).
+Скорость зависит от версий библиотек — перед сменой сравните их scripts/bench_jwt_decode.
+Токены, выпущенные одним бэкендом, проверяются другим: формат и алгоритмы одинаковые.
+
+DecodedTokenCache — ограниченный LRU уже проверенных токенов: повторный запрос с тем же
+токеном не проверяет подпись заново. Запись живет не дольше exp токена и JWT_DECODE_CACHE_TTL.
+"""
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+JWT_BACKEND = os.getenv("JWT_BACKEND", "jose").lower()   # jose | pyjwt | auto
+
+
+class TokenExpired(Exception):
+    """
+    Срок действия токена истек.
+    """
+
+
+class TokenInvalid(Exception):
+    """
+    Токен поврежден, подпись не сходится или алгоритм не разрешен.
+    """
+
+
+class JwtBackend(ABC):
+    """
+    Базовый интерфейс библиотеки JWT.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def encode(self, claims: Dict[str, Any], key: str, algorithm: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def decode(self, token: str, key: str, algorithms: List[str]) -> Dict[str, Any]:
+        """
+        Проверяет подпись и exp.
+
+        Raises:
+            TokenExpired: Если срок действия истек.
+            TokenInvalid: Для любой другой ошибки проверки.
+        """
+        raise NotImplementedError
+
+
+class JoseBackend(JwtBackend):
+    name = "jose"
+
+    def __init__(self):
+        from jose import jwt, JWTError, ExpiredSignatureError
+
+        self._jwt = jwt
+        self._error = JWTError
+        self._expired = ExpiredSignatureError
+
+    def encode(self, claims: Dict[str, Any], key: str, algorithm: str) -> str:
+        return self._jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithms: List[str]) -> Dict[str, Any]:
+        try:
+            return self._jwt.decode(token, key, algorithms=algorithms)
+        except self._expired as exc:
+            raise TokenExpired(str(exc)) from exc
+        except self._error as exc:
+            raise TokenInvalid(str(exc)) from exc
+
+
+class PyJWTBackend(JwtBackend):
+    name = "pyjwt"
+
+    def __init__(self):
+        import jwt
+
+        self._jwt = jwt
+
+    def encode(self, claims: Dict[str, Any], key: str, algorithm: str) -> str:
+        return self._jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithms: List[str]) -> Dict[str, Any]:
+        try:
+            return self._jwt.decode(token, key, algorithms=algorithms)
+        except self._jwt.ExpiredSignatureError as exc:
+            raise TokenExpired(str(exc)) from exc
+        except self._jwt.InvalidTokenError as exc:
+            raise TokenInvalid(str(exc)) from exc
+
+
+_BACKENDS = {JoseBackend.name: JoseBackend, PyJWTBackend.name: PyJWTBackend}
+_backends: Dict[str, JwtBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_jwt_backend(name: Optional[str] = None) -> JwtBackend:
+    """
+    Бэкенд по имени (по умолчанию — JWT_BACKEND).
+
+    Raises:
+        ValueError: Для неизвестного бэкенда.
+        ImportError: Если библиотека бэкенда не установлена (кроме режима auto).
+    """
+    name = (name or JWT_BACKEND).lower()
+    if name == "auto":
+        try:
+            return get_jwt_backend(PyJWTBackend.name)
+        except ImportError:
+            return get_jwt_backend(JoseBackend.name)
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                cls = _BACKENDS.get(name)
+                if cls is None:
+                    raise ValueError(f"Unknown JWT backend: {name}")
+                backend = cls()
+                _backends[name] = backend
+    return backend
+
+
+class DecodedTokenCache:
+    """
+    LRU проверенных токенов: токен -> claims.
+    Ключ — токен целиком (подпись покрывает заголовок и payload, поэтому чужой payload
+    с подсмотренной подписью в кеш не попадет).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()   # token -> (expires_at, claims)
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Claims из кеша или None (нет записи, либо истек TTL или exp токена).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, claims = entry
+            if expires_at <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        """
+        Сохраняет claims проверенного токена до min(exp, сейчас + ttl).
+        """
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        with self._lock:
+            self._entries[token] = (expires_at, claims)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -4,23 +4,36 @@
 Media DB abstraction over Postgres.
 Заменяет MinIO flow: presign -> staged_uploads -> upload -> confirm -> product_media.
 
+Метаданные медиа хранятся в Postgres, а байты — в объектном хранилище
+(utils.object_store, бэкенд MEDIA_STORAGE_BACKEND). Записи со storage_backend="db"
+по-прежнему читаются из колонки content.
 """
 
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List, NamedTuple, Tuple
 from uuid import uuid4
 from pathlib import Path
 from datetime import datetime
+import os
+import hashlib
 import logging
 
+from sqlalchemy import LargeBinary, bindparam, delete, func, literal, literal_column, null, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError, NoResultFound
 
 
-from models.product import StagedUpload, ProductMedia
+from models.product import Product, StagedUpload, StagedUploadPart, ProductMedia, ProductMediaVariant, MediaBlob
 from database.database import SessionLocal
+from utils.object_store import DB_BACKEND, MEDIA_READ_CHUNK_SIZE, get_object_store, default_backend
 
 logger = logging.getLogger("media_db")
 
+UPLOAD_UPLOADING = "uploading"
+UPLOAD_COMPLETE = "complete"
+MEDIA_UPLOAD_CHUNK_SIZE = int(os.getenv("MEDIA_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))          # рекомендуемый размер части
+MEDIA_UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("MEDIA_UPLOAD_MAX_CHUNK_SIZE", str(32 * 1024 * 1024)))  # больше — 413
+
 
 def gen_object_key(product_id: int, filename: str) -> str:
     """
@@ -31,7 +44,227 @@ def gen_object_key(product_id: int, filename: str) -> str:
     return f"products/{product_id}/{uuid4().hex}{suffix}"
 
 
-def create_staged_placeholder(db: Session, object_key: str, product_id: int, filename: str, mime_type: str = "application/octet-stream") -> StagedUpload:
+def coerce_bytes(raw) -> bytes:
+    """
+    Приводит значение колонки bytea (memoryview/bytearray/str/None) к bytes.
+    """
+    if raw is None:
+        return b""
+    if isinstance(raw, memoryview):
+        return raw.tobytes()
+    if isinstance(raw, bytearray):
+        return bytes(raw)
+    if isinstance(raw, str):
+        return raw.encode("utf-8")
+    return raw
+
+
+def media_size(media) -> int:
+    """
+    Размер содержимого медиа (ProductMedia или StagedUpload) в байтах.
+    """
+    backend = getattr(media, "storage_backend", None) or DB_BACKEND
+    if backend == DB_BACKEND:
+        return len(coerce_bytes(getattr(media, "content", None)))
+    return get_object_store(backend).size(media.object_key)
+
+
+def iter_media_content(media, start: int = 0, end: Optional[int] = None, chunk_size: int = MEDIA_READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Читает содержимое медиа частями из того хранилища, где оно лежит.
+    end — включительно (None — до конца).
+    """
+    backend = getattr(media, "storage_backend", None) or DB_BACKEND
+    if backend != DB_BACKEND:
+        yield from get_object_store(backend).iter_chunks(media.object_key, start=start, end=end, chunk_size=chunk_size)
+        return
+    content = coerce_bytes(getattr(media, "content", None))
+    stop = len(content) if end is None else min(end + 1, len(content))
+    for offset in range(start, stop, chunk_size):
+        yield content[offset:min(offset + chunk_size, stop)]
+
+
+def read_media_content(media) -> bytes:
+    """
+    Читает содержимое медиа целиком.
+    """
+    return b"".join(iter_media_content(media))
+
+
+def content_digest(chunks) -> Tuple[str, int]:
+    """
+    SHA-256 (hex) и размер содержимого, переданного частями.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _iter_db_content(model, row_id: int, start: int, end: Optional[int], chunk_size: int) -> Iterator[bytes]:
+    # Читаем bytea частями через substring, не выгружая колонку целиком
+    db = SessionLocal()
+    try:
+        offset = start
+        while end is None or offset <= end:
+            length = chunk_size if end is None else min(chunk_size, end - offset + 1)
+            chunk = coerce_bytes(
+                db.query(func.substring(model.content, offset + 1, length))
+                .filter(model.id == row_id)
+                .scalar()
+            )
+            if not chunk:
+                break
+            yield chunk
+            offset += len(chunk)
+    finally:
+        db.close()
+
+
+def iter_stored_content(backend: Optional[str], object_key: Optional[str], media_id: int, start: int = 0, end: Optional[int] = None, chunk_size: int = MEDIA_READ_CHUNK_SIZE, model=ProductMedia) -> Iterator[bytes]:
+    """
+    Читает байты [start, end] медиа частями из хранилища, указанного в записи,
+    без предварительной загрузки записи (для "db" — substring по колонке content).
+    model — ProductMedia или ProductMediaVariant (тогда media_id — ID копии).
+    """
+    if backend and backend != DB_BACKEND:
+        yield from get_object_store(backend).iter_chunks(object_key, start=start, end=end, chunk_size=chunk_size)
+    else:
+        yield from _iter_db_content(model, media_id, start, end, chunk_size)
+
+
+def ensure_content_digest(media_id: int) -> Optional[Tuple[str, int]]:
+    """
+    Вычисляет и сохраняет content_sha256/content_size для записей, созданных до их появления.
+    Для "db" хеш считается в Postgres (sha256(content)), байты в приложение не передаются.
+
+    Returns:
+        Optional[Tuple[str, int]]: (sha256, размер) или None, если медиа не найдено.
+    """
+    db = SessionLocal()
+    try:
+        row = db.query(ProductMedia.storage_backend, ProductMedia.object_key).filter(ProductMedia.id == media_id).first()
+        if row is None:
+            return None
+        if (row.storage_backend or DB_BACKEND) == DB_BACKEND:
+            sha, size = db.query(
+                func.encode(func.sha256(func.coalesce(ProductMedia.content, b"")), "hex"),
+                func.coalesce(func.length(ProductMedia.content), 0),
+            ).filter(ProductMedia.id == media_id).one()
+        else:
+            sha, size = content_digest(get_object_store(row.storage_backend).iter_chunks(row.object_key))
+        db.query(ProductMedia).filter(ProductMedia.id == media_id).update(
+            {"content_sha256": sha, "content_size": size}, synchronize_session=False
+        )
+        db.commit()
+        return sha, int(size)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class MediaCleanup(NamedTuple):
+    """
+    Что освободить после удаления ProductMedia: объекты, принадлежавшие только
+    удаленным медиа (старые записи без блоба и уменьшенные копии), и блобы,
+    у которых уменьшился счетчик ссылок.
+    """
+    objects: List[Tuple[str, str]]
+    blob_ids: List[int]
+
+
+def prepare_media_delete(db: Session, *criteria) -> MediaCleanup:
+    """
+    Вызывается перед удалением ProductMedia, отобранных criteria, в той же транзакции:
+    уменьшает ref_count их блобов. После commit нужно вызвать finish_media_delete.
+
+    Args:
+        db (Session): Сессия базы данных.
+        *criteria: Условия отбора ProductMedia (например, ProductMedia.id == media_id).
+
+    Returns:
+        MediaCleanup: Объекты и блобы для освобождения.
+    """
+    media_ids = select(ProductMedia.id).where(*criteria)
+    objects = [
+        (row.storage_backend, row.object_key)
+        for row in db.query(ProductMedia.storage_backend, ProductMedia.object_key).filter(*criteria, ProductMedia.blob_id.is_(None))
+    ]
+    objects += [
+        (row.storage_backend, row.object_key)
+        for row in db.query(ProductMediaVariant.storage_backend, ProductMediaVariant.object_key)
+        .filter(ProductMediaVariant.media_id.in_(media_ids))
+    ]
+    counts = db.query(ProductMedia.blob_id, func.count(ProductMedia.id)).filter(
+        *criteria, ProductMedia.blob_id.isnot(None)
+    ).group_by(ProductMedia.blob_id).all()
+    if counts:
+        table = MediaBlob.__table__
+        db.execute(
+            table.update().where(table.c.id == bindparam("_blob_id")).values(ref_count=table.c.ref_count - bindparam("_refs")),
+            [{"_blob_id": blob_id, "_refs": refs} for blob_id, refs in counts],
+        )
+    return MediaCleanup(objects=objects, blob_ids=[blob_id for blob_id, _ in counts])
+
+
+def finish_media_delete(db: Session, cleanup: MediaCleanup) -> None:
+    """
+    После commit удаления: удаляет объекты и блобы, на которые больше нет ссылок. Ошибки логируются.
+    """
+    for backend, object_key in cleanup.objects:
+        delete_stored_object(backend, object_key)
+    if cleanup.blob_ids:
+        try:
+            purge_unreferenced_blobs(db, cleanup.blob_ids)
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Failed to purge media blobs %s: %s", cleanup.blob_ids, exc)
+
+
+def purge_unreferenced_blobs(db: Session, blob_ids: Optional[List[int]] = None, limit: int = 500) -> Tuple[int, int]:
+    """
+    Удаляет блобы с ref_count <= 0, на которые не ссылается ни один ProductMedia, и их объекты.
+    Блоб, который параллельно снова стал использоваться (ref_count увеличен), не удаляется.
+
+    Returns:
+        Tuple[int, int]: Количество удаленных блобов и освобожденных байт.
+    """
+    candidates = select(MediaBlob.id).where(
+        MediaBlob.ref_count <= 0,
+        ~select(ProductMedia.id).where(ProductMedia.blob_id == MediaBlob.id).exists(),
+    )
+    if blob_ids is not None:
+        candidates = candidates.where(MediaBlob.id.in_(blob_ids))
+    candidates = candidates.limit(limit).with_for_update(skip_locked=True)
+    rows = db.execute(
+        delete(MediaBlob)
+        .where(MediaBlob.id.in_(candidates.scalar_subquery()))
+        .returning(MediaBlob.storage_backend, MediaBlob.object_key, MediaBlob.size)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    for row in rows:
+        delete_stored_object(row.storage_backend, row.object_key)
+    return len(rows), sum(int(row.size or 0) for row in rows)
+
+
+def delete_stored_object(backend: Optional[str], object_key: Optional[str]) -> None:
+    """
+    Удаляет объект из внешнего хранилища (для "db" ничего не делает). Ошибки логируются.
+    """
+    if not backend or backend == DB_BACKEND or not object_key:
+        return
+    try:
+        get_object_store(backend).delete(object_key)
+    except Exception as exc:
+        logger.exception("Failed to delete object %s from %s: %s", object_key, backend, exc)
+
+
+def create_staged_placeholder(db: Session, object_key: str, product_id: int, filename: str, mime_type: str = "application/octet-stream", total_size: Optional[int] = None) -> StagedUpload:
     """
     Создаёт placeholder в staged_uploads с пустым content (bytea).
     Полезно для сценария presign -> confirm без фактического upload.
@@ -48,6 +281,7 @@ def create_staged_placeholder(db: Session, object_key: str, product_id: int, fil
         filename=filename,
         content=b"",  # placeholder
         mime_type=mime_type,
+        total_size=total_size,
         created_at=datetime.utcnow()
     )
     db.add(staged)
@@ -64,26 +298,74 @@ def create_staged_placeholder(db: Session, object_key: str, product_id: int, fil
         raise
 
 
+def create_staged_from_blob(db: Session, object_key: str, product_id: int, filename: str, blob: MediaBlob, mime_type: Optional[str] = None) -> StagedUpload:
+    """
+    Создаёт завершенный staged upload без загрузки байтов: содержимое уже есть в блобе
+    (клиент передал SHA-256 файла в presign). Confirm добавит ссылку на этот блоб.
+    """
+    staged = StagedUpload(
+        object_key=object_key,
+        product_id=product_id,
+        filename=filename,
+        content=None,
+        storage_backend=blob.storage_backend,
+        content_sha256=blob.sha256,
+        content_size=blob.size,
+        mime_type=mime_type or blob.mime_type,
+        upload_state=UPLOAD_COMPLETE,
+        received_bytes=blob.size,
+        total_size=blob.size,
+        blob_id=blob.id,
+        created_at=datetime.utcnow()
+    )
+    db.add(staged)
+    try:
+        db.commit()
+        db.refresh(staged)
+        return staged
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to create staged upload %s from blob %s: %s", object_key, blob.id, exc)
+        raise
+
+
 def store_staged_upload(db: Session, object_key: str, product_id: int, filename: str, content: bytes, mime_type: str = "application/octet-stream") -> StagedUpload:
     """
     Сохраняет/обновляет staged_upload запись с реальным содержимым.
+    Байты записываются в объектное хранилище под object_key (или в колонку content для бэкенда "db").
     Возвращает StagedUpload.
     """
-    
+    backend = default_backend()
+    if content and backend != DB_BACKEND:
+        get_object_store(backend).put(object_key, content, mime_type or "application/octet-stream")
+    sha, size = content_digest([content or b""])
+
     staged = db.query(StagedUpload).filter(StagedUpload.object_key == object_key).first()
     if staged is None:
         staged = StagedUpload(
             object_key=object_key,
             product_id=product_id,
             filename=filename,
-            content=content or b"",
+            content=(content or b"") if backend == DB_BACKEND else None,
+            storage_backend=backend if content else DB_BACKEND,
+            content_sha256=sha if content else None,
+            content_size=size if content else None,
             mime_type=mime_type,
             created_at=datetime.utcnow()
         )
         db.add(staged)
     else:
         staged.filename = filename or staged.filename
-        staged.content = content or staged.content
+        if content:
+            db.query(StagedUploadPart).filter(StagedUploadPart.staged_id == staged.id).delete(synchronize_session=False)
+            staged.content = content if backend == DB_BACKEND else None
+            staged.storage_backend = backend
+            staged.content_sha256 = sha
+            staged.content_size = size
+            staged.upload_state = UPLOAD_COMPLETE
+            staged.received_bytes = size
+            staged.total_size = size
+            staged.blob_id = None
         staged.mime_type = mime_type or staged.mime_type
         staged.created_at = staged.created_at or datetime.utcnow()
     try:
@@ -95,50 +377,348 @@ def store_staged_upload(db: Session, object_key: str, product_id: int, filename:
         logger.exception("Failed to store staged upload %s: %s", object_key, exc)
         raise
 
+class UploadConflict(Exception):
+    """
+    Часть не может быть принята в текущем состоянии загрузки (смещение не совпадает
+    или загрузка не начата). offset — сколько байт уже получено.
+    """
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+def _locked_staged(db: Session, object_key: str) -> Optional[StagedUpload]:
+    return db.query(StagedUpload).filter(StagedUpload.object_key == object_key).with_for_update().first()
+
+
+def begin_chunked_upload(db: Session, object_key: str, product_id: int, filename: str, mime_type: str = "application/octet-stream", total_size: Optional[int] = None) -> StagedUpload:
+    """
+    Начинает (или начинает заново) загрузку staged upload частями.
+    Незавершенная предыдущая загрузка под тем же object_key отменяется.
+
+    Args:
+        db (Session): Сессия базы данных.
+        object_key (str): Ключ объекта.
+        product_id (int): ID продукта.
+        filename (str): Имя файла.
+        mime_type (str): MIME-тип.
+        total_size (Optional[int]): Полный размер файла, если известен заранее.
+
+    Returns:
+        StagedUpload: Запись в состоянии "uploading".
+    """
+    backend = default_backend()
+    mime_type = mime_type or "application/octet-stream"
+    try:
+        staged = _locked_staged(db, object_key)
+        if staged is not None:
+            if staged.upload_state == UPLOAD_UPLOADING:
+                _abort_store_upload(staged)
+            db.query(StagedUploadPart).filter(StagedUploadPart.staged_id == staged.id).delete(synchronize_session=False)
+        upload_id = None
+        if backend != DB_BACKEND:
+            upload_id = get_object_store(backend).begin_chunked(object_key, mime_type)
+        if staged is None:
+            staged = StagedUpload(object_key=object_key, product_id=product_id, created_at=datetime.utcnow())
+            db.add(staged)
+        staged.filename = filename or staged.filename or object_key
+        staged.mime_type = mime_type
+        staged.content = b"" if backend == DB_BACKEND else None
+        staged.storage_backend = backend
+        staged.content_sha256 = None
+        staged.content_size = None
+        staged.upload_state = UPLOAD_UPLOADING
+        staged.received_bytes = 0
+        staged.total_size = total_size if total_size is not None else staged.total_size
+        staged.upload_id = upload_id
+        staged.upload_parts = []
+        staged.blob_id = None
+        staged.updated_at = datetime.utcnow()
+        db.commit()
+        db.refresh(staged)
+        return staged
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to begin chunked upload %s: %s", object_key, exc)
+        raise
+
+
+def append_upload_chunk(db: Session, object_key: str, offset: int, data: bytes, sha256: Optional[bytes] = None, total_size: Optional[int] = None) -> StagedUpload:
+    """
+    Записывает часть загрузки в хранилище. Части принимаются строго по порядку:
+    offset должен совпадать с числом уже полученных байт. Когда получены все
+    total_size байт, загрузка завершается (complete_chunked_upload).
+
+    Args:
+        db (Session): Сессия базы данных.
+        object_key (str): Ключ объекта.
+        offset (int): Смещение части в файле.
+        data (bytes): Содержимое части.
+        sha256 (Optional[bytes]): Ожидаемый SHA-256 части (digest), если клиент его передал.
+        total_size (Optional[int]): Полный размер файла (если еще не был известен).
+
+    Returns:
+        StagedUpload: Обновленная запись.
+
+    Raises:
+        ValueError: Если загрузка не найдена, контрольная сумма не совпала или часть некорректна.
+        UploadConflict: Если смещение не совпадает с полученным или загрузка не идет.
+    """
+    if sha256 is not None and hashlib.sha256(data).digest() != sha256:
+        raise ValueError("chunk checksum mismatch")
+    try:
+        staged = _locked_staged(db, object_key)
+        if staged is None:
+            raise ValueError("staged upload not found")
+        if staged.upload_state != UPLOAD_UPLOADING:
+            raise UploadConflict("upload is not in progress", staged.received_bytes)
+        if offset != staged.received_bytes:
+            raise UploadConflict("offset does not match received bytes", staged.received_bytes)
+        if total_size is not None:
+            if staged.total_size is not None and staged.total_size != total_size:
+                raise ValueError("upload length cannot be changed")
+            staged.total_size = total_size
+        end = offset + len(data)
+        if staged.total_size is not None and end > staged.total_size:
+            raise ValueError("chunk exceeds upload length")
+        is_last = staged.total_size is not None and end == staged.total_size
+
+        backend = staged.storage_backend or DB_BACKEND
+        if data:
+            etag = None
+            if backend == DB_BACKEND:
+                # Каждая часть — отдельная строка; склеиваются один раз при завершении
+                db.execute(StagedUploadPart.__table__.insert().values(
+                    staged_id=staged.id, part_number=len(staged.upload_parts or []) + 1, content=data,
+                ))
+            else:
+                store = get_object_store(backend)
+                if not is_last and len(data) < store.min_part_size:
+                    raise ValueError(f"chunks except the last one must be at least {store.min_part_size} bytes")
+                etag = store.write_chunk(object_key, staged.upload_id, len(staged.upload_parts or []) + 1, offset, data)
+            staged.upload_parts = list(staged.upload_parts or []) + [{
+                "part_number": len(staged.upload_parts or []) + 1,
+                "offset": offset,
+                "size": len(data),
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "etag": etag,
+            }]
+            staged.received_bytes = end
+        staged.updated_at = datetime.utcnow()
+        if is_last:
+            _complete_upload(db, staged)
+        db.commit()
+        db.refresh(staged)
+        return staged
+    except Exception:
+        db.rollback()
+        raise
+
+
+def complete_chunked_upload(db: Session, object_key: str) -> StagedUpload:
+    """
+    Завершает загрузку частями, размер которой не был известен заранее.
+
+    Raises:
+        ValueError: Если загрузка не найдена.
+        UploadConflict: Если загрузка не идет.
+    """
+    try:
+        staged = _locked_staged(db, object_key)
+        if staged is None:
+            raise ValueError("staged upload not found")
+        if staged.upload_state != UPLOAD_UPLOADING:
+            raise UploadConflict("upload is not in progress", staged.received_bytes)
+        _complete_upload(db, staged)
+        db.commit()
+        db.refresh(staged)
+        return staged
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _complete_upload(db: Session, staged: StagedUpload) -> None:
+    # Сборка объекта выполняется хранилищем; хеш считается потоково (или в Postgres для "db")
+    backend = staged.storage_backend or DB_BACKEND
+    if backend == DB_BACKEND:
+        db.flush()
+        parts = StagedUploadPart.__table__
+        joined = (
+            select(func.coalesce(
+                func.string_agg(parts.c.content, aggregate_order_by(literal(b"", LargeBinary), parts.c.part_number)),
+                literal(b"", LargeBinary),
+            ))
+            .where(parts.c.staged_id == staged.id)
+            .scalar_subquery()
+        )
+        db.query(StagedUpload).filter(StagedUpload.id == staged.id).update({"content": joined}, synchronize_session=False)
+        db.execute(delete(parts).where(parts.c.staged_id == staged.id))
+        sha, size = db.query(
+            func.encode(func.sha256(func.coalesce(StagedUpload.content, b"")), "hex"),
+            func.coalesce(func.length(StagedUpload.content), 0),
+        ).filter(StagedUpload.id == staged.id).one()
+    else:
+        store = get_object_store(backend)
+        store.complete_chunked(staged.object_key, staged.upload_id, staged.upload_parts or [])
+        sha, size = content_digest(store.iter_chunks(staged.object_key))
+    staged.content_sha256 = sha
+    staged.content_size = int(size)
+    staged.total_size = int(size)
+    staged.upload_state = UPLOAD_COMPLETE
+    staged.upload_id = None
+    staged.updated_at = datetime.utcnow()
+
+
+def _abort_store_upload(staged: StagedUpload) -> None:
+    backend = staged.storage_backend or DB_BACKEND
+    if backend == DB_BACKEND:
+        return
+    try:
+        get_object_store(backend).abort_chunked(staged.object_key, staged.upload_id)
+    except Exception as exc:
+        logger.exception("Failed to abort upload %s in %s: %s", staged.object_key, backend, exc)
+
+
+def abort_chunked_upload(db: Session, object_key: str) -> bool:
+    """
+    Отменяет загрузку частями: освобождает записанные части и удаляет staged запись.
+
+    Returns:
+        bool: False, если загрузка не найдена.
+    """
+    try:
+        staged = _locked_staged(db, object_key)
+        if staged is None:
+            return False
+        if staged.upload_state == UPLOAD_UPLOADING:
+            _abort_store_upload(staged)
+        else:
+            delete_stored_object(staged.storage_backend, staged.object_key)
+        db.delete(staged)
+        db.commit()
+        return True
+    except Exception:
+        db.rollback()
+        raise
+
+
+def acquire_blob(db: Session, staged: StagedUpload, sha: str, size: int, mime_type: str):
+    """
+    Добавляет ссылку на блоб с содержимым staged upload (в текущей транзакции, без commit).
+    Если блоба с таким SHA-256 нет, он создается и забирает объект staged upload
+    (для "db" байты копируются из staged_uploads внутри Postgres); иначе увеличивается ref_count.
+
+    Returns:
+        Row: id, storage_backend, object_key, inserted (True — блоб создан из этого staged upload).
+
+    Raises:
+        ValueError: Если staged upload ссылался на блоб, который уже удален.
+    """
+    if staged.blob_id is not None:
+        # Загрузка была пропущена при presign — блоб должен существовать
+        row = db.execute(
+            update(MediaBlob)
+            .where(MediaBlob.id == staged.blob_id, MediaBlob.sha256 == sha)
+            .values(ref_count=MediaBlob.ref_count + 1)
+            .returning(MediaBlob.id, MediaBlob.storage_backend, MediaBlob.object_key, literal(False).label("inserted"))
+        ).first()
+        if row is None:
+            raise ValueError("deduplicated media content no longer exists, upload the file again")
+        return row
+
+    backend = staged.storage_backend or DB_BACKEND
+    source = select(
+        literal(sha),
+        literal(size),
+        literal(backend),
+        literal(staged.object_key),
+        StagedUpload.content if backend == DB_BACKEND else null(),
+        literal(mime_type),
+        literal(1),
+        literal(datetime.utcnow()),
+    ).where(StagedUpload.id == staged.id)
+    stmt = pg_insert(MediaBlob).from_select(
+        ["sha256", "size", "storage_backend", "object_key", "content", "mime_type", "ref_count", "created_at"], source
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaBlob.sha256],
+        set_={"ref_count": MediaBlob.ref_count + 1},
+    ).returning(
+        MediaBlob.id, MediaBlob.storage_backend, MediaBlob.object_key,
+        # xmax = 0 только у строки, вставленной этим запросом
+        literal_column("xmax = 0").label("inserted"),
+    )
+    return db.execute(stmt).first()
+
+
+def find_reusable_blob(db: Session, sha: str, owner_id: Optional[int] = None) -> Optional[MediaBlob]:
+    """
+    Блоб с данным SHA-256, который пользователь может переиспользовать без загрузки.
+    Знание хеша не должно давать доступ к чужому файлу, поэтому (если owner_id задан)
+    блоб должен уже использоваться в медиа продуктов этого пользователя.
+    """
+    query = db.query(MediaBlob).filter(MediaBlob.sha256 == sha, MediaBlob.ref_count > 0)
+    if owner_id is not None:
+        query = query.filter(
+            db.query(ProductMedia.id)
+            .join(Product, Product.id == ProductMedia.product_id)
+            .filter(ProductMedia.blob_id == MediaBlob.id, Product.owner_id == owner_id)
+            .exists()
+        )
+    return query.first()
+
+
 def create_media_from_staged(db: Session, object_key: str, is_primary: bool = False, meta: Optional[Dict[str, Any]] = None, mime_type: Optional[str] = None) -> ProductMedia:
     """
     Создаёт запись ProductMedia из staged_upload по object_key.
-    Безопасно приводит staged.content к bytes, создаёт запись ProductMedia,
-    снимает is_primary у других медиа при необходимости и удаляет staged запись.
+    Содержимое дедуплицируется по SHA-256: ProductMedia ссылается на общий MediaBlob.
+    Новый блоб забирает объект staged upload без копирования; если такой блоб уже есть,
+    увеличивается его счетчик ссылок, а загруженная копия удаляется.
+    Снимает is_primary у других медиа при необходимости и удаляет staged запись.
     Возвращает созданный ProductMedia объект.
     """
     staged = db.query(StagedUpload).filter(StagedUpload.object_key == object_key).first()
     if not staged:
         raise ValueError("staged upload not found")
 
-    # Приводим staged.content к bytes безопасно
-    raw = getattr(staged, "content", None) or b""
-    try:
-        if isinstance(raw, memoryview):
-            content_bytes = raw.tobytes()
-        elif isinstance(raw, bytearray):
-            content_bytes = bytes(raw)
-        elif isinstance(raw, str):
-            content_bytes = raw.encode("utf-8")
+    backend = getattr(staged, "storage_backend", None) or DB_BACKEND
+    reused_blob_id = staged.blob_id
+
+    # Хеш содержимого (ETag и ключ дедупликации) фиксируется при подтверждении
+    sha, size = getattr(staged, "content_sha256", None), getattr(staged, "content_size", None)
+    if sha is None or size is None:
+        if backend == DB_BACKEND:
+            sha, size = db.query(
+                func.encode(func.sha256(func.coalesce(StagedUpload.content, b"")), "hex"),
+                func.coalesce(func.length(StagedUpload.content), 0),
+            ).filter(StagedUpload.id == staged.id).one()
         else:
-            content_bytes = raw
-    except Exception:
-        logger.exception("Failed to coerce staged.content to bytes for object_key=%s", object_key)
-        content_bytes = b""
+            sha, size = content_digest(get_object_store(backend).iter_chunks(object_key))
 
     filename = getattr(staged, "filename", object_key) or object_key
     final_mime = mime_type or getattr(staged, "mime_type", "application/octet-stream")
 
-    media = ProductMedia(
-        product_id=staged.product_id,
-        filename=filename,
-        object_key=object_key,
-        content=content_bytes or b"",
-        mime_type=final_mime,
-        width=getattr(staged, "width", None),
-        height=getattr(staged, "height", None),
-        is_primary=is_primary,
-        meta=meta or {},
-        created_at=datetime.utcnow()
-    )
-
-    db.add(media)
     try:
+        blob = acquire_blob(db, staged, sha, int(size), final_mime)
+        media = ProductMedia(
+            product_id=staged.product_id,
+            filename=filename,
+            object_key=blob.object_key,
+            content=None,
+            storage_backend=blob.storage_backend,
+            blob_id=blob.id,
+            content_sha256=sha,
+            content_size=size,
+            mime_type=final_mime,
+            width=getattr(staged, "width", None),
+            height=getattr(staged, "height", None),
+            is_primary=is_primary,
+            meta=meta or {},
+            created_at=datetime.utcnow()
+        )
+        db.add(media)
         db.commit()
         db.refresh(media)
     except Exception as exc:
@@ -146,6 +726,10 @@ def create_media_from_staged(db: Session, object_key: str, is_primary: bool = Fa
         logger.exception("Failed to commit new media from staged %s: %s", object_key, exc)
         raise
 
+    # Такой файл уже хранился — загруженная копия не нужна
+    if not blob.inserted and reused_blob_id is None and blob.object_key != object_key:
+        delete_stored_object(backend, object_key)
+
     # Если нужно — снять флаг primary у других медиа того же продукта
     if media.is_primary:
         try:
@@ -170,13 +754,15 @@ def create_media_from_staged(db: Session, object_key: str, is_primary: bool = Fa
 
 
 
-def public_media_url(media_id: int) -> str:
+def public_media_url(media_id: int, size: Optional[str] = None) -> str:
     """
     Возвращает относительный URL, по которому ваше приложение служит бинарник.
     В вашем проекте есть роутер: GET /api/products/media/{media_id}/file
     Возвращаем относительный путь — при необходимости замените на абсолютный с доменом.
+    size — уменьшенная копия (thumb, medium); пока ее нет, по URL отдается оригинал.
     """
-    return f"/api/products/media/{media_id}/file"
+    url = f"/api/products/media/{media_id}/file"
+    return f"{url}?size={size}" if size else url
 
 
 # ---- Вспомогательные функции ----
@@ -202,5 +788,7 @@ def delete_media(db: Session, media_id: int) -> None:
         db (Session): Сессия базы данных.
         media_id (int): ID медиа для удаления.
     """
+    cleanup = prepare_media_delete(db, ProductMedia.id == media_id)
     db.query(ProductMedia).filter(ProductMedia.id == media_id).delete()
     db.commit()
+    finish_media_delete(db, cleanup)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Media Garbage Collector
+-----------------------
+Очистка неподтвержденных загрузок и потерянных объектов хранилища.
+
+  - sweep_staged  — удаляет staged_uploads без активности дольше MEDIA_STAGED_TTL_HOURS
+    пакетами по MEDIA_GC_BATCH_SIZE (DELETE ... RETURNING с FOR UPDATE SKIP LOCKED,
+    поэтому несколько процессов API не мешают друг другу), затем их объекты в хранилище
+    и незавершенные загрузки частями;
+  - sweep_blobs   — удаляет блобы дедупликации (media_blobs), на которые не осталось ссылок;
+  - sweep_orphans — находит в хранилище объекты (с префиксом MEDIA_GC_ORPHAN_PREFIX),
+    на которые не ссылается ни одна запись, и удаляет те, что старше MEDIA_GC_ORPHAN_GRACE_HOURS.
+
+sweep_staged выполняется фоновым потоком каждые MEDIA_GC_INTERVAL секунд; поиск
+потерянных объектов перебирает все хранилище и запускается вручную:
+python -m utils.media_gc orphans --dry-run
+Счетчики освобожденных байт доступны через gc_stats().
+"""
+import os
+import argparse
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, case, delete, func, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from database.database import SessionLocal
+from models.product import MediaBlob, ProductMedia, ProductMediaVariant, StagedUpload
+from utils.media_db import UPLOAD_UPLOADING, delete_stored_object, purge_unreferenced_blobs
+from utils.object_store import DB_BACKEND, default_backend, get_object_store
+
+logger = logging.getLogger("media_gc")
+
+MEDIA_GC_ENABLED = os.getenv("MEDIA_GC_ENABLED", "true").lower() == "true"
+MEDIA_GC_INTERVAL = float(os.getenv("MEDIA_GC_INTERVAL", "600"))                  # секунды
+MEDIA_STAGED_TTL_HOURS = float(os.getenv("MEDIA_STAGED_TTL_HOURS", "24"))
+MEDIA_GC_BATCH_SIZE = int(os.getenv("MEDIA_GC_BATCH_SIZE", "200"))
+MEDIA_GC_MAX_BATCHES = int(os.getenv("MEDIA_GC_MAX_BATCHES", "50"))               # за один проход
+MEDIA_GC_ORPHAN_PREFIX = os.getenv("MEDIA_GC_ORPHAN_PREFIX", "products/")
+MEDIA_GC_ORPHAN_GRACE_HOURS = float(os.getenv("MEDIA_GC_ORPHAN_GRACE_HOURS", "48"))
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {
+    "runs": 0,
+    "staged_deleted": 0,
+    "db_bytes_reclaimed": 0,
+    "store_bytes_reclaimed": 0,
+    "objects_deleted": 0,
+    "orphans_deleted": 0,
+    "orphan_bytes_reclaimed": 0,
+    "blobs_deleted": 0,
+    "blob_bytes_reclaimed": 0,
+    "last_run_at": None,
+    "last_error": None,
+}
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _count(**values) -> None:
+    with _stats_lock:
+        for name, value in values.items():
+            _stats[name] += value
+
+
+def gc_stats() -> Dict[str, Any]:
+    """
+    Счетчики очистки с момента запуска процесса.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _referenced_keys(db: Session, keys: List[str]) -> set:
+    if not keys:
+        return set()
+    query = union_all(
+        select(ProductMedia.object_key).where(ProductMedia.object_key.in_(keys)),
+        select(ProductMediaVariant.object_key).where(ProductMediaVariant.object_key.in_(keys)),
+        select(StagedUpload.object_key).where(StagedUpload.object_key.in_(keys)),
+        select(MediaBlob.object_key).where(MediaBlob.object_key.in_(keys)),
+    )
+    return {row[0] for row in db.execute(query)}
+
+
+def sweep_staged(db: Session, ttl_hours: float = MEDIA_STAGED_TTL_HOURS, batch_size: int = MEDIA_GC_BATCH_SIZE, max_batches: Optional[int] = MEDIA_GC_MAX_BATCHES) -> Dict[str, int]:
+    """
+    Удаляет устаревшие staged_uploads и их содержимое.
+
+    Args:
+        db (Session): Сессия базы данных.
+        ttl_hours (float): Время без активности, после которого загрузка считается брошенной.
+        batch_size (int): Строк в одном DELETE.
+        max_batches (Optional[int]): Ограничение числа пакетов за вызов (None — до конца).
+
+    Returns:
+        Dict[str, int]: deleted, db_bytes, store_bytes.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+    result = {"deleted": 0, "db_bytes": 0, "store_bytes": 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        stale_ids = (
+            select(StagedUpload.id)
+            .where(or_(
+                StagedUpload.updated_at < cutoff,
+                and_(StagedUpload.updated_at.is_(None), StagedUpload.created_at < cutoff),
+            ))
+            .order_by(StagedUpload.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = delete(StagedUpload).where(StagedUpload.id.in_(stale_ids.scalar_subquery())).returning(
+            StagedUpload.object_key,
+            StagedUpload.storage_backend,
+            StagedUpload.upload_state,
+            StagedUpload.upload_id,
+            StagedUpload.blob_id,
+            # байты незавершенной загрузки в Postgres лежат в staged_upload_parts (удаляются каскадом)
+            (func.coalesce(func.octet_length(StagedUpload.content), 0) + case(
+                (and_(StagedUpload.storage_backend == DB_BACKEND, StagedUpload.upload_state == UPLOAD_UPLOADING),
+                 func.coalesce(StagedUpload.received_bytes, 0)),
+                else_=0,
+            )).label("db_bytes"),
+            func.coalesce(StagedUpload.content_size, StagedUpload.received_bytes, 0).label("stored_bytes"),
+        )
+        try:
+            rows = db.execute(stmt.execution_options(synchronize_session=False)).all()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if not rows:
+            break
+
+        # Объект, который уже стал ProductMedia (confirm во время очистки), не трогаем.
+        # У загрузки из существующего блоба (blob_id) своего объекта нет — байты принадлежат блобу
+        stored = [row for row in rows if row.blob_id is None and (row.storage_backend or DB_BACKEND) != DB_BACKEND]
+        referenced = _referenced_keys(db, [row.object_key for row in stored])
+        db.commit()
+        store_bytes = 0
+        objects = 0
+        for row in stored:
+            if row.object_key in referenced:
+                continue
+            if row.upload_state == UPLOAD_UPLOADING:
+                try:
+                    get_object_store(row.storage_backend).abort_chunked(row.object_key, row.upload_id)
+                except Exception as exc:
+                    logger.exception("Failed to abort upload %s in %s: %s", row.object_key, row.storage_backend, exc)
+                    continue
+            else:
+                delete_stored_object(row.storage_backend, row.object_key)
+            store_bytes += int(row.stored_bytes or 0)
+            objects += 1
+
+        db_bytes = sum(int(row.db_bytes or 0) for row in rows)
+        result["deleted"] += len(rows)
+        result["db_bytes"] += db_bytes
+        result["store_bytes"] += store_bytes
+        _count(staged_deleted=len(rows), db_bytes_reclaimed=db_bytes, store_bytes_reclaimed=store_bytes, objects_deleted=objects)
+        if len(rows) < batch_size:
+            break
+
+    if result["deleted"]:
+        logger.info(
+            "Staged uploads GC: deleted %s rows, reclaimed %s bytes in Postgres and %s bytes in object stores",
+            result["deleted"], result["db_bytes"], result["store_bytes"],
+        )
+    return result
+
+
+def sweep_blobs(db: Session, grace_hours: float = 1.0) -> Dict[str, int]:
+    """
+    Удаляет блобы без ссылок: с ref_count <= 0 (если удаление медиа прервалось до очистки)
+    и с ненулевым счетчиком, но без ProductMedia (медиа удалены в обход prepare_media_delete).
+    Блобы моложе grace_hours не трогаются.
+
+    Returns:
+        Dict[str, int]: deleted, bytes.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    db.query(MediaBlob).filter(
+        MediaBlob.ref_count > 0,
+        MediaBlob.created_at < cutoff,
+        ~select(ProductMedia.id).where(ProductMedia.blob_id == MediaBlob.id).exists(),
+    ).update({"ref_count": 0}, synchronize_session=False)
+    db.commit()
+    deleted, reclaimed = purge_unreferenced_blobs(db)
+    if deleted:
+        _count(blobs_deleted=deleted, blob_bytes_reclaimed=reclaimed)
+        logger.info("Media blobs GC: deleted %s unreferenced blobs, reclaimed %s bytes", deleted, reclaimed)
+    return {"deleted": deleted, "bytes": reclaimed}
+
+
+def sweep_orphans(db: Session, backend: str, prefix: str = MEDIA_GC_ORPHAN_PREFIX, grace_hours: float = MEDIA_GC_ORPHAN_GRACE_HOURS, batch_size: int = 1000, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Удаляет объекты хранилища backend, на которые не ссылаются product_media,
+    product_media_variants и staged_uploads. Объекты моложе grace_hours пропускаются:
+    их запись в БД может быть еще не зафиксирована.
+
+    Returns:
+        Dict[str, int]: scanned, orphans, bytes.
+    """
+    store = get_object_store(backend)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+    result = {"scanned": 0, "orphans": 0, "bytes": 0}
+
+    def process(batch) -> None:
+        referenced = _referenced_keys(db, [item.key for item in batch])
+        db.commit()
+        for item in batch:
+            if item.key in referenced:
+                continue
+            modified_at = item.modified_at if item.modified_at.tzinfo else item.modified_at.replace(tzinfo=timezone.utc)
+            if modified_at > cutoff:
+                continue
+            result["orphans"] += 1
+            result["bytes"] += item.size
+            if dry_run:
+                logger.info("Orphaned object %s (%s bytes)", item.key, item.size)
+                continue
+            store.delete(item.key)
+            _count(orphans_deleted=1, orphan_bytes_reclaimed=item.size)
+
+    batch = []
+    for item in store.list_objects(prefix):
+        result["scanned"] += 1
+        batch.append(item)
+        if len(batch) >= batch_size:
+            process(batch)
+            batch = []
+    if batch:
+        process(batch)
+
+    logger.info(
+        "Orphan scan of %s: scanned %s objects, %s orphans (%s bytes)%s",
+        backend, result["scanned"], result["orphans"], result["bytes"], " [dry run]" if dry_run else "",
+    )
+    return result
+
+
+def run_gc_once() -> Dict[str, int]:
+    """
+    Один проход очистки staged_uploads в собственной сессии; ошибки записываются в статистику.
+    """
+    db = SessionLocal()
+    try:
+        result = sweep_staged(db)
+        blobs = sweep_blobs(db)
+        result["blobs_deleted"] = blobs["deleted"]
+        result["blob_bytes"] = blobs["bytes"]
+        with _stats_lock:
+            _stats["runs"] += 1
+            _stats["last_run_at"] = datetime.utcnow().isoformat()
+            _stats["last_error"] = None
+        return result
+    except Exception as exc:
+        logger.exception("Staged uploads GC failed: %s", exc)
+        with _stats_lock:
+            _stats["last_error"] = str(exc)
+        return {"deleted": 0, "db_bytes": 0, "store_bytes": 0, "blobs_deleted": 0, "blob_bytes": 0}
+    finally:
+        db.close()
+
+
+def _gc_loop() -> None:
+    while not _stop.wait(MEDIA_GC_INTERVAL):
+        run_gc_once()
+
+
+def start_media_gc() -> None:
+    """
+    Запускает фоновый поток очистки (если MEDIA_GC_ENABLED).
+    """
+    global _thread
+    if not MEDIA_GC_ENABLED:
+        logger.info("Media GC is disabled")
+        return
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_gc_loop, name="media-gc", daemon=True)
+    _thread.start()
+
+
+def stop_media_gc() -> None:
+    """
+    Останавливает фоновый поток очистки.
+    """
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
+        _thread = None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Clean up abandoned staged uploads and orphaned media objects")
+    parser.add_argument("command", choices=["staged", "orphans"])
+    parser.add_argument("--ttl-hours", type=float, default=MEDIA_STAGED_TTL_HOURS)
+    parser.add_argument("--batch-size", type=int, default=MEDIA_GC_BATCH_SIZE)
+    parser.add_argument("--backend", choices=["local", "s3"], default=None, help="Хранилище для поиска потерянных объектов (по умолчанию MEDIA_STORAGE_BACKEND)")
+    parser.add_argument("--prefix", default=MEDIA_GC_ORPHAN_PREFIX)
+    parser.add_argument("--grace-hours", type=float, default=MEDIA_GC_ORPHAN_GRACE_HOURS)
+    parser.add_argument("--dry-run", action="store_true", help="Только показать потерянные объекты")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "staged":
+            result = sweep_staged(db, ttl_hours=args.ttl_hours, batch_size=args.batch_size, max_batches=None)
+            logger.info("Staged GC finished: %s", result)
+        else:
+            backend = args.backend or default_backend()
+            if backend == DB_BACKEND:
+                parser.error("--backend is required when MEDIA_STORAGE_BACKEND is db")
+            result = sweep_orphans(db, backend, prefix=args.prefix, grace_hours=args.grace_hours, dry_run=args.dry_run)
+            logger.info("Orphan GC finished: %s", result)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Media Migration
+---------------
+Перенос байтов медиафайлов из колонок content (product_media, product_media_variants,
+media_blobs, staged_uploads) в объектное хранилище.
+
+Строки обрабатываются пакетами по возрастанию id; в памяти одновременно находится
+содержимое только одного файла. Объект сначала записывается в хранилище, затем в той же
+строке обнуляется content и выставляется storage_backend — повторный запуск после сбоя
+безопасен (объект просто перезаписывается под тем же ключом).
+Место в таблицах освобождается после VACUUM (FULL) product_media, product_media_variants,
+media_blobs, staged_uploads.
+
+Запуск: python -m utils.media_migrate --to s3 --batch-size 50
+"""
+import argparse
+import logging
+from typing import List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from models.product import MediaBlob, ProductMedia, ProductMediaVariant, StagedUpload
+from utils.media_db import coerce_bytes, content_digest, gen_object_key
+from utils.object_store import DB_BACKEND, ObjectStore, get_object_store, default_backend
+
+logger = logging.getLogger("media_migrate")
+
+
+def migrate_table(db: Session, model, store: ObjectStore, batch_size: int = 50, limit: Optional[int] = None, dry_run: bool = False) -> int:
+    """
+    Переносит содержимое строк модели (ProductMedia или StagedUpload) с storage_backend="db" в store.
+
+    Returns:
+        int: Количество перенесенных строк.
+    """
+    moved = 0
+    last_id = 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        rows = db.query(model.id, model.object_key, model.product_id, model.filename, model.mime_type).filter(
+            model.storage_backend == DB_BACKEND,
+            model.id > last_id,
+            func.coalesce(func.length(model.content), 0) > 0,
+        ).order_by(model.id).limit(size).all()
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row.id
+            object_key = row.object_key or gen_object_key(product_id=row.product_id, filename=row.filename or "file")
+            if dry_run:
+                moved += 1
+                continue
+            content = coerce_bytes(db.query(model.content).filter(model.id == row.id).scalar())
+            store.put(object_key, content, row.mime_type or "application/octet-stream")
+            sha, content_size = content_digest([content])
+            db.execute(
+                update(model)
+                .where(model.id == row.id, model.storage_backend == DB_BACKEND)
+                .values(
+                    object_key=object_key, storage_backend=store.name, content=None,
+                    content_sha256=sha, content_size=content_size,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            moved += 1
+        if not dry_run:
+            db.commit()
+        logger.info("%s: moved %s rows to %s (up to id %s)", model.__tablename__, moved, store.name, last_id)
+    return moved
+
+
+def migrate_blobs(db: Session, store: ObjectStore, batch_size: int = 50, limit: Optional[int] = None, dry_run: bool = False) -> int:
+    """
+    Переносит содержимое блобов дедупликации (media_blobs) с storage_backend="db" в store
+    и переключает ссылающиеся на них ProductMedia.
+
+    Returns:
+        int: Количество перенесенных блобов.
+    """
+    moved = 0
+    last_id = 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        rows = db.query(MediaBlob.id, MediaBlob.object_key, MediaBlob.mime_type).filter(
+            MediaBlob.storage_backend == DB_BACKEND,
+            MediaBlob.id > last_id,
+        ).order_by(MediaBlob.id).limit(size).all()
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row.id
+            if dry_run:
+                moved += 1
+                continue
+            content = coerce_bytes(db.query(MediaBlob.content).filter(MediaBlob.id == row.id).scalar())
+            store.put(row.object_key, content, row.mime_type or "application/octet-stream")
+            db.execute(
+                update(MediaBlob)
+                .where(MediaBlob.id == row.id, MediaBlob.storage_backend == DB_BACKEND)
+                .values(storage_backend=store.name, content=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.execute(
+                update(ProductMedia)
+                .where(ProductMedia.blob_id == row.id)
+                .values(storage_backend=store.name, object_key=row.object_key)
+                .execution_options(synchronize_session=False)
+            )
+            moved += 1
+        if not dry_run:
+            db.commit()
+        logger.info("media_blobs: moved %s blobs to %s (up to id %s)", moved, store.name, last_id)
+    return moved
+
+
+def migrate_variants(db: Session, store: ObjectStore, batch_size: int = 50, limit: Optional[int] = None, dry_run: bool = False) -> int:
+    """
+    Переносит содержимое уменьшенных копий (product_media_variants) с storage_backend="db" в store.
+    Ключ объекта, хеш и размер у копий уже заполнены при генерации.
+
+    Returns:
+        int: Количество перенесенных копий.
+    """
+    moved = 0
+    last_id = 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        rows = db.query(ProductMediaVariant.id, ProductMediaVariant.object_key, ProductMediaVariant.mime_type).filter(
+            ProductMediaVariant.storage_backend == DB_BACKEND,
+            ProductMediaVariant.id > last_id,
+        ).order_by(ProductMediaVariant.id).limit(size).all()
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row.id
+            if dry_run:
+                moved += 1
+                continue
+            content = coerce_bytes(db.query(ProductMediaVariant.content).filter(ProductMediaVariant.id == row.id).scalar())
+            store.put(row.object_key, content, row.mime_type or "application/octet-stream")
+            db.execute(
+                update(ProductMediaVariant)
+                .where(ProductMediaVariant.id == row.id, ProductMediaVariant.storage_backend == DB_BACKEND)
+                .values(storage_backend=store.name, content=None)
+                .execution_options(synchronize_session=False)
+            )
+            moved += 1
+        if not dry_run:
+            db.commit()
+        logger.info("product_media_variants: moved %s variants to %s (up to id %s)", moved, store.name, last_id)
+    return moved
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Move media blobs from Postgres to an object store")
+    parser.add_argument("--to", choices=["local", "s3"], default=None, help="Целевое хранилище (по умолчанию MEDIA_STORAGE_BACKEND)")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--skip-staged", action="store_true", help="Не переносить staged_uploads")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    target = args.to or default_backend()
+    if target == DB_BACKEND:
+        parser.error("target backend must be an object store (local or s3)")
+    store = get_object_store(target)
+
+    from database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        moved = migrate_table(db, ProductMedia, store, args.batch_size, args.limit, args.dry_run)
+        moved += migrate_variants(db, store, args.batch_size, args.limit, args.dry_run)
+        moved += migrate_blobs(db, store, args.batch_size, args.limit, args.dry_run)
+        if not args.skip_staged:
+            moved += migrate_table(db, StagedUpload, store, args.batch_size, args.limit, args.dry_run)
+    finally:
+        db.close()
+    logger.info("Media migration finished: %s rows %s", moved, "would be moved" if args.dry_run else "moved")
+    if moved and not args.dry_run:
+        logger.info("Run VACUUM (FULL) product_media, product_media_variants, media_blobs, staged_uploads to return the freed space")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Media Variants
+--------------
+Фоновая генерация уменьшенных копий изображений товаров (thumb, medium) в WebP/AVIF
+с запасным JPEG.
+
+confirm_media_upload ставит медиа в очередь (schedule_media_variants); поток-диспетчер
+читает оригинал из хранилища и передает декодирование и сжатие в пул процессов
+(utils.image_variants.render_variants), затем сохраняет копии в то же хранилище,
+что и новые загрузки, и записывает width/height оригинала в ProductMedia.
+Если дочерний процесс пула падает (BrokenProcessPool), пул пересоздается, а задача
+ставится в очередь повторно (не более MEDIA_VARIANT_MAX_ATTEMPTS раз).
+Очередь не переживает перезапуск — пропущенные медиа догоняет
+python -m utils.media_variants backfill.
+"""
+import os
+import argparse
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database.database import SessionLocal
+from models.product import MediaBlob, ProductMedia, ProductMediaVariant
+from utils import image_variants
+from utils.media_db import content_digest, delete_stored_object, iter_stored_content
+from utils.object_store import DB_BACKEND, get_object_store, default_backend
+
+logger = logging.getLogger("media_variants")
+
+MEDIA_VARIANTS_ENABLED = os.getenv("MEDIA_VARIANTS_ENABLED", "true").lower() == "true"
+MEDIA_VARIANT_PROCESSES = int(os.getenv("MEDIA_VARIANT_PROCESSES", "2"))
+MEDIA_VARIANT_THUMB_SIZE = int(os.getenv("MEDIA_VARIANT_THUMB_SIZE", "320"))      # px, большая сторона
+MEDIA_VARIANT_MEDIUM_SIZE = int(os.getenv("MEDIA_VARIANT_MEDIUM_SIZE", "1024"))
+MEDIA_VARIANT_QUALITY = int(os.getenv("MEDIA_VARIANT_QUALITY", "80"))
+MEDIA_VARIANT_MAX_PIXELS = int(os.getenv("MEDIA_VARIANT_MAX_PIXELS", str(60_000_000)))
+MEDIA_VARIANT_MAX_BYTES = int(os.getenv("MEDIA_VARIANT_MAX_BYTES", str(40 * 1024 * 1024)))
+MEDIA_VARIANT_MAX_ATTEMPTS = int(os.getenv("MEDIA_VARIANT_MAX_ATTEMPTS", "3"))   # при падении процесса пула
+
+VARIANT_SIZES: Dict[str, int] = {"thumb": MEDIA_VARIANT_THUMB_SIZE, "medium": MEDIA_VARIANT_MEDIUM_SIZE}
+
+_lock = threading.Lock()
+_dispatcher: Optional[ThreadPoolExecutor] = None
+_processes: Optional[ProcessPoolExecutor] = None
+_formats: Optional[List[str]] = None
+
+
+def is_image(mime_type: Optional[str]) -> bool:
+    return bool(mime_type) and mime_type.lower().startswith("image/") and mime_type.lower() != "image/svg+xml"
+
+
+def variant_object_key(product_id: int, media_id: int, variant: str, fmt: str) -> str:
+    return f"products/{product_id}/variants/{media_id}/{variant}.{image_variants.EXTENSIONS[fmt]}"
+
+
+def start_media_variant_workers() -> None:
+    """
+    Создает пул процессов и поток-диспетчер (если MEDIA_VARIANTS_ENABLED и установлен Pillow).
+    """
+    global _dispatcher, _processes, _formats
+    if not MEDIA_VARIANTS_ENABLED:
+        logger.info("Media variant generation is disabled")
+        return
+    with _lock:
+        if _processes is not None:
+            return
+        try:
+            _formats = image_variants.supported_formats()
+        except ImportError:
+            logger.warning("Pillow is not installed, media variants will not be generated")
+            return
+        _processes = _new_process_pool()
+        _dispatcher = ThreadPoolExecutor(max_workers=MEDIA_VARIANT_PROCESSES, thread_name_prefix="media-variants")
+        logger.info("Media variant workers started (%s processes, formats: %s)", MEDIA_VARIANT_PROCESSES, ", ".join(_formats))
+
+
+def _new_process_pool() -> ProcessPoolExecutor:
+    # spawn: дочерние процессы не наследуют потоки и соединения с БД родителя
+    return ProcessPoolExecutor(
+        max_workers=MEDIA_VARIANT_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=image_variants.init_worker,
+        initargs=(MEDIA_VARIANT_MAX_PIXELS,),
+    )
+
+
+def _restart_process_pool(broken: ProcessPoolExecutor) -> None:
+    """
+    Заменяет сломанный пул процессов новым (если его еще не заменил другой поток
+    и пул не остановлен).
+    """
+    global _processes
+    with _lock:
+        if _processes is not broken:
+            return
+        _processes = _new_process_pool()
+    broken.shutdown(wait=False, cancel_futures=True)
+    logger.warning("Media variant process pool was broken and has been restarted")
+
+
+def stop_media_variant_workers() -> None:
+    """
+    Останавливает пул; поставленные, но не начатые задачи отбрасываются.
+    """
+    global _dispatcher, _processes
+    with _lock:
+        dispatcher, processes = _dispatcher, _processes
+        _dispatcher = _processes = None
+    if dispatcher is not None:
+        dispatcher.shutdown(wait=True, cancel_futures=True)
+    if processes is not None:
+        processes.shutdown(wait=True, cancel_futures=True)
+
+
+def schedule_media_variants(media_id: int, attempt: int = 1) -> bool:
+    """
+    Ставит генерацию копий медиа в очередь.
+
+    Returns:
+        bool: False, если пул не запущен.
+    """
+    dispatcher = _dispatcher
+    if dispatcher is None:
+        return False
+    try:
+        dispatcher.submit(_generate_logged, media_id, attempt)
+    except RuntimeError:  # пул уже остановлен
+        return False
+    return True
+
+
+def _generate_logged(media_id: int, attempt: int = 1) -> None:
+    try:
+        generate_media_variants(media_id)
+    except BrokenProcessPool:
+        if attempt >= MEDIA_VARIANT_MAX_ATTEMPTS:
+            logger.error("Giving up on variants for media %s after %s attempts: worker process died", media_id, attempt)
+        elif not schedule_media_variants(media_id, attempt + 1):
+            logger.warning("Variants for media %s were not rescheduled: workers are stopped", media_id)
+    except Exception:
+        logger.exception("Failed to generate variants for media %s", media_id)
+
+
+def _render(data: bytes) -> Dict:
+    processes = _processes
+    if processes is not None:
+        try:
+            return processes.submit(
+                image_variants.render_variants, data, VARIANT_SIZES, _formats, MEDIA_VARIANT_QUALITY
+            ).result()
+        except BrokenProcessPool:
+            _restart_process_pool(processes)
+            raise
+    # Без пула (CLI) — в текущем процессе
+    image_variants.init_worker(MEDIA_VARIANT_MAX_PIXELS)
+    return image_variants.render_variants(data, VARIANT_SIZES, image_variants.supported_formats(), MEDIA_VARIANT_QUALITY)
+
+
+def generate_media_variants(media_id: int) -> int:
+    """
+    Генерирует и сохраняет копии изображения, записывает размеры оригинала.
+    Повторный вызов перезаписывает копии.
+
+    Args:
+        media_id (int): ID медиафайла.
+
+    Returns:
+        int: Количество сохраненных копий (0 — не изображение или медиа удалено).
+    """
+    db = SessionLocal()
+    try:
+        row = db.query(
+            ProductMedia.product_id, ProductMedia.object_key, ProductMedia.storage_backend,
+            ProductMedia.mime_type, ProductMedia.content_size, ProductMedia.blob_id,
+        ).filter(ProductMedia.id == media_id).first()
+        db.commit()
+        if row is None or not is_image(row.mime_type):
+            return 0
+        if row.content_size is not None and row.content_size > MEDIA_VARIANT_MAX_BYTES:
+            logger.info("Media %s is too large for variants (%s bytes)", media_id, row.content_size)
+            return 0
+
+        if row.blob_id is not None and (row.storage_backend or DB_BACKEND) == DB_BACKEND:
+            data = b"".join(iter_stored_content(DB_BACKEND, row.object_key, row.blob_id, model=MediaBlob))
+        else:
+            data = b"".join(iter_stored_content(row.storage_backend, row.object_key, media_id))
+        try:
+            rendered = _render(data)
+        except image_variants.decode_errors() as exc:
+            # Файл с image/* типом, который Pillow не смог декодировать, — не повторяем
+            logger.warning("Media %s could not be decoded as an image: %s", media_id, exc)
+            return 0
+        del data
+
+        backend = default_backend()
+        now = datetime.utcnow()
+        values = []
+        for item in rendered["variants"]:
+            payload = item.pop("data")
+            sha, size = content_digest([payload])
+            key = variant_object_key(row.product_id, media_id, item["variant"], item["format"])
+            mime_type = image_variants.MIME_TYPES[item["format"]]
+            if backend != DB_BACKEND:
+                get_object_store(backend).put(key, payload, mime_type)
+            values.append({
+                "media_id": media_id,
+                "variant": item["variant"],
+                "format": item["format"],
+                "object_key": key,
+                "storage_backend": backend,
+                "content": payload if backend == DB_BACKEND else None,
+                "content_sha256": sha,
+                "content_size": size,
+                "mime_type": mime_type,
+                "width": item["width"],
+                "height": item["height"],
+                "created_at": now,
+            })
+
+        saved = _save_variants(db, media_id, values, rendered["width"], rendered["height"])
+        if not saved and backend != DB_BACKEND:
+            # Медиа удалили во время генерации
+            for value in values:
+                delete_stored_object(backend, value["object_key"])
+        return saved
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _save_variants(db: Session, media_id: int, values: List[Dict], width: int, height: int) -> int:
+    updated = db.query(ProductMedia).filter(ProductMedia.id == media_id).update(
+        {"width": width, "height": height}, synchronize_session=False
+    )
+    if not updated or not values:
+        db.commit()
+        return 0
+    table = ProductMediaVariant.__table__
+    stmt = pg_insert(table).values(values)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_product_media_variants_media_variant_format",
+        set_={
+            column: stmt.excluded[column]
+            for column in ("object_key", "storage_backend", "content", "content_sha256", "content_size", "mime_type", "width", "height", "created_at")
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+    return len(values)
+
+
+def pick_format(accept: Optional[str], available: List[str]) -> Optional[str]:
+    """
+    Формат копии по заголовку Accept: avif, затем webp, если клиент их принимает, иначе jpeg.
+    """
+    accept = (accept or "").lower()
+    for fmt in ("avif", "webp"):
+        if fmt in available and image_variants.MIME_TYPES[fmt] in accept:
+            return fmt
+    if "jpeg" in available:
+        return "jpeg"
+    return None
+
+
+def backfill(limit: Optional[int] = None) -> int:
+    """
+    Генерирует копии для изображений, у которых их еще нет.
+
+    Returns:
+        int: Количество обработанных медиа.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(ProductMedia.id, ProductMedia.mime_type).filter(
+            ~ProductMedia.variants.any(),
+            ProductMedia.mime_type.ilike("image/%"),
+        ).order_by(ProductMedia.id)
+        if limit:
+            query = query.limit(limit)
+        media_ids = [row.id for row in query if is_image(row.mime_type)]
+        db.commit()
+    finally:
+        db.close()
+
+    done = 0
+    for media_id in media_ids:
+        try:
+            generate_media_variants(media_id)
+        except Exception:
+            logger.exception("Failed to generate variants for media %s", media_id)
+            continue
+        done += 1
+        if done % 50 == 0:
+            logger.info("Media variants backfill: %s/%s", done, len(media_ids))
+    return done
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate image variants for product media")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv)
+    done = backfill(args.limit)
+    logger.info("Media variants generated for %s media", done)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Object Store
+------------
+Хранилища бинарных данных медиафайлов вне Postgres.
+
+  - local — файлы в каталоге MEDIA_LOCAL_ROOT (один сервер или общий том);
+  - s3    — S3-совместимое хранилище (AWS S3, MinIO), нужен boto3.
+
+Имя бэкенда сохраняется в колонке storage_backend записи медиа ("db" — байты
+в колонке content, как раньше), поэтому записи, перенесенные в разные хранилища,
+обслуживаются одновременно. Новые загрузки пишутся в MEDIA_STORAGE_BACKEND
+(по умолчанию db). Для local нужен абсолютный MEDIA_LOCAL_ROOT: относительный путь
+зависел бы от каталога запуска процесса, и файлы, записанные одним процессом,
+не находились бы другим. Конфигурация проверяется при старте приложения (check_object_store).
+"""
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger("object_store")
+
+DB_BACKEND = "db"
+
+MEDIA_STORAGE_BACKEND = os.getenv("MEDIA_STORAGE_BACKEND", DB_BACKEND).lower()   # db | local | s3
+MEDIA_LOCAL_ROOT = os.getenv("MEDIA_LOCAL_ROOT", "")                # абсолютный путь, обязателен для local
+MEDIA_S3_BUCKET = os.getenv("MEDIA_S3_BUCKET", "gryadka-media")
+MEDIA_S3_ENDPOINT_URL = os.getenv("MEDIA_S3_ENDPOINT_URL")          # например, http://localhost:9000 для MinIO
+MEDIA_S3_REGION = os.getenv("MEDIA_S3_REGION", "us-east-1")
+MEDIA_S3_ACCESS_KEY = os.getenv("MEDIA_S3_ACCESS_KEY")
+MEDIA_S3_SECRET_KEY = os.getenv("MEDIA_S3_SECRET_KEY")
+MEDIA_READ_CHUNK_SIZE = int(os.getenv("MEDIA_READ_CHUNK_SIZE", str(256 * 1024)))
+
+
+class StoredObject(NamedTuple):
+    """
+    Объект в хранилище: ключ, размер и время последнего изменения (UTC).
+    """
+    key: str
+    size: int
+    modified_at: datetime
+
+
+class ObjectNotFound(Exception):
+    """
+    Объект отсутствует в хранилище.
+    """
+
+
+class ObjectStore(ABC):
+    """
+    Базовый интерфейс хранилища объектов.
+    """
+
+    name = ""
+    min_part_size = 0   # минимальный размер части при загрузке частями (кроме последней)
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        """
+        Сохраняет объект (перезаписывая существующий).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = MEDIA_READ_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Читает байты [start, end] (end включительно, None — до конца) частями.
+
+        Raises:
+            ObjectNotFound: Если объекта нет.
+        """
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        """
+        Читает объект целиком.
+        """
+        return b"".join(self.iter_chunks(key))
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """
+        Размер объекта в байтах.
+
+        Raises:
+            ObjectNotFound: Если объекта нет.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Удаляет объект (отсутствие объекта не считается ошибкой).
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.size(key)
+            return True
+        except ObjectNotFound:
+            return False
+
+    @abstractmethod
+    def list_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        """
+        Перечисляет объекты с ключом, начинающимся с prefix (включая временные файлы незавершенных записей).
+        """
+        raise NotImplementedError
+
+    # Загрузка частями (resumable upload): begin -> write_chunk* -> complete | abort.
+
+    @abstractmethod
+    def begin_chunked(self, key: str, content_type: str = "application/octet-stream") -> Optional[str]:
+        """
+        Начинает загрузку объекта частями.
+
+        Returns:
+            Optional[str]: Идентификатор загрузки в хранилище (если нужен).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_chunk(self, key: str, upload_id: Optional[str], part_number: int, offset: int, data: bytes) -> Optional[str]:
+        """
+        Записывает часть part_number (с 1), начинающуюся с байта offset.
+
+        Returns:
+            Optional[str]: ETag части (если нужен для complete_chunked).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def complete_chunked(self, key: str, upload_id: Optional[str], parts: List[Dict]) -> None:
+        """
+        Собирает объект из записанных частей (part_number, etag) без копирования через приложение.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def abort_chunked(self, key: str, upload_id: Optional[str]) -> None:
+        """
+        Отменяет незавершенную загрузку и освобождает записанные части.
+        """
+        raise NotImplementedError
+
+
+class LocalFileStore(ObjectStore):
+    """
+    Хранилище в локальном каталоге; ключ объекта — относительный путь.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = MEDIA_LOCAL_ROOT):
+        if not root or not os.path.isabs(root):
+            raise RuntimeError(f"MEDIA_LOCAL_ROOT must be an absolute path for the local media store, got {root!r}")
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key.lstrip("/")).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = MEDIA_READ_CHUNK_SIZE) -> Iterator[bytes]:
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        with f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def size(self, key: str) -> int:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                key = path.relative_to(self.root).as_posix()
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield StoredObject(key, stat.st_size, datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc))
+
+    def _upload_path(self, key: str) -> Path:
+        path = self._path(key)
+        return path.with_name(f".{path.name}.upload")
+
+    def begin_chunked(self, key: str, content_type: str = "application/octet-stream") -> Optional[str]:
+        path = self._upload_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        open(path, "wb").close()
+        return None
+
+    def write_chunk(self, key: str, upload_id: Optional[str], part_number: int, offset: int, data: bytes) -> Optional[str]:
+        path = self._upload_path(key)
+        try:
+            f = open(path, "r+b")
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        with f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+        return None
+
+    def complete_chunked(self, key: str, upload_id: Optional[str], parts: List[Dict]) -> None:
+        try:
+            os.replace(self._upload_path(key), self._path(key))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def abort_chunked(self, key: str, upload_id: Optional[str]) -> None:
+        try:
+            self._upload_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class S3ObjectStore(ObjectStore):
+    """
+    S3-совместимое хранилище (AWS S3, MinIO) через boto3.
+    """
+
+    name = "s3"
+    min_part_size = 5 * 1024 * 1024   # ограничение S3 multipart upload
+
+    def __init__(
+        self,
+        bucket: str = MEDIA_S3_BUCKET,
+        endpoint_url: Optional[str] = MEDIA_S3_ENDPOINT_URL,
+        region: str = MEDIA_S3_REGION,
+        access_key: Optional[str] = MEDIA_S3_ACCESS_KEY,
+        secret_key: Optional[str] = MEDIA_S3_SECRET_KEY,
+    ):
+        import boto3
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path"}, max_pool_connections=32),
+        )
+
+    def _is_not_found(self, exc) -> bool:
+        code = str(exc.response.get("Error", {}).get("Code", ""))
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def iter_chunks(self, key: str, start: int = 0, end: Optional[int] = None, chunk_size: int = MEDIA_READ_CHUNK_SIZE) -> Iterator[bytes]:
+        params = {"Bucket": self.bucket, "Key": key}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = self.client.get_object(**params)
+        except self._client_error as exc:
+            if self._is_not_found(exc):
+                raise ObjectNotFound(key)
+            raise
+        body = response["Body"]
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    def size(self, key: str) -> int:
+        try:
+            return int(self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"])
+        except self._client_error as exc:
+            if self._is_not_found(exc):
+                raise ObjectNotFound(key)
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        # Незавершенные multipart upload сюда не попадают — их удаляет правило
+        # жизненного цикла бакета AbortIncompleteMultipartUpload
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield StoredObject(item["Key"], int(item["Size"]), item["LastModified"])
+
+    def begin_chunked(self, key: str, content_type: str = "application/octet-stream") -> Optional[str]:
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=key, ContentType=content_type)["UploadId"]
+
+    def write_chunk(self, key: str, upload_id: Optional[str], part_number: int, offset: int, data: bytes) -> Optional[str]:
+        response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data)
+        return response["ETag"]
+
+    def complete_chunked(self, key: str, upload_id: Optional[str], parts: List[Dict]) -> None:
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": part["part_number"], "ETag": part["etag"]} for part in parts]},
+        )
+
+    def abort_chunked(self, key: str, upload_id: Optional[str]) -> None:
+        if not upload_id:
+            return
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except self._client_error as exc:
+            if str(exc.response.get("Error", {}).get("Code", "")) != "NoSuchUpload":
+                raise
+
+
+_stores: Dict[str, ObjectStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_object_store(name: Optional[str] = None) -> ObjectStore:
+    """
+    Хранилище по имени бэкенда (по умолчанию — MEDIA_STORAGE_BACKEND).
+
+    Raises:
+        ValueError: Для неизвестного бэкенда или "db" (у него нет объектного хранилища).
+    """
+    name = (name or MEDIA_STORAGE_BACKEND).lower()
+    store = _stores.get(name)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(name)
+            if store is None:
+                if name == LocalFileStore.name:
+                    store = LocalFileStore()
+                elif name == S3ObjectStore.name:
+                    store = S3ObjectStore()
+                else:
+                    raise ValueError(f"Unknown object store backend: {name}")
+                _stores[name] = store
+    return store
+
+
+def default_backend() -> str:
+    """
+    Бэкенд для новых загрузок ("db", "local" или "s3").
+    """
+    return MEDIA_STORAGE_BACKEND
+
+
+def check_object_store() -> None:
+    """
+    Проверяет настройки хранилища для новых загрузок при старте приложения.
+
+    Raises:
+        RuntimeError: Если хранилище настроено неверно (например, относительный MEDIA_LOCAL_ROOT).
+        ValueError: Для неизвестного бэкенда.
+    """
+    if MEDIA_STORAGE_BACKEND != DB_BACKEND:
+        get_object_store(MEDIA_STORAGE_BACKEND)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Sensor Reading Rate Limit
+-------------------------
+Хранилище времени последнего показания датчика для rate limiting.
+
+Решение о 429 принимается за O(1) без запроса к sensor_readings:
+  - memory   — в памяти процесса (по умолчанию, один воркер);
+  - postgres — UNLOGGED-таблица sensor_last_reading, общая для всех воркеров.
+Холодное хранилище один раз заполняется из sensor_readings.
+"""
+import os
+import threading
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from models.sensor import SensorReading, SensorLastReading
+
+logger = logging.getLogger("reading_rate_limit")
+
+SENSOR_RATE_LIMIT_BACKEND = os.getenv("SENSOR_RATE_LIMIT_BACKEND", "memory").lower()
+
+
+def _backfill_last_reading(db: Session, device_id: int) -> Optional[datetime]:
+    """
+    Время последнего сохраненного показания датчика из sensor_readings.
+    """
+    return db.query(func.max(SensorReading.created_at)).filter(
+        SensorReading.device_id == device_id
+    ).scalar()
+
+
+class LastReadingStore(ABC):
+    """
+    Базовый интерфейс хранилища времени последнего показания.
+    """
+
+    @abstractmethod
+    def try_acquire(self, db: Session, device_id: int, reading_at: datetime, interval: timedelta) -> bool:
+        """
+        Атомарно проверяет интервал и, если он соблюден, запоминает reading_at.
+
+        Returns:
+            bool: True, если показание можно принять, иначе False (rate limit).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_reading_at(self, db: Session, device_id: int) -> Optional[datetime]:
+        """
+        Время последнего принятого показания датчика (или None).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def record(self, db: Session, device_id: int, reading_at: datetime) -> None:
+        """
+        Запоминает время показания, если оно новее сохраненного.
+        """
+        raise NotImplementedError
+
+    def forget(self, device_id: int) -> None:
+        """
+        Сбрасывает состояние датчика (например, после неудачной записи показания).
+        По умолчанию ничего не делает: хранилищам в транзакции БД хватает отката.
+        """
+
+
+class InMemoryLastReadingStore(LastReadingStore):
+    """
+    Хранилище в памяти процесса. Подходит для одного воркера.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last: Dict[int, Optional[datetime]] = {}
+
+    def _ensure_loaded(self, db: Session, device_id: int) -> None:
+        if device_id in self._last:
+            return
+        value = _backfill_last_reading(db, device_id)
+        with self._lock:
+            self._last.setdefault(device_id, value)
+
+    def try_acquire(self, db: Session, device_id: int, reading_at: datetime, interval: timedelta) -> bool:
+        self._ensure_loaded(db, device_id)
+        with self._lock:
+            last = self._last.get(device_id)
+            if last is not None and (reading_at - last) < interval:
+                return False
+            self._last[device_id] = reading_at
+            return True
+
+    def last_reading_at(self, db: Session, device_id: int) -> Optional[datetime]:
+        self._ensure_loaded(db, device_id)
+        with self._lock:
+            return self._last.get(device_id)
+
+    def record(self, db: Session, device_id: int, reading_at: datetime) -> None:
+        self._ensure_loaded(db, device_id)
+        with self._lock:
+            last = self._last.get(device_id)
+            if last is None or reading_at > last:
+                self._last[device_id] = reading_at
+
+    def forget(self, device_id: int) -> None:
+        with self._lock:
+            self._last.pop(device_id, None)
+
+
+class PostgresLastReadingStore(LastReadingStore):
+    """
+    Общее для всех воркеров хранилище в UNLOGGED-таблице sensor_last_reading.
+    Все операции выполняются в транзакции вызывающего кода, поэтому откат
+    записи показания откатывает и обновление времени.
+    """
+
+    table = SensorLastReading.__table__
+
+    def try_acquire(self, db: Session, device_id: int, reading_at: datetime, interval: timedelta) -> bool:
+        stmt = pg_insert(self.table).values(device_id=device_id, last_reading_at=reading_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.table.c.device_id],
+            set_={"last_reading_at": stmt.excluded.last_reading_at},
+            where=self.table.c.last_reading_at <= stmt.excluded.last_reading_at - interval,
+        ).returning(self.table.c.device_id, literal_column("xmax = 0").label("inserted"))
+        row = db.execute(stmt).first()
+        if row is None:
+            return False
+        if not row.inserted:
+            return True
+
+        # Холодный старт для датчика: один раз сверяемся с историей показаний
+        previous = _backfill_last_reading(db, device_id)
+        if previous is not None and (reading_at - previous) < interval:
+            db.execute(
+                self.table.update()
+                .where(self.table.c.device_id == device_id)
+                .values(last_reading_at=previous)
+            )
+            return False
+        return True
+
+    def last_reading_at(self, db: Session, device_id: int) -> Optional[datetime]:
+        value = db.query(SensorLastReading.last_reading_at).filter(
+            SensorLastReading.device_id == device_id
+        ).scalar()
+        if value is not None:
+            return value
+        value = _backfill_last_reading(db, device_id)
+        if value is not None:
+            self.record(db, device_id, value)
+        return value
+
+    def record(self, db: Session, device_id: int, reading_at: datetime) -> None:
+        stmt = pg_insert(self.table).values(device_id=device_id, last_reading_at=reading_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.table.c.device_id],
+            set_={"last_reading_at": func.greatest(self.table.c.last_reading_at, stmt.excluded.last_reading_at)},
+        )
+        db.execute(stmt)
+
+
+_store: Optional[LastReadingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_last_reading_store() -> LastReadingStore:
+    """
+    Возвращает хранилище, выбранное переменной окружения SENSOR_RATE_LIMIT_BACKEND.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if SENSOR_RATE_LIMIT_BACKEND == "postgres":
+                    _store = PostgresLastReadingStore()
+                else:
+                    if SENSOR_RATE_LIMIT_BACKEND != "memory":
+                        logger.warning("Unknown SENSOR_RATE_LIMIT_BACKEND=%s, using memory", SENSOR_RATE_LIMIT_BACKEND)
+                    _store = InMemoryLastReadingStore()
+    return _store
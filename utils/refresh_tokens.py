@@ -3,17 +3,24 @@
 Refresh Token Utilities
 -----------------------
 Модуль для работы с refresh токенами: создание, проверка, ротация и отзыв.
+
+Ротация выполняется одним SQL-оператором (см. verify_and_rotate_refresh_token):
+условный UPDATE старого токена и INSERT нового в data-modifying CTE. Параллельные
+запросы с одним токеном сериализуются блокировкой строки — ротацию выполнит только
+первый, остальные получат ReuseDetected.
 """
 
 import hmac
 import hashlib
 import secrets
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
+from typing import NamedTuple, Optional, Tuple
 
+from sqlalchemy import Boolean, DateTime, String, false, func, insert, literal, select, true, update
 from sqlalchemy.orm import Session
 
 from models.refresh_token import RefreshToken
+from models.user import User
 
 import os
 
@@ -40,6 +47,32 @@ def _hash_token_hmac(token: str) -> str:
     return hmac.new(REFRESH_TOKEN_SECRET.encode("utf-8"), token.encode("utf-8"), hashlib.sha256).hexdigest()
 
 
+def _generate_token() -> Tuple[str, str, datetime]:
+    plain = secrets.token_urlsafe(REFRESH_TOKEN_BYTES)
+    return plain, _hash_token_hmac(plain), datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXP_DAYS)
+
+
+def new_refresh_token_values(user_id: int, device_info: Optional[str] = None) -> Tuple[str, dict]:
+    """
+    Генерирует refresh токен и значения строки refresh_tokens для INSERT
+    (для вставки в транзакции вызывающего кода, без отдельного commit).
+    
+    Args:
+        user_id (int): ID пользователя, которому принадлежит токен.
+        device_info (Optional[str]): Информация об устройстве (опционально).
+        
+    Returns:
+        Tuple[str, dict]: Пара (plain токен, значения колонок user_id, token_hash, expires_at, device_info).
+    """
+    plain, token_hash, expires_at = _generate_token()
+    return plain, {
+        "user_id": user_id,
+        "token_hash": token_hash,
+        "expires_at": expires_at,
+        "device_info": device_info,
+    }
+
+
 def create_refresh_token(db: Session, user_id: int, device_info: Optional[str] = None) -> Tuple[str, RefreshToken]:
     """
     Создание нового refresh токена.
@@ -55,16 +88,8 @@ def create_refresh_token(db: Session, user_id: int, device_info: Optional[str] =
     Returns:
         Tuple[str, RefreshToken]: Пара (plain токен, объект RefreshToken из БД).
     """
-    plain = secrets.token_urlsafe(REFRESH_TOKEN_BYTES)
-    token_hash = _hash_token_hmac(plain)
-    expires_at = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXP_DAYS)
-
-    db_token = RefreshToken(
-        user_id=user_id,
-        token_hash=token_hash,
-        expires_at=expires_at,
-        device_info=device_info,
-    )
+    plain, values = new_refresh_token_values(user_id, device_info)
+    db_token = RefreshToken(**values)
     db.add(db_token)
     db.commit()
     db.refresh(db_token)
@@ -90,43 +115,107 @@ class ReuseDetected(Exception):
     pass
 
 
-def verify_and_rotate_refresh_token(db: Session, plain_token: str) -> Tuple[int, str, RefreshToken]:
+class RotatedToken(NamedTuple):
+    """
+    Результат ротации: новый refresh токен и данные пользователя для access токена.
+    """
+    user_id: int
+    plain: str
+    expires_at: datetime
+    role: str
+
+
+def _rotate_statement(token_hash: str, new_token_hash: str, new_expires_at: datetime):
+    """
+    Один оператор ротации:
+
+        WITH new_id AS (SELECT nextval(...)),
+             old AS (UPDATE refresh_tokens SET revoked = true, replaced_by = new_id
+                     WHERE token_hash = :hash AND NOT revoked AND expires_at > now()
+                     RETURNING user_id, device_info),
+             new AS (INSERT INTO refresh_tokens ... SELECT ... FROM old JOIN new_id ON true RETURNING ...)
+        SELECT new.*, users.role, users.is_active FROM new JOIN users
+
+    id нового токена берется из последовательности заранее — одну строку нельзя
+    изменить в одном операторе дважды, поэтому replaced_by пишется тем же UPDATE.
+    """
+    table = RefreshToken.__table__
+    new_id = select(
+        func.nextval(func.pg_get_serial_sequence(table.name, "id")).label("id")
+    ).cte("new_id")
+    old = (
+        update(table)
+        .where(
+            table.c.token_hash == token_hash,
+            table.c.revoked == false(),
+            table.c.expires_at > func.now(),
+        )
+        .values(revoked=True, replaced_by=select(new_id.c.id).scalar_subquery())
+        .returning(table.c.user_id, table.c.device_info)
+        .cte("old")
+    )
+    new = (
+        insert(table)
+        .from_select(
+            ["id", "user_id", "token_hash", "expires_at", "device_info", "revoked"],
+            select(
+                new_id.c.id,
+                old.c.user_id,
+                literal(new_token_hash, String),
+                literal(new_expires_at, DateTime(timezone=True)),
+                old.c.device_info,
+                literal(False, Boolean),
+            ).select_from(old.join(new_id, true())),
+        )
+        .returning(table.c.user_id, table.c.expires_at)
+        .cte("new")
+    )
+    users = User.__table__
+    return select(new.c.user_id, new.c.expires_at, users.c.role, users.c.is_active).select_from(
+        new.join(users, users.c.id == new.c.user_id)
+    )
+
+
+def verify_and_rotate_refresh_token(db: Session, plain_token: str) -> RotatedToken:
     """
     Проверка и ротация refresh токена.
     
-    Проверяет переданный токен, и если он действителен, создает новый токен,
-    отмечает старый как отозванный и возвращает новый токен.
+    Старый токен отзывается, новый создается и связывается с ним (replaced_by) одним
+    оператором в одной транзакции. Если оператор ничего не изменил, токен разбирается
+    отдельным запросом только ради ответа: не найден, просрочен или уже использован.
     
     Args:
         db (Session): Сессия базы данных SQLAlchemy.
         plain_token (str): Проверяемый refresh токен.
         
     Returns:
-        Tuple[int, str, RefreshToken]: Кортеж (user_id, новый plain токен, новый объект RefreshToken).
+        RotatedToken: Новый токен, ID и роль пользователя.
         
     Raises:
-        ValueError: Если токен недействителен или просрочен.
-        ReuseDetected: Если обнаружено повторное использование токена.
+        ValueError: Если токен недействителен, просрочен или пользователь деактивирован.
+        ReuseDetected: Если токен уже был использован (в том числе параллельным запросом).
     """
     token_hash = _hash_token_hmac(plain_token)
-    db_token = db.query(RefreshToken).filter(RefreshToken.token_hash == token_hash).first()
-
-    if not db_token:
+    new_plain, new_token_hash, new_expires_at = _generate_token()
+    try:
+        row = db.execute(_rotate_statement(token_hash, new_token_hash, new_expires_at)).first()
+        if row is not None:
+            if not row.is_active:
+                db.rollback()
+                raise ValueError("User is inactive")
+            db.commit()
+            return RotatedToken(user_id=row.user_id, plain=new_plain, expires_at=row.expires_at, role=row.role)
+
+        db_token = db.query(RefreshToken.user_id, RefreshToken.revoked).filter(RefreshToken.token_hash == token_hash).first()
+        db.rollback()
+    except Exception:
+        db.rollback()
+        raise
+
+    if db_token is None:
         raise ValueError("Invalid refresh token")
-
     if db_token.revoked:
         if REVOKE_ON_REUSE:
             revoke_all_for_user(db, db_token.user_id)
         raise ReuseDetected("Refresh token reuse detected")
-
-    if db_token.expires_at < datetime.now(timezone.utc):
-        db_token.revoked = True
-        db.commit()
-        raise ValueError("Refresh token expired")
-
-    # Ротация токена
-    new_plain, new_db = create_refresh_token(db, db_token.user_id, device_info=db_token.device_info)
-    db_token.revoked = True
-    db_token.replaced_by = new_db.id
-    db.commit()
-    return db_token.user_id, new_plain, new_db
\ No newline at end of file
+    raise ValueError("Refresh token expired")
@@ -3,22 +3,69 @@
 Security Utilities
 ------------------
 Модуль для безопасного хеширования и проверки паролей.
+
+Argon2 намеренно медленный и требует много памяти, поэтому хеширование и проверка
+выполняются в отдельном пуле фиксированного размера (PASSWORD_HASH_WORKERS потоков;
+argon2-cffi отпускает GIL на время вычисления). Очередь ограничена
+PASSWORD_HASH_MAX_PENDING задачами: при переполнении сразу выбрасывается
+PasswordHasherBusy (ответ 503), а не растет задержка у всех входов.
+
+Параметры Argon2 задаются переменными ARGON2_*; хеши со старыми параметрами
+прозрачно пересчитываются при успешном входе (verify_and_update_password).
 """
 
+import os
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
 from passlib.context import CryptContext
 
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))   # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))   # выполняются + ждут
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))    # секунды, для 503
+
 # Контекст для хеширования паролей с использованием алгоритма Argon2
 # Argon2 обеспечивает высокую степень безопасности и устойчивость к атакам
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Очередь пула хеширования паролей заполнена.
+    """
+
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_stats: Dict[str, float] = {
+    "pending": 0,        # выполняются + ждут в очереди
+    "running": 0,
+    "completed": 0,
+    "rejected": 0,
+    "wait_seconds": 0.0,  # суммарное ожидание в очереди
+    "run_seconds": 0.0,   # суммарное время вычисления
+}
 
 
 def hash_password(password: str) -> str:
     """
-    Хеширование пароля с использованием алгоритма Argon2.
-    
+    Хеширование пароля с использованием алгоритма Argon2 (в текущем потоке).
+
     Args:
         password (str): Исходный пароль в открытом виде.
-        
+
     Returns:
         str: Хешированный пароль в виде строки.
     """
@@ -27,13 +74,144 @@ def hash_password(password: str) -> str:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Проверка соответствия введенного пароля хешированному значению.
-    
+    Проверка соответствия введенного пароля хешированному значению (в текущем потоке).
+
     Args:
         plain_password (str): Введенный пользователем пароль.
         hashed_password (str): Хешированный пароль из базы данных.
-        
+
     Returns:
         bool: True, если пароль совпадает с хешем, иначе False.
     """
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Проверка пароля с пересчетом хеша, если он создан с устаревшими параметрами (в текущем потоке).
+
+    Returns:
+        Tuple[bool, Optional[str]]: (совпал ли пароль, новый хеш или None).
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _pool
+
+
+def _submit(fn: Callable, *args) -> Future:
+    """
+    Ставит задачу в пул или сразу отказывает, если очередь заполнена.
+
+    Raises:
+        PasswordHasherBusy: Если задач в пуле уже PASSWORD_HASH_MAX_PENDING.
+    """
+    with _pool_lock:
+        if _stats["pending"] >= PASSWORD_HASH_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise PasswordHasherBusy("password hashing pool is saturated")
+        _stats["pending"] += 1
+    queued_at = time.monotonic()
+
+    def task():
+        started = time.monotonic()
+        with _pool_lock:
+            _stats["running"] += 1
+            _stats["wait_seconds"] += started - queued_at
+        try:
+            return fn(*args)
+        finally:
+            with _pool_lock:
+                _stats["running"] -= 1
+                _stats["completed"] += 1
+                _stats["run_seconds"] += time.monotonic() - started
+
+    def release(_future: Future) -> None:
+        # И после выполнения, и после отмены при остановке пула
+        with _pool_lock:
+            _stats["pending"] -= 1
+
+    try:
+        future = _get_pool().submit(task)
+    except RuntimeError:
+        release(None)
+        raise PasswordHasherBusy("password hashing pool is shut down")
+    future.add_done_callback(release)
+    return future
+
+
+def hash_password_pooled(password: str) -> str:
+    """
+    Хеширование пароля в пуле (для синхронных обработчиков).
+
+    Raises:
+        PasswordHasherBusy: Если пул перегружен.
+    """
+    return _submit(hash_password, password).result()
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Проверка пароля с пересчетом устаревшего хеша в пуле (для синхронных обработчиков).
+
+    Raises:
+        PasswordHasherBusy: Если пул перегружен.
+    """
+    return _submit(verify_and_update, plain_password, hashed_password).result()
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    Хеширование пароля в пуле без блокировки event loop.
+
+    Raises:
+        PasswordHasherBusy: Если пул перегружен.
+    """
+    return await asyncio.wrap_future(_submit(hash_password, password))
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Проверка пароля с пересчетом устаревшего хеша в пуле без блокировки event loop.
+
+    Raises:
+        PasswordHasherBusy: Если пул перегружен.
+    """
+    return await asyncio.wrap_future(_submit(verify_and_update, plain_password, hashed_password))
+
+
+def password_pool_stats() -> Dict[str, float]:
+    """
+    Состояние пула хеширования: глубина очереди, отказы и среднее время ожидания/вычисления.
+    """
+    with _pool_lock:
+        stats = dict(_stats)
+    completed = stats["completed"] or 1
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": int(stats["pending"]),
+        "running": int(stats["running"]),
+        "queued": int(stats["pending"] - stats["running"]),
+        "completed": int(stats["completed"]),
+        "rejected": int(stats["rejected"]),
+        "avg_wait_ms": round(stats["wait_seconds"] / completed * 1000, 2),
+        "avg_run_ms": round(stats["run_seconds"] / completed * 1000, 2),
+    }
+
+
+def shutdown_password_pool() -> None:
+    """
+    Останавливает пул (задачи в очереди отбрасываются).
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
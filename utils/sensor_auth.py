@@ -3,18 +3,54 @@
 Sensor Authentication Utilities
 -------------------------------
 Утилиты для аутентификации датчиков по API-ключам.
+
+Результат поиска датчика по хешу ключа кешируется в памяти процесса (TTL + LRU),
+а время последнего подключения (last_seen) не пишется на каждый запрос,
+а периодически сбрасывается в БД одним пакетным UPDATE.
 """
 import hmac
 import hashlib
-from typing import Optional
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, NamedTuple, Dict
+from sqlalchemy import bindparam
 from sqlalchemy.orm import Session
 from models.sensor import SensorDevice
 import os
-from datetime import datetime, timezone  
+from datetime import datetime, timezone
 
 
 SENSOR_SECRET_KEY = os.getenv("SENSOR_SECRET_KEY")
 
+# Конфигурация кеша датчиков
+SENSOR_AUTH_CACHE_TTL = float(os.getenv("SENSOR_AUTH_CACHE_TTL", "60"))        # секунды
+SENSOR_AUTH_CACHE_SIZE = int(os.getenv("SENSOR_AUTH_CACHE_SIZE", "10000"))     # записей
+SENSOR_LAST_SEEN_FLUSH_INTERVAL = float(os.getenv("SENSOR_LAST_SEEN_FLUSH_INTERVAL", "30"))  # секунды
+
+logger = logging.getLogger("sensor_auth")
+
+
+class CachedSensor(NamedTuple):
+    """
+    Минимальные данные датчика, необходимые для приема показаний.
+    """
+    id: int
+    is_active: bool
+    product_id: Optional[int]
+
+
+_cache_lock = threading.Lock()
+_cache: "OrderedDict[str, tuple]" = OrderedDict()  # api_key_hash -> (expires_at, CachedSensor)
+
+_last_seen_lock = threading.Lock()
+_pending_last_seen: Dict[int, datetime] = {}  # device_id -> последнее время подключения
+
+_flusher_stop = threading.Event()
+_flusher_thread: Optional[threading.Thread] = None
+
+
 def hash_api_key(api_key: str) -> str:
     """
     Хеширование API-ключа с использованием HMAC-SHA256.
@@ -26,21 +62,144 @@ def hash_api_key(api_key: str) -> str:
         hashlib.sha256
     ).hexdigest()
 
-def verify_sensor_api_key(db: Session, api_key: str) -> Optional[SensorDevice]:
+
+def _cache_get(api_key_hash: str) -> Optional[CachedSensor]:
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(api_key_hash)
+        if entry is None:
+            return None
+        expires_at, sensor = entry
+        if expires_at <= now:
+            del _cache[api_key_hash]
+            return None
+        _cache.move_to_end(api_key_hash)
+        return sensor
+
+
+def _cache_put(api_key_hash: str, sensor: CachedSensor) -> None:
+    with _cache_lock:
+        _cache[api_key_hash] = (time.monotonic() + SENSOR_AUTH_CACHE_TTL, sensor)
+        _cache.move_to_end(api_key_hash)
+        while len(_cache) > SENSOR_AUTH_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def invalidate_sensor_cache(api_key_hash: Optional[str] = None) -> None:
+    """
+    Сброс закешированных данных датчика.
+    Вызывается при изменении датчика (активация/деактивация, привязка к продукту).
+
+    Args:
+        api_key_hash (Optional[str]): Хеш ключа датчика. Если не указан — кеш очищается полностью.
+    """
+    with _cache_lock:
+        if api_key_hash is None:
+            _cache.clear()
+        else:
+            _cache.pop(api_key_hash, None)
+
+
+def mark_sensor_seen(device_id: int, seen_at: Optional[datetime] = None) -> None:
+    """
+    Запоминает время последнего подключения датчика для последующего пакетного сброса в БД.
+    """
+    with _last_seen_lock:
+        _pending_last_seen[device_id] = seen_at or datetime.now(timezone.utc)
+
+
+def flush_last_seen(db: Optional[Session] = None) -> int:
+    """
+    Сбрасывает накопленные значения last_seen одним пакетным UPDATE.
+
+    Args:
+        db (Optional[Session]): Сессия базы данных. Если не указана — открывается новая.
+
+    Returns:
+        int: Количество обновленных датчиков.
+    """
+    with _last_seen_lock:
+        if not _pending_last_seen:
+            return 0
+        pending = dict(_pending_last_seen)
+        _pending_last_seen.clear()
+
+    own_session = db is None
+    if own_session:
+        from database.database import SessionLocal
+        db = SessionLocal()
+    table = SensorDevice.__table__
+    stmt = (
+        table.update()
+        .where(table.c.id == bindparam("_device_id"))
+        .values(last_seen=bindparam("_last_seen"))
+    )
+    try:
+        db.execute(stmt, [{"_device_id": device_id, "_last_seen": seen_at} for device_id, seen_at in pending.items()])
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Failed to flush sensor last_seen: %s", exc)
+        # Возвращаем значения обратно, не затирая более свежие
+        with _last_seen_lock:
+            for device_id, seen_at in pending.items():
+                _pending_last_seen.setdefault(device_id, seen_at)
+        return 0
+    finally:
+        if own_session:
+            db.close()
+    return len(pending)
+
+
+def _flusher_loop() -> None:
+    while not _flusher_stop.wait(SENSOR_LAST_SEEN_FLUSH_INTERVAL):
+        flush_last_seen()
+
+
+def start_last_seen_flusher() -> None:
+    """
+    Запускает фоновый поток периодического сброса last_seen.
+    """
+    global _flusher_thread
+    if _flusher_thread is not None and _flusher_thread.is_alive():
+        return
+    _flusher_stop.clear()
+    _flusher_thread = threading.Thread(target=_flusher_loop, name="sensor-last-seen-flusher", daemon=True)
+    _flusher_thread.start()
+
+
+def stop_last_seen_flusher() -> None:
+    """
+    Останавливает фоновый поток и сбрасывает оставшиеся значения last_seen.
+    """
+    global _flusher_thread
+    _flusher_stop.set()
+    if _flusher_thread is not None:
+        _flusher_thread.join(timeout=5)
+        _flusher_thread = None
+    flush_last_seen()
+
+
+def verify_sensor_api_key(db: Session, api_key: str) -> Optional[CachedSensor]:
     """
     Верификация API-ключа датчика.
-    Возвращает объект датчика, если ключ действителен и датчик активен.
+    Возвращает данные датчика, если ключ действителен и датчик активен.
+    Поиск по хешу ключа кешируется; last_seen обновляется пакетно в фоне.
     """
     api_key_hash = hash_api_key(api_key)
-    sensor = db.query(SensorDevice).filter(
-        SensorDevice.api_key_hash == api_key_hash,
-        SensorDevice.is_active == True
-    ).first()
-    
-    if sensor:
-        # Обновляем время последнего подключения
-        sensor.last_seen = datetime.now(timezone.utc)
-        db.commit()
-        db.refresh(sensor)
-    
-    return sensor
\ No newline at end of file
+    sensor = _cache_get(api_key_hash)
+    if sensor is None:
+        row = db.query(SensorDevice.id, SensorDevice.is_active, SensorDevice.product_id).filter(
+            SensorDevice.api_key_hash == api_key_hash
+        ).first()
+        if row is None:
+            return None
+        sensor = CachedSensor(id=row.id, is_active=bool(row.is_active), product_id=row.product_id)
+        _cache_put(api_key_hash, sensor)
+
+    if not sensor.is_active:
+        return None
+
+    # Обновляем время последнего подключения (сбрасывается в БД периодически)
+    mark_sensor_seen(sensor.id)
+    return sensor
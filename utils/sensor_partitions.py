@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Sensor Readings Partitions
+--------------------------
+Обслуживание помесячных секций таблицы sensor_readings.
+
+  - ensure    — создает секции на текущий и N следующих месяцев (+ секцию DEFAULT);
+                строки месяца, уже попавшие в DEFAULT, переносятся в его новую секцию;
+  - retention — отсоединяет (detach) или удаляет (drop) секции старше срока хранения;
+                просроченные строки секции DEFAULT переносятся в отдельные таблицы
+                месяцев (как у отсоединенной секции) или удаляются;
+  - maintain  — ensure + retention (для запуска по cron);
+  - migrate   — переводит существующую несекционированную таблицу на секции.
+
+Запуск: python -m utils.sensor_partitions maintain
+
+Обновление существующей установки: create_all не меняет уже созданную таблицу, поэтому
+sensor_readings, созданная до секционирования, остается обычной таблицей — секции
+не создаются, retention ничего не делает, а при старте пишется ошибка в лог.
+Перед запуском новой версии один раз выполните (таблица блокируется на время переноса):
+python -m utils.sensor_partitions migrate
+"""
+import os
+import re
+import argparse
+import logging
+from datetime import datetime, date
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from models.sensor import SensorReading
+
+logger = logging.getLogger("sensor_partitions")
+
+PARENT_TABLE = SensorReading.__tablename__
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+LEGACY_TABLE = f"{PARENT_TABLE}_legacy"
+
+SENSOR_PARTITION_MONTHS_AHEAD = int(os.getenv("SENSOR_PARTITION_MONTHS_AHEAD", "3"))
+SENSOR_RETENTION_MONTHS = int(os.getenv("SENSOR_RETENTION_MONTHS", "0"))  # 0 — хранить бессрочно
+SENSOR_RETENTION_MODE = os.getenv("SENSOR_RETENTION_MODE", "detach")     # detach | drop
+
+_PARTITION_RE = re.compile(rf"^{PARENT_TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def _month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _add_months(value: date, months: int) -> date:
+    index = value.year * 12 + (value.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """
+    Имя секции для месяца: sensor_readings_yYYYYmMM.
+    """
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """
+    Проверяет, что sensor_readings существует и является секционированной таблицей.
+    """
+    return bool(conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"),
+        {"name": PARENT_TABLE},
+    ).scalar())
+
+
+def list_partitions(conn: Connection) -> List[str]:
+    """
+    Список имен секций sensor_readings.
+    """
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:name) ORDER BY c.relname"
+    ), {"name": PARENT_TABLE})
+    return [r[0] for r in rows]
+
+
+def _create_month_partitions(conn: Connection, first_month: date, last_month: date) -> List[str]:
+    created = []
+    month = _month_start(first_month)
+    existing = set(list_partitions(conn))
+    default_locked = False
+    while month <= last_month:
+        name = partition_name(month)
+        if name not in existing:
+            upper = _add_months(month, 1)
+            bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+            if DEFAULT_PARTITION in existing and not default_locked:
+                # Новые строки не попадут в DEFAULT, пока из него переносятся строки месяца
+                conn.execute(text(f'LOCK TABLE "{DEFAULT_PARTITION}" IN EXCLUSIVE MODE'))
+                default_locked = True
+            if default_locked and _default_has_rows(conn, month, upper):
+                _attach_from_default(conn, name, month, upper, bounds)
+            else:
+                conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" {bounds}'))
+            created.append(name)
+        month = _add_months(month, 1)
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{PARENT_TABLE}" DEFAULT'))
+    return created
+
+
+def _default_has_rows(conn: Connection, month: date, upper: date) -> bool:
+    return bool(conn.execute(
+        text(f'SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= :lower AND created_at < :upper LIMIT 1'),
+        {"lower": month, "upper": upper},
+    ).scalar())
+
+
+def _attach_from_default(conn: Connection, name: str, month: date, upper: date, bounds: str) -> None:
+    """
+    Создает секцию месяца, в который уже попали строки секции DEFAULT.
+    CREATE TABLE ... PARTITION OF в этом случае завершается ошибкой, поэтому секция
+    создается отдельной таблицей, строки переносятся из DEFAULT, затем секция присоединяется.
+    """
+    columns = ", ".join(c.name for c in SensorReading.__table__.columns)
+    params = {"lower": month, "upper": upper}
+    conn.execute(text(f'CREATE TABLE "{name}" (LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    moved = conn.execute(text(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at >= :lower AND created_at < :upper RETURNING {columns}) '
+        f'INSERT INTO "{name}" ({columns}) SELECT {columns} FROM moved'
+    ), params).rowcount
+    conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{name}" {bounds}'))
+    logger.info("Moved %s rows from %s to new partition %s", moved, DEFAULT_PARTITION, name)
+
+
+def ensure_partitions(engine: Engine, months_ahead: int = SENSOR_PARTITION_MONTHS_AHEAD, today: Optional[date] = None) -> List[str]:
+    """
+    Создает секции с текущего месяца на months_ahead месяцев вперед.
+
+    Returns:
+        List[str]: Имена созданных секций.
+    """
+    current = _month_start(today or datetime.utcnow().date())
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            logger.error("%s is not partitioned; run `python -m utils.sensor_partitions migrate`", PARENT_TABLE)
+            return []
+        created = _create_month_partitions(conn, current, _add_months(current, months_ahead))
+    if created:
+        logger.info("Created sensor_readings partitions: %s", ", ".join(created))
+    return created
+
+
+def apply_retention(engine: Engine, retention_months: int = SENSOR_RETENTION_MONTHS, mode: str = SENSOR_RETENTION_MODE, today: Optional[date] = None) -> List[str]:
+    """
+    Отсоединяет или удаляет секции, целиком старше срока хранения.
+    Строки старше срока в секции DEFAULT обрабатываются так же: при detach переносятся
+    в таблицу своего месяца (sensor_readings_yYYYYmMM вне секционированной таблицы),
+    при drop удаляются.
+
+    Args:
+        retention_months (int): Срок хранения в месяцах (0 — ничего не делать).
+        mode (str): "detach" — отсоединить секцию (данные остаются в отдельной таблице),
+            "drop" — удалить секцию.
+
+    Returns:
+        List[str]: Имена обработанных секций.
+    """
+    if retention_months <= 0:
+        return []
+    if mode not in ("detach", "drop"):
+        raise ValueError("mode must be 'detach' or 'drop'")
+
+    cutoff = _add_months(_month_start(today or datetime.utcnow().date()), -retention_months)
+    expired = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        partitions = list_partitions(conn)
+        for name in partitions:
+            match = _PARTITION_RE.match(name)
+            if not match:
+                continue
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if _add_months(month, 1) > cutoff:
+                continue
+            conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"'))
+            if mode == "drop":
+                conn.execute(text(f'DROP TABLE "{name}"'))
+            expired.append(name)
+        if DEFAULT_PARTITION in partitions:
+            expired += _expire_default_rows(conn, cutoff, mode)
+    if expired:
+        logger.info("Retention (%s) applied to sensor_readings partitions: %s", mode, ", ".join(expired))
+    return expired
+
+
+def _expire_default_rows(conn: Connection, cutoff: date, mode: str) -> List[str]:
+    """
+    Обрабатывает строки секции DEFAULT старше cutoff (месяцы без своей секции).
+
+    Returns:
+        List[str]: Таблицы, куда перенесены строки (detach), или DEFAULT_PARTITION (drop).
+    """
+    params = {"cutoff": cutoff}
+    if mode == "drop":
+        deleted = conn.execute(text(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at < :cutoff'), params).rowcount
+        if not deleted:
+            return []
+        logger.info("Deleted %s expired rows from %s", deleted, DEFAULT_PARTITION)
+        return [DEFAULT_PARTITION]
+
+    months = [r[0].date() for r in conn.execute(text(
+        "SELECT DISTINCT date_trunc('month', created_at) "
+        f'FROM "{DEFAULT_PARTITION}" WHERE created_at < :cutoff ORDER BY 1'
+    ), params)]
+    columns = ", ".join(c.name for c in SensorReading.__table__.columns)
+    archived = []
+    for month in months:
+        name = partition_name(month)
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" (LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+        moved = conn.execute(text(
+            f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at >= :lower AND created_at < :upper RETURNING {columns}) '
+            f'INSERT INTO "{name}" ({columns}) SELECT {columns} FROM moved'
+        ), {"lower": month, "upper": _add_months(month, 1)}).rowcount
+        logger.info("Moved %s expired rows from %s to %s", moved, DEFAULT_PARTITION, name)
+        archived.append(name)
+    return archived
+
+
+def migrate_legacy_table(engine: Engine, months_ahead: int = SENSOR_PARTITION_MONTHS_AHEAD) -> bool:
+    """
+    Переводит несекционированную таблицу sensor_readings на секции в одной транзакции.
+    Старая таблица переименовывается в sensor_readings_legacy и остается для проверки;
+    удалить ее можно вручную после сверки данных.
+
+    Returns:
+        bool: True, если миграция выполнена.
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            logger.info("%s is already partitioned", PARENT_TABLE)
+            return False
+
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": PARENT_TABLE}).scalar()
+        today = _month_start(datetime.utcnow().date())
+        if not exists:
+            SensorReading.__table__.create(conn)
+            _create_month_partitions(conn, today, _add_months(today, months_ahead))
+            return True
+
+        conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" RENAME TO "{LEGACY_TABLE}"'))
+        index_names = [r[0] for r in conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :name"), {"name": LEGACY_TABLE}
+        )]
+        for index_name in index_names:
+            conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name[:55]}_legacy"'))
+        conn.execute(text(f'ALTER SEQUENCE IF EXISTS "{PARENT_TABLE}_id_seq" RENAME TO "{LEGACY_TABLE}_id_seq"'))
+
+        SensorReading.__table__.create(conn)
+        bounds = conn.execute(text(f'SELECT min(created_at), max(created_at) FROM "{LEGACY_TABLE}"')).first()
+        first_month = _month_start(bounds[0].date()) if bounds[0] else today
+        last_month = max(_month_start(bounds[1].date()) if bounds[1] else today, today)
+        _create_month_partitions(conn, first_month, _add_months(last_month, months_ahead))
+
+        columns = ", ".join(c.name for c in SensorReading.__table__.columns)
+        conn.execute(text(f'INSERT INTO "{PARENT_TABLE}" ({columns}) SELECT {columns} FROM "{LEGACY_TABLE}"'))
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{PARENT_TABLE}', 'id'), "
+            f'COALESCE((SELECT max(id) FROM "{PARENT_TABLE}"), 0) + 1, false)'
+        ))
+    logger.info("Migrated %s to monthly partitions; old data kept in %s", PARENT_TABLE, LEGACY_TABLE)
+    return True
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Maintenance of sensor_readings monthly partitions")
+    parser.add_argument("command", choices=["ensure", "retention", "maintain", "migrate"])
+    parser.add_argument("--months-ahead", type=int, default=SENSOR_PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--retention-months", type=int, default=SENSOR_RETENTION_MONTHS)
+    parser.add_argument("--mode", choices=["detach", "drop"], default=SENSOR_RETENTION_MODE)
+    args = parser.parse_args(argv)
+
+    from database.database import engine
+
+    if args.command == "migrate":
+        migrate_legacy_table(engine, months_ahead=args.months_ahead)
+    if args.command in ("ensure", "maintain"):
+        ensure_partitions(engine, months_ahead=args.months_ahead)
+    if args.command in ("retention", "maintain"):
+        apply_retention(engine, retention_months=args.retention_months, mode=args.mode)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Sensor Rollups
+--------------
+Почасовые и посуточные агрегаты показаний датчиков (sensor_readings_hourly / _daily).
+
+Агрегаты обновляются инкрементально в той же транзакции, что и запись показаний
+(INSERT ... ON CONFLICT DO UPDATE: сумма и количество складываются, min/max — LEAST/GREATEST).
+История, накопленная до появления агрегатов, пересчитывается один раз при старте
+приложения (ensure_rollups: таблица агрегатов пуста, а показания есть). Пересчет
+вручную (например, после правки данных):
+python -m utils.sensor_rollups rebuild [--device-id N] [--days N]
+
+Время показаний хранится как московское без часового пояса — как и при приеме.
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import pytz
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models.sensor import SensorDevice, SensorReading, SensorReadingHourly, SensorReadingDaily
+
+logger = logging.getLogger("sensor_rollups")
+
+METRICS = ("temperature", "ph", "salinity", "humidity")
+# Ключ advisory lock первичного пересчета (несколько воркеров стартуют одновременно)
+ROLLUP_BACKFILL_LOCK = 7302
+
+# Уровень агрегации -> (модель, единица date_trunc)
+ROLLUP_LEVELS = {
+    "hour": (SensorReadingHourly, "hour"),
+    "day": (SensorReadingDaily, "day"),
+}
+
+# Поля паспорта продукта, которые можно вычислить по агрегатам
+PASSPORT_AVERAGE_FIELDS = {
+    "ph": "Средний pH за время выращивания",
+    "salinity": "Средняя соленость почвы за время выращивания",
+    "temperature": "Средняя температура за время выращивания",
+}
+
+
+def get_moscow_time() -> datetime:
+    return datetime.now(pytz.timezone('Europe/Moscow')).replace(tzinfo=None)
+
+
+def _truncate(value: datetime, unit: str) -> datetime:
+    if unit == "day":
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _aggregate(device_id: int, readings: Iterable[Dict[str, Any]], unit: str) -> List[Dict[str, Any]]:
+    """
+    Агрегирует показания по интервалам в памяти (для инкрементального обновления).
+    """
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    for reading in readings:
+        start = _truncate(reading["created_at"], unit)
+        acc = buckets.get(start)
+        if acc is None:
+            acc = {"device_id": device_id, "bucket_start": start, "readings_count": 0}
+            for name in METRICS:
+                acc.update({f"{name}_sum": None, f"{name}_count": 0, f"{name}_min": None, f"{name}_max": None})
+            buckets[start] = acc
+        acc["readings_count"] += 1
+        for name in METRICS:
+            value = reading.get(name)
+            if value is None:
+                continue
+            acc[f"{name}_sum"] = (acc[f"{name}_sum"] or 0) + value
+            acc[f"{name}_count"] += 1
+            acc[f"{name}_min"] = value if acc[f"{name}_min"] is None else min(acc[f"{name}_min"], value)
+            acc[f"{name}_max"] = value if acc[f"{name}_max"] is None else max(acc[f"{name}_max"], value)
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def _merge_upsert(model):
+    """
+    INSERT ... ON CONFLICT DO UPDATE, прибавляющий новые показания к существующему интервалу.
+    """
+    table = model.__table__
+    stmt = pg_insert(table)
+    excluded = stmt.excluded
+    set_ = {"readings_count": table.c.readings_count + excluded.readings_count}
+    for name in METRICS:
+        set_[f"{name}_sum"] = func.coalesce(table.c[f"{name}_sum"], 0) + func.coalesce(excluded[f"{name}_sum"], 0)
+        set_[f"{name}_count"] = table.c[f"{name}_count"] + excluded[f"{name}_count"]
+        set_[f"{name}_min"] = func.least(table.c[f"{name}_min"], excluded[f"{name}_min"])
+        set_[f"{name}_max"] = func.greatest(table.c[f"{name}_max"], excluded[f"{name}_max"])
+    return stmt.on_conflict_do_update(index_elements=[table.c.device_id, table.c.bucket_start], set_=set_)
+
+
+def apply_readings(db: Session, device_id: int, readings: List[Dict[str, Any]]) -> None:
+    """
+    Добавляет новые показания датчика в почасовые и посуточные агрегаты.
+    Выполняется в транзакции вызывающего кода (без commit).
+
+    Args:
+        db (Session): Сессия базы данных.
+        device_id (int): ID датчика.
+        readings (List[Dict[str, Any]]): Показания (created_at и значения метрик).
+    """
+    if not readings:
+        return
+    for model, unit in ROLLUP_LEVELS.values():
+        rows = _aggregate(device_id, readings, unit)
+        db.execute(_merge_upsert(model), rows)
+
+
+def rebuild_rollups(db: Session, device_id: Optional[int] = None, since: Optional[datetime] = None) -> None:
+    """
+    Пересчитывает агрегаты по сырым показаниям (с заменой существующих интервалов).
+
+    Args:
+        db (Session): Сессия базы данных.
+        device_id (Optional[int]): Ограничить пересчет одним датчиком.
+        since (Optional[datetime]): Пересчитывать начиная с этого момента (выравнивается на начало суток).
+    """
+    for model, unit in ROLLUP_LEVELS.values():
+        table = model.__table__
+        bucket = func.date_trunc(unit, SensorReading.created_at)
+        columns = [SensorReading.device_id, bucket, func.count()]
+        names = ["device_id", "bucket_start", "readings_count"]
+        for name in METRICS:
+            column = getattr(SensorReading, name)
+            columns += [func.sum(column), func.count(column), func.min(column), func.max(column)]
+            names += [f"{name}_sum", f"{name}_count", f"{name}_min", f"{name}_max"]
+
+        query = select(*columns)
+        if device_id is not None:
+            query = query.where(SensorReading.device_id == device_id)
+        if since is not None:
+            query = query.where(SensorReading.created_at >= _truncate(since, "day"))
+        query = query.group_by(SensorReading.device_id, bucket)
+
+        stmt = pg_insert(table).from_select(names, query)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.device_id, table.c.bucket_start],
+            set_={name: stmt.excluded[name] for name in names[2:]},
+        )
+        db.execute(stmt)
+    db.commit()
+
+
+def ensure_rollups(engine: Engine) -> bool:
+    """
+    Однократно заполняет агрегаты по истории, накопленной до их появления:
+    если почасовых агрегатов нет, а показания есть, выполняется полный пересчет.
+
+    Returns:
+        bool: True, если пересчет выполнен.
+    """
+    db = Session(bind=engine)
+    try:
+        db.execute(select(func.pg_advisory_xact_lock(ROLLUP_BACKFILL_LOCK)))
+        if db.execute(select(SensorReadingHourly.device_id).limit(1)).first() is not None:
+            db.commit()
+            return False
+        if db.execute(select(SensorReading.device_id).limit(1)).first() is None:
+            db.commit()
+            return False
+        logger.info("Sensor rollups are empty, rebuilding them from sensor_readings")
+        rebuild_rollups(db)
+        return True
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def first_full_bucket(since: datetime, level: str) -> datetime:
+    """
+    Начало первого интервала уровня level, целиком лежащего после since.
+    """
+    unit = ROLLUP_LEVELS[level][1]
+    start = _truncate(since, unit)
+    if start == since:
+        return start
+    return start + (timedelta(days=1) if unit == "day" else timedelta(hours=1))
+
+
+def read_rollups(db: Session, device_id: int, level: str, since: datetime) -> List[Any]:
+    """
+    Агрегаты датчика выбранного уровня ("hour" / "day"), целиком лежащие после since.
+    Неполный первый интервал [since, first_full_bucket(since)) вызывающий код считает по сырым показаниям.
+    """
+    model, _ = ROLLUP_LEVELS[level]
+    return db.query(model).filter(
+        model.device_id == device_id,
+        model.bucket_start >= first_full_bucket(since, level),
+    ).order_by(model.bucket_start).all()
+
+
+def passport_sensor_averages(db: Session, product_id: int) -> Dict[str, str]:
+    """
+    Средние значения метрик по всем датчикам продукта за все время (по посуточным агрегатам)
+    в формате полей паспорта ("Средний pH за время выращивания" и т.п.).
+    """
+    columns = []
+    for name in PASSPORT_AVERAGE_FIELDS:
+        columns.append(
+            (func.sum(getattr(SensorReadingDaily, f"{name}_sum")) /
+             func.nullif(func.sum(getattr(SensorReadingDaily, f"{name}_count")), 0)).label(name)
+        )
+    row = db.query(*columns).join(
+        SensorDevice, SensorDevice.id == SensorReadingDaily.device_id
+    ).filter(SensorDevice.product_id == product_id).first()
+
+    result = {}
+    if row is None:
+        return result
+    for name, field in PASSPORT_AVERAGE_FIELDS.items():
+        value = row._mapping[name]
+        if value is not None:
+            result[field] = f"{float(value):.2f}"
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Rebuild sensor readings rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--device-id", type=int, default=None)
+    parser.add_argument("--days", type=int, default=None, help="Пересчитать только последние N дней")
+    args = parser.parse_args(argv)
+
+    from database.database import SessionLocal
+
+    since = get_moscow_time() - timedelta(days=args.days) if args.days else None
+    db = SessionLocal()
+    try:
+        rebuild_rollups(db, device_id=args.device_id, since=since)
+    finally:
+        db.close()
+    logger.info("Sensor rollups rebuilt (device_id=%s, since=%s)", args.device_id, since)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()